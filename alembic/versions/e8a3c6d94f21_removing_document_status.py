@@ -0,0 +1,45 @@
+"""removing collection document status
+
+Revision ID: e8a3c6d94f21
+Revises: d5f1b3c72e08
+Create Date: 2026-10-20 00:12:31.540918
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e8a3c6d94f21'
+down_revision: Union[str, Sequence[str], None] = 'd5f1b3c72e08'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # documents unlinked from a collection whose chunks are not deleted from Milvus yet
+    op.get_bind().execute(
+        sa.text(
+            """
+            INSERT INTO collection_document_statuses(name) VALUES (:name)
+            """
+        ),
+        [
+            {"name": "removing"},
+        ]
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.get_bind().execute(
+        sa.text(
+            """
+            DELETE FROM collection_document_statuses WHERE name = :name
+            """
+        ),
+        {"name": "removing"}
+    )
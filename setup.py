@@ -35,6 +35,7 @@ setup(
         "mysqlclient==2.2.7",
         "PyJWT==2.10.1",
         "redis==6.2.0",
+        "msgpack==1.1.0",
         "aiomysql==0.2.0",
         "alembic==1.16.2",
         "fastapi-csrf-protect==1.0.3",
@@ -48,6 +49,8 @@ setup(
         "llama-index-vector-stores-milvus==0.8.7",
         "celery==5.5.3",
         "pymilvus==2.5.10",
+        "pyarrow==20.0.0",
+        "minio==7.2.15",
         "pyrate-limiter==3.9.0",
         "bcrypt==5.0.0",
         "user_agents==2.2.0",
@@ -0,0 +1,75 @@
+import argparse
+import time
+import tracemalloc
+
+from test.chunking_corpus import build_corpus
+from weschatbot.services.document.adaptive_markdown_strategy import AdaptiveMarkdownStrategy
+
+
+def run_once(strategy, content, metadata):
+    tracemalloc.start()
+    start = time.perf_counter()
+    chunks = strategy.chunk_markdown(content, metadata)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return len(chunks), elapsed, peak
+
+
+def benchmark(strategy, corpus, repeat=5):
+    metadata = {"doc_id": "1", "document_name": "bench.md", "file_path": "bench.md"}
+    results = {}
+    for name, content in corpus.items():
+        # warm up the splitters (tokenizer download, regex cache)
+        strategy.chunk_markdown(content, metadata)
+
+        total_chunks, total_time, peak = 0, 0.0, 0
+        for _ in range(repeat):
+            n_chunks, elapsed, run_peak = run_once(strategy, content, metadata)
+            total_chunks += n_chunks
+            total_time += elapsed
+            peak = max(peak, run_peak)
+
+        # timings under tracemalloc are inflated; measure throughput without it
+        start = time.perf_counter()
+        for _ in range(repeat):
+            strategy.chunk_markdown(content, metadata)
+        plain_time = time.perf_counter() - start
+
+        results[name] = {
+            "bytes": len(content),
+            "chunks": total_chunks // repeat,
+            "chunks_per_sec": total_chunks / plain_time if plain_time else 0.0,
+            "mb_per_sec": len(content) * repeat / plain_time / 1e6 if plain_time else 0.0,
+            "peak_alloc_kb": peak / 1024,
+        }
+    return results
+
+
+def print_results(results):
+    print(f"{'corpus':<14}{'bytes':>10}{'chunks':>8}{'chunks/s':>12}{'MB/s':>8}{'peak KB':>10}")
+    for name, r in results.items():
+        print(f"{name:<14}{r['bytes']:>10}{r['chunks']:>8}{r['chunks_per_sec']:>12.1f}"
+              f"{r['mb_per_sec']:>8.2f}{r['peak_alloc_kb']:>10.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark AdaptiveMarkdownStrategy over a synthetic corpus")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--scale", type=int, default=1, help="Concatenate each corpus document N times")
+    parser.add_argument("--legacy", action="store_true", help="Also run the pre single-pass scanner for comparison")
+    args = parser.parse_args()
+
+    corpus = {name: "\n\n".join([content] * args.scale) for name, content in build_corpus().items()}
+
+    print("AdaptiveMarkdownStrategy")
+    print_results(benchmark(AdaptiveMarkdownStrategy(), corpus, repeat=args.repeat))
+
+    if args.legacy:
+        from test.test_adaptive_markdown_strategy import LegacyAdaptiveMarkdownStrategy
+        print("\nLegacyAdaptiveMarkdownStrategy")
+        print_results(benchmark(LegacyAdaptiveMarkdownStrategy(), corpus, repeat=args.repeat))
+
+
+if __name__ == "__main__":
+    main()
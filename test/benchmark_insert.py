@@ -0,0 +1,84 @@
+import argparse
+import time
+
+import numpy as np
+from llama_index.core import Document as LlamaDocument
+from llama_index.core.schema import TextNode
+from llama_index.vector_stores.milvus import MilvusVectorStore
+from pymilvus import Collection, connections, utility
+
+from weschatbot.services.document.columnar_insert import ColumnarInserter, ColumnBatch, collection_schema
+
+
+def make_chunks(rows, dim, text_size):
+    rng = np.random.default_rng(0)
+    chunks = [
+        LlamaDocument(
+            text=("lorem ipsum " * (text_size // 12 + 1))[:text_size],
+            metadata={
+                "doc_id": str(i // 100),
+                "document_name": f"document_{i // 100}.pdf",
+                "file_path": f"/data/document_{i // 100}.pdf",
+                "chunk_index": i % 100,
+                "chunk_hash": f"{i:064x}",
+                "source_doc_ids": [str(i // 100)],
+                "token_count": text_size // 4,
+            },
+        )
+        for i in range(rows)
+    ]
+    embeddings = rng.random((rows, dim), dtype=np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return chunks, embeddings.tolist()
+
+
+def fresh_collection(name, dim):
+    if utility.has_collection(name):
+        utility.drop_collection(name)
+    Collection(name=name, schema=collection_schema(dim))
+
+
+def bench_direct(name, chunks, embeddings):
+    inserter = ColumnarInserter(collection_name=name)
+    start = time.perf_counter()
+    inserter.insert(ColumnBatch.from_chunks(chunks, embeddings))
+    return time.perf_counter() - start
+
+
+def bench_vector_store(name, uri, dim, chunks, embeddings):
+    vector_store = MilvusVectorStore(uri=uri, collection_name=name, dim=dim, overwrite=False, text_key="text")
+    start = time.perf_counter()
+    nodes = [TextNode(text=chunk.text, metadata=chunk.metadata, embedding=embedding)
+             for chunk, embedding in zip(chunks, embeddings)]
+    vector_store.add(nodes)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare direct columnar inserts with MilvusVectorStore.add")
+    parser.add_argument("--uri", default="http://localhost:19530", help="Milvus server, or a milvus-lite .db file")
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--text-size", type=int, default=2000, help="Characters per chunk")
+    args = parser.parse_args()
+
+    connections.connect(alias="default", uri=args.uri)
+    chunks, embeddings = make_chunks(args.rows, args.dim, args.text_size)
+
+    results = {}
+    fresh_collection("bench_insert_direct", args.dim)
+    results["direct"] = bench_direct("bench_insert_direct", chunks, embeddings)
+    fresh_collection("bench_insert_vector_store", args.dim)
+    results["vector_store"] = bench_vector_store("bench_insert_vector_store", args.uri, args.dim,
+                                                 chunks, embeddings)
+
+    print(f"{'path':<16}{'rows':>8}{'seconds':>10}{'rows/s':>10}")
+    for path, elapsed in results.items():
+        print(f"{path:<16}{args.rows:>8}{elapsed:>10.2f}{args.rows / elapsed:>10.0f}")
+
+    for name in ["bench_insert_direct", "bench_insert_vector_store"]:
+        utility.drop_collection(name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+import random
+
+WORDS = (
+    "pump valve pressure maintenance schedule operator manual inspection filter replacement safety "
+    "procedure warranty temperature sensor calibration output flow nominal rated voltage current "
+    "installation warning notice service interval component assembly document revision"
+).split()
+
+
+def _sentence(rnd, min_words=6, max_words=24):
+    words = [rnd.choice(WORDS) for _ in range(rnd.randint(min_words, max_words))]
+    return " ".join(words).capitalize() + "."
+
+
+def _paragraph(rnd, sentences=6):
+    return " ".join(_sentence(rnd) for _ in range(sentences))
+
+
+def _table(rnd, rows, cols=5):
+    header = "| " + " | ".join(f"Column {c}" for c in range(cols)) + " |"
+    separator = "|" + "|".join(["---"] * cols) + "|"
+    body = ["| " + " | ".join(rnd.choice(WORDS) for _ in range(cols)) + " |" for _ in range(rows)]
+    return "\n".join([header, separator, *body])
+
+
+def long_prose(seed=0, sections=12):
+    rnd = random.Random(seed)
+    parts = []
+    for s in range(sections):
+        parts.append(f"## Section {s}")
+        parts.extend(_paragraph(rnd, rnd.randint(4, 12)) for _ in range(rnd.randint(2, 5)))
+    return "\n\n".join(parts)
+
+
+def table_heavy(seed=0, tables=6):
+    rnd = random.Random(seed)
+    parts = ["# Inventory report"]
+    for t in range(tables):
+        parts.append(f"Table {t} lists the {rnd.choice(WORDS)} values.")
+        parts.append(_table(rnd, rows=rnd.choice([5, 40, 250])))
+        parts.append(_sentence(rnd))
+    # a table split by a blank line and a short header-less table
+    parts.append(_table(rnd, rows=3) + "\n\n" + _table(rnd, rows=3).split("\n", 2)[2])
+    parts.append("a | b | c | d\nx | y | z | w")
+    return "\n\n".join(parts)
+
+
+def image_heavy(seed=0, images=40):
+    rnd = random.Random(seed)
+    parts = ["# Illustrated guide"]
+    for i in range(images):
+        parts.append(f"![figure {i}](images/figure_{i}.png)")
+        parts.append(f'<img src="images/photo_{i}.JPG" alt="photo">')
+        parts.append(f"See https://example.com/assets/diagram_{i}.svg for the diagram. " + _sentence(rnd))
+    return "\n\n".join(parts)
+
+
+def mixed(seed=0):
+    return "\n\n".join([long_prose(seed, sections=3), table_heavy(seed, tables=2), image_heavy(seed, images=5)])
+
+
+CORPUS = {
+    "long_prose": long_prose,
+    "table_heavy": table_heavy,
+    "image_heavy": image_heavy,
+    "mixed": mixed,
+}
+
+
+def build_corpus(seed=0):
+    return {name: factory(seed) for name, factory in CORPUS.items()}
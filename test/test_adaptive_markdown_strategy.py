@@ -0,0 +1,161 @@
+import re
+from typing import List, Dict
+
+import pytest
+from llama_index.core import Document as LlamaDocument
+
+from test.chunking_corpus import build_corpus
+from weschatbot.services.document.adaptive_markdown_strategy import AdaptiveMarkdownStrategy
+
+
+class LegacyAdaptiveMarkdownStrategy(AdaptiveMarkdownStrategy):
+    """The per-line regex scanner the single-pass scanner replaced, kept as the reference output."""
+
+    def _remove_images(self, content: str) -> str:
+        patterns = [
+            r'!\[.*?\]\(.*?\.(jpg|jpeg|png|gif|svg|bmp|webp|ico).*?\)',
+            r'<img[^>]*>',
+            r'https?://\S+\.(jpg|jpeg|png|gif|svg|bmp|webp|ico)\b'
+        ]
+        for pattern in patterns:
+            content = re.sub(pattern, '', content, flags=re.IGNORECASE)
+        return content
+
+    def _split_tables_and_text(self, content: str) -> List[Dict]:
+        sections = []
+        lines = content.split('\n')
+        i = 0
+
+        while i < len(lines):
+            if self._is_table_line(lines[i]):
+                section, i = self._extract_table_section(lines, i)
+            else:
+                section, i = self._extract_text_section(lines, i)
+
+            if section['content'].strip():
+                sections.append(section)
+
+        return sections
+
+    def _is_table_line(self, line: str) -> bool:
+        return '|' in line and line.count('|') >= 3
+
+    def _is_table_separator(self, line: str) -> bool:
+        return bool(re.match(r'^\s*\|?[\s\-:|]+\|[\s\-:|]*$', line))
+
+    def _extract_table_section(self, lines: List[str], start: int, *args) -> tuple:
+        ctx_before = [
+            lines[j] for j in range(max(0, start - self.table_context_lines_before), start)
+            if lines[j].strip() and not self._is_table_line(lines[j])
+        ]
+
+        table_lines = []
+        header = None
+        i = start
+
+        while i < len(lines):
+            if self._is_table_line(lines[i]):
+                table_lines.append(lines[i])
+                if not header and i + 1 < len(lines) and self._is_table_separator(lines[i + 1]):
+                    header = [lines[i], lines[i + 1]]
+                i += 1
+            elif not lines[i].strip() and i + 1 < len(lines) and self._is_table_line(lines[i + 1]):
+                i += 1
+            else:
+                i += 1
+                break
+
+        ctx_after = [
+            lines[j] for j in range(i, min(i + self.table_context_lines_after, len(lines)))
+            if lines[j].strip() and not self._is_table_line(lines[j])
+        ]
+
+        return {
+            'type': 'table',
+            'content': '\n'.join(table_lines),
+            'header': header,
+            'row_count': sum(1 for d in table_lines if d.strip() and not self._is_table_separator(d)),
+            'context_before': '\n'.join(ctx_before[-self.table_context_lines_before:]),
+            'context_after': '\n'.join(ctx_after[:self.table_context_lines_after])
+        }, i
+
+    def _extract_text_section(self, lines: List[str], start: int, *args) -> tuple:
+        text_lines = []
+        i = start
+        while i < len(lines) and not self._is_table_line(lines[i]):
+            text_lines.append(lines[i])
+            i += 1
+        return {'type': 'text', 'content': '\n'.join(text_lines)}, i
+
+    def _merge_and_split_chunks(self, chunks: List[LlamaDocument]) -> List[LlamaDocument]:
+        if not chunks:
+            return chunks
+
+        merged = []
+        i = 0
+
+        while i < len(chunks):
+            current = chunks[i]
+            word_count = len(current.text.split())
+            if word_count < self.min_words_per_chunk and i + 1 < len(chunks):
+                next_chunk = chunks[i + 1]
+                combined_text = f"{current.text}\n\n{next_chunk.text}"
+
+                if len(combined_text) <= self.max_chunk_size:
+                    merged.append(LlamaDocument(text=combined_text, metadata={**next_chunk.metadata}))
+                    i += 2
+                    continue
+                else:
+                    doc = LlamaDocument(text=combined_text, metadata=current.metadata)
+                    split_nodes = self.sentence_splitter.get_nodes_from_documents([doc])
+                    for node in split_nodes:
+                        merged.append(LlamaDocument(text=node.text, metadata={**current.metadata}))
+                    i += 2
+                    continue
+
+            if len(current.text) > self.max_chunk_size:
+                doc = LlamaDocument(text=current.text, metadata=current.metadata)
+                split_nodes = self.sentence_splitter.get_nodes_from_documents([doc])
+                for node in split_nodes:
+                    merged.append(LlamaDocument(text=node.text, metadata={**current.metadata}))
+                i += 1
+                continue
+
+            merged.append(current)
+            i += 1
+
+        return merged
+
+
+EDGE_CASES = [
+    "",
+    "\n\n\n",
+    "| a | b |\n|---|---|\n| 1 | 2 |",
+    "---|---\n| a | b | c |\n| 1 | 2 | 3 |",
+    "intro\n| a | b | c |\n\n\n| 1 | 2 | 3 |\ntrailing line\nafter",
+    "| a | b | c |\n   \n| 1 | 2 | 3 |\n  |  :--- | ---: |\n",
+    "![x](a.PNG) <IMG src='b'> http://h/c.webp text ![not an image](doc.pdf)",
+]
+
+
+def chunk_pairs(strategy, content):
+    return [(c.text, c.metadata) for c in strategy.chunk_markdown(content, {"doc_id": "1", "file_path": "a.md"})]
+
+
+@pytest.mark.parametrize("name,content", sorted(build_corpus().items()))
+def test_single_pass_scanner_matches_legacy_chunks(name, content):
+    assert chunk_pairs(AdaptiveMarkdownStrategy(), content) == chunk_pairs(LegacyAdaptiveMarkdownStrategy(), content)
+
+
+@pytest.mark.parametrize("content", EDGE_CASES)
+def test_single_pass_scanner_matches_legacy_sections(content):
+    new, legacy = AdaptiveMarkdownStrategy(), LegacyAdaptiveMarkdownStrategy()
+    assert new._remove_images(content) == legacy._remove_images(content)
+    assert new._split_tables_and_text(content) == legacy._split_tables_and_text(content)
+    assert chunk_pairs(new, content) == chunk_pairs(legacy, content)
+
+
+def test_has_fewer_words():
+    for text in ["", "a", "a b ", "  a  b  c  ", "a b c d e f"]:
+        for limit in range(0, 7):
+            assert AdaptiveMarkdownStrategy._has_fewer_words(text, limit) == (len(text.split()) < limit)
@@ -0,0 +1,61 @@
+import json
+
+import pyarrow.parquet as pq
+from llama_index.core import Document as LlamaDocument
+from pymilvus import DataType, FieldSchema
+
+from weschatbot.services.document.bulk_import import DYNAMIC_FIELD, ParquetChunkWriter
+from weschatbot.services.document.columnar_insert import BOOKKEEPING_FIELDS, ColumnBatch, collection_schema
+
+
+def make_batch(n, start=0):
+    chunks = [
+        LlamaDocument(
+            text=f"chunk {i}",
+            metadata={"doc_id": "3", "document_name": "a.pdf", "file_path": "/data/a.pdf", "chunk_index": i,
+                      "chunk_hash": f"{i:064x}", "source_doc_ids": ["3", "4"]},
+        )
+        for i in range(start, start + n)
+    ]
+    return ColumnBatch.from_chunks(chunks, [[float(i), 1.0] for i in range(start, start + n)])
+
+
+def read(files):
+    return [row for path in files for row in pq.read_table(str(path)).to_pylist()]
+
+
+def test_writer_rolls_files_and_matches_schema(tmp_path):
+    schema = collection_schema(dim=2)
+    writer = ParquetChunkWriter(schema.fields, str(tmp_path), max_rows_per_file=4)
+    first = make_batch(3)
+    first_ids = first.column("row_id")
+    writer.write(first)
+    writer.write(make_batch(3, start=3))
+    writer.close()
+
+    assert writer.rows == 6
+    assert [len(pq.read_table(str(path))) for path in writer.files] == [4, 2]
+    rows = read(writer.files)
+    assert rows[0]["row_id"] == first_ids[0]
+    assert [row["chunk_index"] for row in rows] == list(range(6))
+    assert rows[5]["embedding"] == [5.0, 1.0]
+    # JSON fields are imported from strings, missing values stay null
+    assert json.loads(rows[0]["source_doc_ids"]) == ["3", "4"]
+    assert rows[0]["created_at"] is None
+    assert json.loads(rows[0][DYNAMIC_FIELD]) == {}
+
+
+def test_undeclared_columns_go_to_dynamic_field(tmp_path):
+    # collections created before the bookkeeping fields were declared, with generated row ids
+    fields = [FieldSchema(name="row_id", dtype=DataType.INT64, is_primary=True, auto_id=True)]
+    fields.extend(field for field in collection_schema(dim=2).fields
+                  if field.name != "row_id" and field.name not in BOOKKEEPING_FIELDS)
+    writer = ParquetChunkWriter(fields, str(tmp_path))
+    writer.write(make_batch(2))
+    writer.close()
+
+    rows = read(writer.files)
+    assert "chunk_hash" not in rows[0]
+    assert "row_id" not in rows[0]
+    assert json.loads(rows[1][DYNAMIC_FIELD]) == {"chunk_index": 1, "chunk_hash": f"{1:064x}",
+                                                  "source_doc_ids": ["3", "4"]}
@@ -0,0 +1,344 @@
+import pickle
+from types import SimpleNamespace
+
+import pytest
+
+from weschatbot.schemas.chat import Message
+from weschatbot.services.chat_history import ChatHistory, estimate_tokens, make_turn, pack_message, pack_turn, \
+    truncate_message, unpack_message, unpack_turn
+
+
+class FakeRedis:
+    """The Redis commands used by ChatHistory, on a dict, with expiries on a manual clock."""
+
+    def __init__(self):
+        self.data = {}
+        self.expires = {}
+        self.now = 0
+        self.calls = []
+
+    def advance(self, seconds):
+        self.now += seconds
+        for key in [k for k, at in self.expires.items() if at <= self.now]:
+            self.data.pop(key, None)
+            del self.expires[key]
+
+    def ttl(self, key):
+        return self.expires[key] - self.now if key in self.expires else -1
+
+    def _call(self, name, *args):
+        self.calls.append((name,) + args)
+
+    def exists(self, key):
+        self._call("exists", key)
+        return int(key in self.data)
+
+    def get(self, key):
+        self._call("get", key)
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self._call("set", key)
+        self.data[key] = value
+        self.expires.pop(key, None)
+        if ex:
+            self.expires[key] = self.now + ex
+
+    def delete(self, *keys):
+        self._call("delete", *keys)
+        for key in keys:
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+
+    def expire(self, key, seconds):
+        self._call("expire", key)
+        if key not in self.data:
+            return 0
+        self.expires[key] = self.now + seconds
+        return 1
+
+    def llen(self, key):
+        return len(self.data.get(key, []))
+
+    def rpush(self, key, *values):
+        self._call("rpush", key)
+        self.data.setdefault(key, []).extend(values)
+        return len(self.data[key])
+
+    def rpushx(self, key, *values):
+        self._call("rpushx", key)
+        if key not in self.data:
+            return 0
+        return self.rpush(key, *values)
+
+    def lrange(self, key, start, end):
+        self._call("lrange", key, start, end)
+        entries = self.data.get(key, [])
+        start = max(start + len(entries) if start < 0 else start, 0)
+        end = end + len(entries) if end < 0 else end
+        return entries[start:end + 1] if end >= 0 else []
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    """Queues commands until ``execute``, except between ``watch`` and ``multi`` like redis-py."""
+
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+        self.immediate = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.reset()
+
+    def watch(self, *keys):
+        self.immediate = True
+
+    def multi(self):
+        self.immediate = False
+
+    def reset(self):
+        self.commands = []
+        self.immediate = False
+
+    def execute(self):
+        commands, self.commands = self.commands, []
+        return [getattr(self.client, name)(*args, **kwargs) for name, args, kwargs in commands]
+
+    def __getattr__(self, name):
+        def command(*args, **kwargs):
+            if self.immediate:
+                return getattr(self.client, name)(*args, **kwargs)
+            self.commands.append((name, args, kwargs))
+            return self
+        return command
+
+
+def history_of(texts, ttl=100):
+    """A ChatHistory over a fake Redis holding the messages ``texts`` of chat "c"."""
+    history = ChatHistory(ttl=ttl)
+    redis_client = FakeRedis()
+    messages = [Message(sender="user", receiver="bot", message=text) for text in texts]
+    history.append("c", messages, redis_client=redis_client)
+    redis_client.calls.clear()
+    return history, redis_client
+
+
+def reads(redis_client):
+    return [call[2:] for call in redis_client.calls if call[0] == "lrange"]
+
+
+def test_entries_round_trip():
+    message = Message(sender="user", receiver="bot", message="Xin chào 👋")
+
+    restored = unpack_message(pack_message(message))
+
+    assert restored.to_dict() == message.to_dict()
+
+
+def test_entries_are_smaller_than_pickles():
+    message = Message(sender="bot", receiver="user", message="ok")
+
+    assert len(pack_message(message)) < len(pickle.dumps(message))
+
+
+def test_token_estimate_grows_with_the_message():
+    assert estimate_tokens("") == 1
+    assert estimate_tokens("a" * 400) == 101
+
+
+def test_turns_round_trip():
+    messages = [
+        Message(sender="user", receiver="bot", message="Hỏi"),
+        Message(sender="bot", receiver="user", message="Đáp"),
+    ]
+    # a QueryResult
+    result = SimpleNamespace(document_id=14, row_id=461234567890123456, document_text="chunk", cosine_score=0.5,
+                             rank=0, collection_id=3, collection_name="kb")
+
+    turn = unpack_turn(pack_turn(make_turn(7, "chat", messages, [result])))
+
+    assert turn["user_id"] == 7
+    assert turn["messages"] == [["user", "bot", "Hỏi"], ["bot", "user", "Đáp"]]
+    assert turn["queries"] == [[14, 461234567890123456, "chunk", 0.5, 0, 3]]
+
+
+def test_turns_record_their_submission_order():
+    first = make_turn(7, "chat", [Message(sender="user", receiver="bot", message="1")])
+    second = make_turn(7, "chat", [Message(sender="user", receiver="bot", message="2")])
+
+    assert first["id"] != second["id"]
+    assert first["submitted_at"] <= second["submitted_at"]
+    assert unpack_turn(pack_turn(second))["submitted_at"] == second["submitted_at"]
+
+
+def test_truncated_message_fits_the_budget():
+    message = Message(sender="bot", receiver="user", message="a" * 10000)
+
+    truncated = truncate_message(message, 100)
+
+    assert estimate_tokens(truncated.message) == 100
+    assert truncated.sender == "bot" and message.message.startswith(truncated.message)
+
+
+@pytest.mark.parametrize("count, pages", [(7, [(-8, -1)]), (8, [(-8, -1), (-16, -9)]), (9, [(-8, -1), (-16, -9)])])
+def test_window_reads_whole_pages(count, pages):
+    texts = [str(i) for i in range(count)]
+    history, redis_client = history_of(texts)
+
+    window = history.window("c", max_tokens=1000, page_size=8, redis_client=redis_client)
+
+    assert [m.message for m in window] == texts
+    assert reads(redis_client) == pages
+
+
+def test_window_budget_cuts_mid_history():
+    # 40 characters are 11 estimated tokens
+    texts = [str(i) * 40 for i in range(10)]
+    history, redis_client = history_of(texts)
+
+    window = history.window("c", max_tokens=35, page_size=8, redis_client=redis_client)
+
+    assert [m.message for m in window] == texts[-3:]
+    assert reads(redis_client) == [(-8, -1)]
+
+
+def test_window_budget_cuts_on_a_later_page():
+    texts = [str(i % 10) * 40 for i in range(12)]
+    history, redis_client = history_of(texts)
+
+    window = history.window("c", max_tokens=11 * 10, page_size=8, redis_client=redis_client)
+
+    assert [m.message for m in window] == texts[-10:]
+    assert reads(redis_client) == [(-8, -1), (-16, -9)]
+
+
+def test_window_stops_at_the_message_cap():
+    texts = [str(i) for i in range(20)]
+    history, redis_client = history_of(texts)
+
+    window = history.window("c", max_messages=5, max_tokens=1000, page_size=8, redis_client=redis_client)
+
+    assert [m.message for m in window] == texts[-5:]
+    assert reads(redis_client) == [(-8, -1)]
+
+
+def test_window_keeps_the_last_message_truncated():
+    texts = ["short", "a" * 400]
+    history, redis_client = history_of(texts)
+
+    window = history.window("c", max_tokens=50, page_size=8, redis_client=redis_client)
+
+    assert len(window) == 1
+    assert estimate_tokens(window[0].message) == 50
+    assert texts[-1].startswith(window[0].message)
+
+
+def test_window_keeps_the_last_message_when_it_fits_alone():
+    texts = ["a" * 400, "b" * 36]
+    history, redis_client = history_of(texts)
+
+    window = history.window("c", max_tokens=10, page_size=8, redis_client=redis_client)
+
+    assert [m.message for m in window] == [texts[-1]]
+
+
+def test_tail_returns_the_last_messages():
+    texts = [str(i) for i in range(9)]
+    history, redis_client = history_of(texts)
+
+    assert [m.message for m in history.tail("c", 3, redis_client=redis_client)] == texts[-3:]
+    assert [m.message for m in history.tail("c", redis_client=redis_client)] == texts
+    assert history.tail("c", 0, redis_client=redis_client) == []
+    assert [m.message for m in history.window("c", 4, redis_client=redis_client)] == texts[-4:]
+
+
+class CountingLoader:
+    """Loads the history of a chat from the "database", counting the calls."""
+
+    def __init__(self, *texts):
+        self.messages = [Message(sender="user", receiver="bot", message=text) for text in texts]
+        self.calls = 0
+
+    def __call__(self, chat_id):
+        self.calls += 1
+        return list(self.messages)
+
+
+def test_reads_and_writes_restart_the_expiry():
+    history, redis_client = history_of(["1"], ttl=100)
+
+    redis_client.advance(80)
+    history.tail("c", redis_client=redis_client)
+    assert redis_client.ttl("chat:c:messages") == 100
+    redis_client.advance(80)
+    history.window("c", max_tokens=1000, redis_client=redis_client)
+    redis_client.advance(80)
+    history.append("c", [Message(sender="bot", receiver="user", message="2")], redis_client=redis_client)
+    redis_client.advance(80)
+
+    assert [m.message for m in history.tail("c", redis_client=redis_client)] == ["1", "2"]
+    redis_client.advance(100)
+    assert "chat:c:messages" not in redis_client.data
+
+
+def test_new_chat_is_never_loaded():
+    loader = CountingLoader("from the database")
+    history = ChatHistory(ttl=100, loader=loader)
+    redis_client = FakeRedis()
+
+    history.create("c", redis_client=redis_client)
+
+    assert history.tail("c", redis_client=redis_client) == []
+    assert history.window("c", max_tokens=1000, redis_client=redis_client) == []
+    history.append("c", [Message(sender="user", receiver="bot", message="hi")], redis_client=redis_client)
+    assert [m.message for m in history.tail("c", redis_client=redis_client)] == ["hi"]
+    assert loader.calls == 0
+    assert "chat:c:empty" not in redis_client.data
+
+
+def test_legacy_pickle_is_converted_to_a_list():
+    loader = CountingLoader("from the database")
+    history = ChatHistory(ttl=100, loader=loader)
+    redis_client = FakeRedis()
+    redis_client.set("ss_c", pickle.dumps([Message(sender="user", receiver="bot", message="q"),
+                                           Message(sender="bot", receiver="user", message="a")]))
+
+    assert [m.message for m in history.tail("c", redis_client=redis_client)] == ["q", "a"]
+    assert "ss_c" not in redis_client.data
+    assert [unpack_message(x).message for x in redis_client.data["chat:c:messages"]] == ["q", "a"]
+    assert redis_client.ttl("chat:c:messages") == 100
+    assert loader.calls == 0
+
+
+def test_expired_chat_is_loaded_once():
+    loader = CountingLoader("q", "a")
+    history = ChatHistory(ttl=100, loader=loader)
+    redis_client = FakeRedis()
+    history.append("c", loader.messages, redis_client=redis_client)
+    loader.calls = 0
+
+    redis_client.advance(100)
+
+    assert [m.message for m in history.tail("c", redis_client=redis_client)] == ["q", "a"]
+    assert [m.message for m in history.window("c", max_tokens=1000, redis_client=redis_client)] == ["q", "a"]
+    assert [m.message for m in history.tail("c", 1, redis_client=redis_client)] == ["a"]
+    assert loader.calls == 1
+
+
+def test_append_to_a_missing_chat_loads_it_first():
+    loader = CountingLoader("q", "a")
+    history = ChatHistory(ttl=100, loader=loader)
+    redis_client = FakeRedis()
+
+    length = history.append("c", [Message(sender="user", receiver="bot", message="q2")], redis_client=redis_client)
+
+    assert length == 3
+    assert [m.message for m in history.tail("c", redis_client=redis_client)] == ["q", "a", "q2"]
+    assert loader.calls == 1
+    assert redis_client.ttl("chat:c:messages") == 100
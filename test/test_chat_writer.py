@@ -0,0 +1,35 @@
+import pytest
+from redis.exceptions import ConnectionError as RedisConnectionError
+
+from weschatbot.schemas.chat import Message
+
+# the writer persists through the MySQL session factory
+pytest.importorskip("MySQLdb")
+
+from weschatbot.services import chat_writer  # noqa: E402
+from weschatbot.services.chat_writer import ChatTurnWriter  # noqa: E402
+
+
+class RedisDown:
+    def __getattr__(self, name):
+        def command(*args, **kwargs):
+            raise RedisConnectionError("Connection refused")
+        return command
+
+
+def test_turn_is_written_synchronously_when_redis_is_down(monkeypatch):
+    monkeypatch.setattr(chat_writer, "get_redis_client", lambda db: RedisDown())
+    writer = ChatTurnWriter(batch_size=10, interval=1, claim_idle=60, failed_alert_interval=0)
+    persisted = []
+
+    def persist(turns):
+        persisted.extend(turns)
+        return {turn["id"]: [(1, "user"), (2, "bot")] for turn in turns}
+
+    monkeypatch.setattr(writer, "persist", persist)
+
+    turn_id = writer.submit(7, "chat", [Message(sender="user", receiver="bot", message="q"),
+                                        Message(sender="bot", receiver="user", message="a")])
+
+    assert [turn["id"] for turn in persisted] == [turn_id]
+    assert persisted[0]["messages"] == [["user", "bot", "q"], ["bot", "user", "a"]]
@@ -0,0 +1,74 @@
+from llama_index.core import Document as LlamaDocument
+
+from weschatbot.services.document.chunk_diff import ChunkDiff, chunk_hash, chunk_id, merge_changes
+
+
+def make_chunks(doc_id, *texts):
+    return [LlamaDocument(text=t, metadata={"doc_id": doc_id, "chunk_hash": chunk_hash(t)}) for t in texts]
+
+
+def row(row_id, doc_id, text=None, sources=None, file_path="a.pdf"):
+    res = {"row_id": row_id, "doc_id": doc_id, "file_path": file_path,
+           "chunk_hash": chunk_hash(text) if text is not None else None}
+    if sources is not None:
+        res["source_doc_ids"] = sources
+    return res
+
+
+def test_only_edited_chunks_are_inserted_and_vanished_deleted():
+    chunks = {"1": make_chunks("1", "intro", "edited body", "outro")}
+    stored = [row(10, "1", "intro"), row(11, "1", "old body"), row(12, "1", "outro")]
+
+    diff = ChunkDiff.compute(chunks, {"1": "a.pdf"}, stored)
+
+    assert [c.text for c in diff.to_insert] == ["edited body"]
+    assert diff.to_delete == [11]
+    assert diff.to_rewrite == {}
+    assert diff.unchanged == 2
+
+
+def test_shared_chunks_keep_other_sources():
+    chunks = {"1": make_chunks("1", "body")}
+    stored = [row(10, "1", "footer", sources=["1", "2"]), row(11, "2", "legal", sources=["2", "1"]),
+              row(12, "1", "body", sources=["1"])]
+
+    diff = ChunkDiff.compute(chunks, {"1": "a.pdf"}, stored)
+
+    assert diff.to_insert == []
+    assert diff.to_delete == []
+    assert diff.to_rewrite == {10: ("2", ["2"]), 11: ("2", ["2"])}
+
+
+def test_rows_without_hash_are_replaced():
+    chunks = {"1": make_chunks("1", "body")}
+    stored = [row(10, "uuid-from-llama-index", None, file_path="a.pdf"), row(11, "other", None, file_path="b.pdf")]
+
+    diff = ChunkDiff.compute(chunks, {"1": "a.pdf"}, stored)
+
+    assert [c.text for c in diff.to_insert] == ["body"]
+    assert diff.to_delete == [10]
+
+
+def test_chunk_id_is_deterministic():
+    first = chunk_id("7", 3, chunk_hash("some text"))
+
+    assert first == chunk_id("7", 3, chunk_hash("some text"))
+    assert 0 < first < 2 ** 63
+    assert first != chunk_id("8", 3, chunk_hash("some text"))
+    assert first != chunk_id("7", 4, chunk_hash("some text"))
+    assert first != chunk_id("7", 3, chunk_hash("other text"))
+
+
+def test_held_back_changes_keep_only_common_sources():
+    stored = [row(10, "1", "footer", sources=["1", "2", "3"]), row(11, "2", "legal", sources=["2", "3"]),
+              row(12, "1", "body", sources=["1"])]
+    first = ChunkDiff.compute({"1": make_chunks("1", "intro")}, {"1": "a.pdf"}, stored)
+    second = ChunkDiff.compute({"2": make_chunks("2", "intro")}, {"2": "b.pdf"}, stored)
+    third = ChunkDiff.compute({"3": make_chunks("3", "footer")}, {"3": "c.pdf"}, stored)
+
+    to_delete, to_rewrite = [], {}
+    for diff in (first, second, third):
+        merge_changes(to_delete, to_rewrite, diff)
+
+    assert to_delete == [12, 11]
+    assert to_rewrite == {10: ("3", ["3"])}
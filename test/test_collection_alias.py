@@ -0,0 +1,42 @@
+import pytest
+from pymilvus import Collection, connections, utility
+
+from weschatbot.services.document.collection_alias import CollectionAlias, generation_name
+from weschatbot.services.document.columnar_insert import collection_schema
+
+
+@pytest.fixture
+def legacy(tmp_path):
+    # milvus-lite, installed with pymilvus
+    connections.connect(alias="default", uri=str(tmp_path / "milvus.db"))
+    Collection("kb", schema=collection_schema(8))
+    yield CollectionAlias("kb")
+    connections.disconnect("default")
+
+
+def test_first_swap_retires_the_legacy_collection(legacy):
+    assert legacy.target() == "kb"
+    Collection(generation_name("kb", 1), schema=collection_schema(8))
+
+    assert legacy.swap("kb__g1") == "kb__g0"
+    assert legacy.target() == "kb__g1"
+    assert utility.has_collection("kb__g0")
+
+
+def test_swap_back_and_drop(legacy):
+    Collection("kb__g1", schema=collection_schema(8))
+    legacy.swap("kb__g1")
+    Collection("kb__g2", schema=collection_schema(8))
+
+    assert legacy.swap("kb__g2") == "kb__g1"
+    # rollback
+    assert legacy.swap("kb__g1") == "kb__g2"
+    assert legacy.target() == "kb__g1"
+
+    with pytest.raises(ValueError):
+        legacy.drop("kb__g1")
+    legacy.drop("kb__g2")
+    assert not utility.has_collection("kb__g2")
+    legacy.drop()
+    assert legacy.target() is None
+    assert not utility.has_collection("kb__g1")
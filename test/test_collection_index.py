@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+from llama_index.core import Document as LlamaDocument
+from pymilvus import Collection, connections, utility
+
+from weschatbot.services.document.collection_index import CollectionIndexBuilder, vector_index_params
+from weschatbot.services.document.columnar_insert import ColumnarInserter, ColumnBatch, collection_schema
+
+DIM = 8
+
+
+@pytest.fixture
+def collection(tmp_path):
+    # milvus-lite, installed with pymilvus
+    connections.connect(alias="default", uri=str(tmp_path / "milvus.db"))
+    collection = Collection("finalize_test", schema=collection_schema(DIM))
+    chunks = [LlamaDocument(text=f"chunk {i}", metadata={"doc_id": str(i // 10), "chunk_index": i % 10})
+              for i in range(200)]
+    embeddings = np.random.default_rng(0).random((200, DIM), dtype=np.float32)
+    ColumnarInserter("finalize_test").insert(ColumnBatch.from_chunks(chunks, embeddings.tolist()))
+    yield collection
+    utility.drop_collection("finalize_test")
+    connections.disconnect("default")
+
+
+def test_finalize_builds_the_index_once_and_loads(collection):
+    assert not collection.has_index()
+    steps = []
+    builder = CollectionIndexBuilder("finalize_test", poll_interval=0.1, timeout=60)
+
+    durations = builder.finalize(progress=lambda step, percent, detail: steps.append((step, percent)))
+
+    assert list(durations) == ["flush", "compact", "index", "load"]
+    assert collection.has_index()
+    assert ("index", 100) in steps and ("load", 100) in steps
+    assert collection.query("row_id >= 0", output_fields=["count(*)"])[0]["count(*)"] == 200
+
+
+def test_drop_index_defers_the_build_to_finalize(collection):
+    builder = CollectionIndexBuilder("finalize_test", compact=False, poll_interval=0.1, timeout=60)
+    builder.finalize()
+
+    builder.drop_index()
+    assert not collection.has_index()
+
+    assert list(builder.finalize()) == ["flush", "index", "load"]
+    assert collection.has_index()
+
+
+def test_incremental_finalize_skips_compaction_and_index_wait(collection):
+    builder = CollectionIndexBuilder("finalize_test", compact_min_rows=1000, poll_interval=0.1, timeout=60)
+    builder.finalize()
+
+    assert list(builder.finalize(rows_written=20)) == ["flush"]
+    assert "compact" in builder.finalize(rows_written=1000)
+
+
+def test_nlist_grows_with_the_row_count():
+    assert vector_index_params(0)["params"]["nlist"] == 128
+    assert vector_index_params(1_000_000)["params"]["nlist"] == 4000
+    assert vector_index_params(10 ** 12)["params"]["nlist"] == 65536
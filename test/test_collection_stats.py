@@ -0,0 +1,68 @@
+import json
+
+import numpy as np
+import pytest
+from llama_index.core import Document as LlamaDocument
+from pymilvus import Collection, CollectionSchema, DataType, FieldSchema, connections, utility
+
+from weschatbot.schemas.collection import CollectionDesc
+from weschatbot.services.collection_stats import collect_stats, collect_token_counts
+from weschatbot.services.document.collection_index import CollectionIndexBuilder
+from weschatbot.services.document.columnar_insert import ColumnarInserter, ColumnBatch, collection_schema
+
+DIM = 8
+
+
+@pytest.fixture
+def collection(tmp_path):
+    # milvus-lite, installed with pymilvus
+    connections.connect(alias="default", uri=str(tmp_path / "milvus.db"))
+    collection = Collection("stats_test", schema=collection_schema(DIM))
+    chunks = [LlamaDocument(text=f"chunk {i}", metadata={"doc_id": "1", "chunk_index": i}) for i in range(30)]
+    embeddings = np.random.default_rng(0).random((30, DIM), dtype=np.float32)
+    ColumnarInserter("stats_test").insert(ColumnBatch.from_chunks(chunks, embeddings.tolist()))
+    yield collection
+    utility.drop_collection("stats_test")
+    connections.disconnect("default")
+
+
+def test_snapshot_round_trips_through_json(collection):
+    CollectionIndexBuilder("stats_test", compact=False, poll_interval=0.1, timeout=60).finalize()
+
+    stats = json.loads(json.dumps(collect_stats("stats_test")))
+    desc = CollectionDesc.from_stats(3, stats, status="done").to_dict()
+
+    assert desc["num_entities"] == 30
+    assert desc["indexes"][0]["params"]["index_type"] == "IVF_FLAT"
+    assert "embedding" in [field["name"] for field in desc["fields"]]
+    assert desc["stats"]["total_rows"] == 30
+    assert desc["stats"]["updated_at"] == stats["updated_at"]
+
+
+def test_rows_without_token_count_are_legacy(collection):
+    chunks = [LlamaDocument(text=f"counted {i}", metadata={"doc_id": "2", "chunk_index": i, "token_count": 100 * i})
+              for i in range(1, 4)]
+    embeddings = np.random.default_rng(1).random((3, DIM), dtype=np.float32)
+    ColumnarInserter("stats_test").insert(ColumnBatch.from_chunks(chunks, embeddings.tolist()))
+    CollectionIndexBuilder("stats_test", compact=False, poll_interval=0.1, timeout=60).ensure_loaded()
+
+    token_counts, legacy = collect_token_counts(collection, batch_size=2)
+
+    assert sorted(token_counts) == [100, 200, 300]
+    assert legacy == 30
+
+
+def test_collections_without_token_count_field_only_have_legacy_rows(collection):
+    schema = CollectionSchema([FieldSchema(name="row_id", dtype=DataType.INT64, is_primary=True, auto_id=True),
+                               FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=DIM)],
+                              enable_dynamic_field=True)
+    legacy_collection = Collection("stats_legacy", schema=schema)
+    try:
+        # a count in the dynamic field is not read
+        legacy_collection.insert([{"embedding": [0.1] * DIM, "token_count": 5}, {"embedding": [0.2] * DIM}])
+        legacy_collection.create_index("embedding", {"index_type": "FLAT", "metric_type": "L2", "params": {}})
+        legacy_collection.load()
+
+        assert collect_token_counts(legacy_collection) == ([], 2)
+    finally:
+        utility.drop_collection("stats_legacy")
@@ -0,0 +1,63 @@
+import numpy as np
+from llama_index.core import Document as LlamaDocument
+
+from weschatbot.services.document.chunk_diff import chunk_id
+from weschatbot.services.document.columnar_insert import BOOKKEEPING_FIELDS, CHUNK_FIELDS, ColumnBatch
+
+
+def make_chunks(n):
+    return [
+        LlamaDocument(
+            text=f"chunk {i}",
+            metadata={
+                "doc_id": "7",
+                "document_name": "report.pdf",
+                "file_path": "/data/report.pdf",
+                "modified_date": "2025-01-01",
+                "chunk_index": i,
+                "chunk_hash": f"{i:064x}",
+                "source_doc_ids": ["7"],
+                "token_count": 3,
+            },
+        )
+        for i in range(n)
+    ]
+
+
+def test_from_chunks_builds_one_column_per_field():
+    batch = ColumnBatch.from_chunks(make_chunks(3), [[0.1, 0.2]] * 3)
+
+    assert len(batch) == 3
+    for name in ["row_id"] + CHUNK_FIELDS + BOOKKEEPING_FIELDS:
+        assert len(batch.column(name)) == 3
+    assert batch.embeddings.dtype == np.float32
+    assert batch.embeddings.shape == (3, 2)
+    assert batch.column("doc_id") == ["7", "7", "7"]
+    assert batch.column("chunk_index") == [0, 1, 2]
+    assert batch.column("row_id") == [chunk_id("7", i, f"{i:064x}") for i in range(3)]
+    assert batch.column("source_doc_ids") == [["7"]] * 3
+    # missing metadata is left to the nullable fields
+    assert batch.column("created_at") == [None] * 3
+    assert batch.column("simhash") == [None] * 3
+
+
+def test_slice_keeps_columns_aligned():
+    batch = ColumnBatch.from_chunks(make_chunks(5), [[float(i), 0.0] for i in range(5)])
+    part = batch.slice(1, 3)
+
+    assert len(part) == 2
+    assert part.column("text") == ["chunk 1", "chunk 2"]
+    assert part.embeddings[:, 0].tolist() == [1.0, 2.0]
+
+
+def test_rows_skip_missing_values():
+    rows = ColumnBatch.from_chunks(make_chunks(2), [[0.5, 0.5]] * 2).rows()
+
+    assert len(rows) == 2
+    assert rows[1]["text"] == "chunk 1"
+    assert rows[1]["chunk_index"] == 1
+    assert "created_at" not in rows[1]
+    assert list(rows[0]["embedding"]) == [0.5, 0.5]
+    assert rows[0]["row_id"] == chunk_id("7", 0, f"{0:064x}")
+    # auto_id collections generate the row id
+    assert "row_id" not in ColumnBatch.from_chunks(make_chunks(1), [[0.5, 0.5]]).rows(with_ids=False)[0]
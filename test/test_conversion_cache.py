@@ -0,0 +1,40 @@
+import hashlib
+import io
+import os
+
+from werkzeug.datastructures import FileStorage
+
+from weschatbot.services.document.conversion_cache import ConversionCache, file_hash
+from weschatbot.www.management.uploads import save_upload_file
+
+
+def test_uploads_are_hashed_while_streaming(tmp_path):
+    content = b"%PDF-1.7 " * 100000
+    upload = FileStorage(stream=io.BytesIO(content), filename="manual.pdf")
+
+    path, content_hash = save_upload_file(upload, str(tmp_path), max_size=len(content), chunk_size=4096)
+
+    assert content_hash == hashlib.sha256(content).hexdigest() == file_hash(path)
+
+
+def test_conversion_cache_is_keyed_by_content_and_converter_version(tmp_path):
+    cache = ConversionCache(folder=str(tmp_path), version="r1")
+    content_hash = hashlib.sha256(b"content").hexdigest()
+
+    assert cache.get(content_hash) is None
+    path = cache.put(content_hash, "# Converted")
+    assert cache.get(content_hash) == path
+    with open(path, encoding="utf-8") as f:
+        assert f.read() == "# Converted"
+
+    assert ConversionCache(folder=str(tmp_path), version="r2").get(content_hash) is None
+
+
+def test_uploads_with_the_same_content_keep_their_own_file(tmp_path):
+    content = b"%PDF-1.7 same content"
+    first, first_hash = save_upload_file(FileStorage(stream=io.BytesIO(content), filename="a.pdf"), str(tmp_path))
+    second, second_hash = save_upload_file(FileStorage(stream=io.BytesIO(content), filename="a.pdf"), str(tmp_path))
+
+    assert first_hash == second_hash
+    assert first != second
+    assert os.path.exists(first) and os.path.exists(second)
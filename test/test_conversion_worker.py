@@ -0,0 +1,29 @@
+import os
+
+import pytest
+
+from weschatbot.services.document.conversion_worker import ConversionWorkerPool
+
+
+def fake_convert(document_id, force=False):
+    # reports its pid as the duration and 100 MB per document id as the peak memory
+    if document_id < 0:
+        os._exit(1)
+    return float(os.getpid()), 100.0 * document_id
+
+
+def test_conversion_process_is_reused_and_recycled():
+    pool = ConversionWorkerPool(max_jobs=2, max_memory_mb=250, initializer=None, job=fake_convert)
+    try:
+        pids = [pool.convert(document_id).seconds for document_id in (1, 1, 1, 3, 1)]
+        # recycled after two jobs, then after going over the memory limit
+        assert pids[0] == pids[1]
+        assert pids[1] != pids[2]
+        assert pids[2] == pids[3]
+        assert pids[3] != pids[4]
+
+        with pytest.raises(Exception):
+            pool.convert(-1)
+        assert pool.convert(1).document_id == 1
+    finally:
+        pool.shutdown()
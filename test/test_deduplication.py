@@ -0,0 +1,40 @@
+from llama_index.core import Document as LlamaDocument
+
+from test.chunking_corpus import long_prose
+from weschatbot.services.document.deduplication import ChunkDeduplicator, simhash, hamming_distance
+
+FOOTER = ("This manual is provided as is without warranty of any kind. Westaco reserves the right to change "
+          "the specifications described in this document at any time without notice. All rights reserved.")
+
+
+def make_chunk(text, doc_id):
+    return LlamaDocument(text=text, metadata={"doc_id": doc_id})
+
+
+def test_simhash_near_duplicates_are_close():
+    edited = FOOTER.replace("any time", "any  time,")
+    assert hamming_distance(simhash(FOOTER), simhash(edited)) <= 3
+    assert hamming_distance(simhash(FOOTER), simhash(long_prose(1, sections=1))) > 3
+
+
+def test_deduplicate_keeps_one_canonical_with_all_sources():
+    dedup = ChunkDeduplicator(max_distance=3)
+    prose = long_prose(2, sections=1)
+    unique, late = dedup.deduplicate([make_chunk(FOOTER, "1"), make_chunk(prose, "1"),
+                                      make_chunk(FOOTER + " ", "2"), make_chunk(FOOTER, "2")])
+
+    assert [c.text for c in unique] == [FOOTER, prose]
+    assert unique[0].metadata["source_doc_ids"] == ["1", "2"]
+    assert unique[1].metadata["source_doc_ids"] == ["1"]
+    assert late == {}
+    assert dedup.duplicates == 2
+
+
+def test_deduplicate_reports_late_references_after_insert():
+    dedup = ChunkDeduplicator(max_distance=0)
+    unique, _ = dedup.deduplicate([make_chunk(FOOTER, "1")])
+    dedup.mark_inserted()
+
+    unique_next, late = dedup.deduplicate([make_chunk(FOOTER, "3"), make_chunk(FOOTER, "1")])
+    assert unique_next == []
+    assert late == {unique[0].metadata["simhash"]: {"3"}}
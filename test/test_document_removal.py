@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+from llama_index.core import Document as LlamaDocument
+from pymilvus import Collection, connections, utility
+
+from weschatbot.services.document.columnar_insert import ColumnarInserter, ColumnBatch, collection_schema
+from weschatbot.services.document.document_removal import DocumentRemover
+
+DIM = 8
+
+
+def chunk(doc_id, index, sources=None):
+    return LlamaDocument(text=f"chunk {doc_id}-{index}",
+                         metadata={"doc_id": doc_id, "chunk_index": index, "chunk_hash": f"{doc_id}{index:063x}",
+                                   "file_path": f"/data/{doc_id}.pdf", "source_doc_ids": sources or [doc_id]})
+
+
+@pytest.fixture
+def collection(tmp_path):
+    # milvus-lite, installed with pymilvus
+    connections.connect(alias="default", uri=str(tmp_path / "milvus.db"))
+    collection = Collection("removal_test", schema=collection_schema(DIM))
+    # documents 1, 2 and 3 with 5 chunks each, one chunk of document 1 also found in document 2
+    chunks = [chunk(doc_id, i) for doc_id in "123" for i in range(5)] + [chunk("1", 5, sources=["1", "2"])]
+    embeddings = np.random.default_rng(0).random((len(chunks), DIM), dtype=np.float32)
+    ColumnarInserter("removal_test").insert(ColumnBatch.from_chunks(chunks, embeddings.tolist()))
+    yield collection
+    utility.drop_collection("removal_test")
+    connections.disconnect("default")
+
+
+def rows(collection):
+    return collection.query("row_id >= 0", output_fields=["doc_id", "source_doc_ids"])
+
+
+def test_removal_deletes_own_chunks_and_keeps_shared_ones(collection):
+    diff = DocumentRemover("removal_test", batch_size=2).remove({1: "/data/1.pdf", 3: "/data/3.pdf"})
+
+    assert len(diff.to_delete) == 10
+    remaining = rows(collection)
+    assert len(remaining) == 6
+    assert {row["doc_id"] for row in remaining} == {"2"}
+    assert all(row["source_doc_ids"] == ["2"] for row in remaining)
+
+
+def test_removing_nothing_is_a_no_op(collection):
+    assert not DocumentRemover("removal_test").remove({}).to_delete
+    assert not DocumentRemover("removal_test").remove({9: "/data/9.pdf"}).to_delete
+    assert len(rows(collection)) == 16
+
+
+def test_shared_chunk_moves_to_its_remaining_document(collection):
+    remover = DocumentRemover("removal_test", document_paths=lambda ids: {doc_id: f"/data/{doc_id}.pdf"
+                                                                          for doc_id in ids})
+    diff = remover.remove({1: "/data/1.pdf"})
+
+    assert len(diff.to_rewrite) == 1
+    shared = collection.query(f"row_id == {next(iter(diff.to_rewrite))}",
+                              output_fields=["doc_id", "file_path", "document_name", "source_doc_ids"])[0]
+    assert shared["doc_id"] == "2" and shared["source_doc_ids"] == ["2"]
+    assert shared["file_path"] == "/data/2.pdf" and shared["document_name"] == "2.pdf"
+
+
+def test_paths_are_escaped_in_the_filter(collection):
+    diff = DocumentRemover("removal_test").remove({9: '/data/"quoted" \\ name.pdf'})
+
+    assert not diff.to_delete
+    assert len(rows(collection)) == 16
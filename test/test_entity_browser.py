@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+from llama_index.core import Document as LlamaDocument
+from pymilvus import Collection
+
+from weschatbot.services.document.columnar_insert import ColumnarInserter, ColumnBatch, collection_schema
+from weschatbot.services.entity_browser import EntityBrowser, browse_fields, decode_token
+from weschatbot.services.milvus_handles import MilvusHandleManager
+from weschatbot.utils.common import SingletonMeta
+
+DIM = 8
+
+
+@pytest.fixture
+def handles(tmp_path):
+    SingletonMeta._instances.pop(MilvusHandleManager, None)
+    # milvus-lite, installed with pymilvus
+    manager = MilvusHandleManager()
+    manager.connect(uri=str(tmp_path / "milvus.db"))
+    Collection("browse_test", schema=collection_schema(DIM))
+    chunks = [LlamaDocument(text=f"chunk {i}", metadata={"doc_id": str(i // 10), "chunk_index": i % 10})
+              for i in range(45)]
+    embeddings = np.random.default_rng(0).random((45, DIM), dtype=np.float32)
+    ColumnarInserter("browse_test").insert(ColumnBatch.from_chunks(chunks, embeddings.tolist()))
+    yield manager
+    manager.drop_collection("browse_test")
+    manager.disconnect()
+    SingletonMeta._instances.pop(MilvusHandleManager, None)
+
+
+def test_default_projection_has_no_vectors():
+    assert "embedding" not in browse_fields(collection_schema(DIM))
+    assert "text" in browse_fields(collection_schema(DIM))
+
+
+def test_pages_follow_row_id_order(handles):
+    browser = EntityBrowser(handles)
+
+    rows, token = browser.page("browse_test", limit=20)
+    assert len(rows) == 20 and "embedding" not in rows[0]
+    assert decode_token(token) == (rows[-1]["row_id"], 20, "browse_test")
+
+    pages = [rows]
+    while token:
+        rows, token = browser.page("browse_test", *decode_token(token)[:2], token=token)
+        pages.append(rows)
+
+    row_ids = [row["row_id"] for page in pages for row in page]
+    assert [len(page) for page in pages] == [20, 20, 5]
+    assert row_ids == sorted(row_ids) and len(set(row_ids)) == 45
+
+
+def test_token_resumes_without_its_iterator(handles):
+    _, token = EntityBrowser(handles).page("browse_test", limit=20)
+    after_row_id, limit, _ = decode_token(token)
+
+    # another process, which never opened the iterator
+    rows, _ = EntityBrowser(handles).page("browse_test", after_row_id, limit, token=token)
+    assert len(rows) == 20 and rows[0]["row_id"] > after_row_id
@@ -0,0 +1,57 @@
+import pytest
+from pymilvus import Collection, MilvusException, utility
+
+from weschatbot.exceptions.collection_exception import CollectionNotFoundException
+from weschatbot.services.document.columnar_insert import collection_schema
+from weschatbot.services.milvus_handles import MilvusHandleManager, is_stale_handle_error
+from weschatbot.utils.common import SingletonMeta
+
+
+@pytest.fixture
+def handles(tmp_path):
+    SingletonMeta._instances.pop(MilvusHandleManager, None)
+    # milvus-lite, installed with pymilvus
+    manager = MilvusHandleManager(revalidate_seconds=0)
+    manager.connect(uri=str(tmp_path / "milvus.db"))
+    Collection("handles_test", schema=collection_schema(8))
+    yield manager
+    manager.drop_collection("handles_test")
+    manager.disconnect()
+    SingletonMeta._instances.pop(MilvusHandleManager, None)
+
+
+def test_handles_are_cached_per_collection(handles):
+    assert MilvusHandleManager() is handles
+    collection = handles.collection("handles_test")
+
+    assert handles.collection("handles_test") is collection
+    assert handles.query("handles_test", expr="row_id >= 0", output_fields=["count(*)"])[0]["count(*)"] == 0
+    with pytest.raises(CollectionNotFoundException):
+        handles.collection("missing")
+
+
+def test_dropped_collection_gets_a_new_handle(handles):
+    collection = handles.collection("handles_test")
+
+    # dropped behind the manager's back, then created again
+    utility.drop_collection("handles_test")
+    with pytest.raises(CollectionNotFoundException):
+        handles.collection("handles_test")
+    Collection("handles_test", schema=collection_schema(8))
+    assert handles.collection("handles_test") is not collection
+
+    assert handles.drop_collection("handles_test")
+    assert not handles.drop_collection("handles_test")
+    Collection("handles_test", schema=collection_schema(8))
+
+
+def test_only_stale_handle_errors_are_retried(handles, monkeypatch):
+    assert is_stale_handle_error(MilvusException(code=100, message="collection not found[collection=42]"))
+    assert is_stale_handle_error(MilvusException(code=101, message="collection not loaded"))
+    assert not is_stale_handle_error(MilvusException(code=1100, message="cannot parse expression"))
+
+    invalidated = []
+    monkeypatch.setattr(handles, "invalidate", lambda *args: invalidated.append(args))
+    with pytest.raises(MilvusException):
+        handles.query("handles_test", expr="row_id >>> 0")
+    assert not invalidated
@@ -0,0 +1,36 @@
+import os
+
+from weschatbot.services.document import page_range_conversion
+from weschatbot.services.document.page_range_conversion import ParallelPdfConverter, page_ranges, stitch
+
+
+def test_page_ranges_cover_all_pages():
+    assert page_ranges(0, 25) == []
+    assert page_ranges(60, 25) == [(0, 25), (25, 50), (50, 60)]
+
+
+def test_stitch_continues_tables_across_ranges():
+    first = "# Manual\n\n| a | b |\n| --- | --- |\n| 1 | 2 |\n\n"
+    repeated_header = "| a | b |\n| --- | --- |\n| 3 | 4 |\n\nAfter."
+    promoted_row = "| 5 | 6 |\n| --- | --- |\n| 7 | 8 |"
+
+    assert stitch([first, repeated_header, promoted_row]) == (
+        "# Manual\n\n| a | b |\n| --- | --- |\n| 1 | 2 |\n| 3 | 4 |\n\nAfter.\n\n"
+        "| 5 | 6 |\n| --- | --- |\n| 7 | 8 |"
+    )
+    other_table = "| x | y | z |\n| --- | --- | --- |\n| 1 | 2 | 3 |"
+    assert stitch([first, other_table]).endswith("| 1 | 2 |\n\n\n" + other_table)
+
+
+def test_stitch_keeps_heading_levels_consistent():
+    parts = ["## Intro\n\ntext", "# Part 2\n\n#### Detail\n\ntext", "### Sub\n\ntext"]
+    assert stitch(parts) == "## Intro\n\ntext\n\n## Part 2\n\n### Detail\n\ntext\n\n### Sub\n\ntext"
+
+
+def test_workers_are_sized_from_available_memory(monkeypatch):
+    monkeypatch.setattr(page_range_conversion, "available_memory_mb", lambda: 9000)
+    cores = len(os.sched_getaffinity(0))
+    assert ParallelPdfConverter(workers=0, worker_memory_mb=4096).workers == min(2, cores)
+    monkeypatch.setattr(page_range_conversion, "available_memory_mb", lambda: 1000)
+    assert ParallelPdfConverter(workers=0, worker_memory_mb=4096).workers == 1
+    assert ParallelPdfConverter().workers == 1
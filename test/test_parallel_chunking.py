@@ -0,0 +1,43 @@
+import os
+
+from test.chunking_corpus import build_corpus
+from weschatbot.services.document.adaptive_markdown_strategy import AdaptiveMarkdownStrategy
+from weschatbot.services.document.parallel_chunking import ParallelChunker
+
+
+def test_parallel_chunking_keeps_document_order_and_isolates_failures():
+    documents = [*build_corpus().values(), "", 123]
+    metadata_list = [{"doc_id": str(i)} for i in range(len(documents))]
+
+    chunker = ParallelChunker(workers=2)
+    try:
+        results = chunker.chunk(documents, metadata_list)
+    finally:
+        chunker.shutdown()
+
+    strategy = AdaptiveMarkdownStrategy()
+    for content, metadata, chunks in zip(documents[:-2], metadata_list, results):
+        assert [c.text for c in chunks] == [c.text for c in strategy.chunk_markdown(content, metadata)]
+    assert results[-2] == []
+    assert results[-1] is None
+
+
+class KillsTheWorker:
+    """Exits the process that unpickles it, like a document that runs a chunking worker out of memory."""
+
+    def __reduce__(self):
+        return os._exit, (1,)
+
+
+def test_document_killing_its_worker_fails_alone():
+    documents = ["# A\n\nfirst", "# B\n\nkiller", "# C\n\nthird"]
+    metadata_list = [{"doc_id": "1"}, {"doc_id": "2", "crash": KillsTheWorker()}, {"doc_id": "3"}]
+
+    chunker = ParallelChunker(workers=2)
+    try:
+        results = chunker.chunk(documents, metadata_list)
+    finally:
+        chunker.shutdown()
+
+    assert results[1] is None
+    assert "first" in results[0][0].text and "third" in results[2][0].text
@@ -0,0 +1,43 @@
+import threading
+import time
+
+import pytest
+
+from weschatbot.services.document.staged_pipeline import StagedPipeline
+
+
+def test_stages_overlap_and_keep_order():
+    results = []
+    running = set()
+    overlapped = threading.Event()
+
+    def stage(name):
+        def run(item):
+            running.add(name)
+            if len(running) > 1:
+                overlapped.set()
+            time.sleep(0.02)
+            running.discard(name)
+            return item
+        return run
+
+    metrics = StagedPipeline(
+        source=range(10),
+        stages=[("chunk", stage("chunk")), ("embed", stage("embed")), ("insert", results.append)],
+        queue_size=1,
+    ).run()
+
+    assert results == list(range(10))
+    assert overlapped.is_set()
+    assert [m["items"] for m in metrics] == [10, 10, 10, 10]
+    assert all(m["max_queue_depth"] <= 1 for m in metrics)
+
+
+def test_first_error_stops_the_pipeline():
+    def fail_on_three(item):
+        if item == 3:
+            raise ValueError("bad batch")
+        return item
+
+    with pytest.raises(ValueError, match="bad batch"):
+        StagedPipeline(source=iter(range(1000)), stages=[("chunk", fail_on_three), ("insert", lambda x: x)]).run()
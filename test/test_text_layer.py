@@ -0,0 +1,34 @@
+from weschatbot.services.document.text_layer import PageText, TextLayerConverter, TextLine
+
+PROSE = "The device must be installed by a qualified technician following the local regulations."
+
+
+def line(text, x, y, size=11.0, bold=False):
+    return TextLine(text, [x, y, x + 5 * len(text), y + size], size=size, bold=bold)
+
+
+def born_digital_page(index=0):
+    lines = [line("Installation", 30, 20, size=20), *(line(PROSE, 30, 50 + 13 * i) for i in range(4))]
+    for i, row in enumerate([("Model", "Voltage", "Weight"), ("A100", "220 V", "3 kg"), ("B200", "110 V", "5 kg")]):
+        lines.extend(line(cell, 30 + 150 * j, 140 + 14 * i) for j, cell in enumerate(row))
+    return PageText(index, 595, 842, lines)
+
+
+def test_born_digital_page_is_read_from_text_layer():
+    (kind, markdown), = TextLayerConverter().plan([born_digital_page()])
+
+    assert kind == "text"
+    assert markdown == (
+        "# Installation\n\n" + " ".join([PROSE] * 4) + "\n\n"
+        "| Model | Voltage | Weight |\n| --- | --- | --- |\n| A100 | 220 V | 3 kg |\n| B200 | 110 V | 5 kg |"
+    )
+
+
+def test_scanned_pages_are_grouped_for_marker():
+    scanned = PageText(1, 595, 842, [line("12", 290, 800)], image_coverage=0.95)
+    two_columns = PageText(3, 595, 842, [line(PROSE, x, 50 + 13 * i) for i in range(8) for x in (30, 320)])
+    pages = [born_digital_page(0), scanned, PageText(2, 595, 842, [], image_coverage=1.0), two_columns,
+             born_digital_page(4)]
+
+    assert [(kind, content if kind == "marker" else None) for kind, content in TextLayerConverter().plan(pages)] \
+        == [("text", None), ("marker", range(1, 4)), ("text", None)]
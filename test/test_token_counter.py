@@ -0,0 +1,39 @@
+from tokenizers import Tokenizer, models, pre_tokenizers
+from transformers import PreTrainedTokenizerFast
+
+from test.chunking_corpus import build_corpus
+from weschatbot.services.document.adaptive_markdown_strategy import AdaptiveMarkdownStrategy
+from weschatbot.services.document.token_counter import TokenCounter
+
+
+def make_counter():
+    # word-level tokenizer built locally so the test does not download the embedding model's tokenizer
+    vocab = {"[UNK]": 0}
+    for content in build_corpus().values():
+        for word in content.split():
+            vocab.setdefault(word, len(vocab))
+    tokenizer = Tokenizer(models.WordLevel(vocab=vocab, unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = pre_tokenizers.WhitespaceSplit()
+    return TokenCounter(PreTrainedTokenizerFast(tokenizer_object=tokenizer, unk_token="[UNK]"))
+
+
+def test_token_counter_counts_and_splits_at_token_boundaries():
+    counter = make_counter()
+    text = " ".join(f"word{i}" for i in range(25))
+
+    assert counter.count(text) == 25
+    assert counter.count_batch([text, "a b", text]) == [25, 2, 25]
+
+    pieces = counter.split(text, 10)
+    assert [counter.count(piece) for piece in pieces] == [10, 10, 5]
+    assert "".join(pieces) == text
+
+
+def test_chunks_respect_max_tokens_with_exact_counts():
+    counter = make_counter()
+    strategy = AdaptiveMarkdownStrategy(min_tokens=64, max_tokens=512, chunk_overlap=16, token_counter=counter)
+
+    for name, content in build_corpus().items():
+        chunks = strategy.chunk_markdown(content, {"doc_id": name})
+        assert chunks
+        assert max(strategy.count_tokens([c.text for c in chunks])) <= 512
@@ -92,6 +92,13 @@ def chatbot_start(gunicorn_args):
     StandaloneApplication(app, options).run()
 
 
+@chatbot.command("requeue_failed_turns")
+def chatbot_requeue_failed_turns():
+    from weschatbot.services.chat_writer import ChatTurnWriter
+    requeued = ChatTurnWriter().requeue_failed()
+    click.echo(f"{requeued} chat turns requeued")
+
+
 @cli.command()
 def version():
     from weschatbot.version import version
@@ -121,11 +128,13 @@ def convert_documents():
 
 @document.command("convert")
 @click.option('--id', 'document_id', required=True, type=int, help='Document ID in database (integer)')
-def convert_document(document_id):
+@click.option('--force', is_flag=True, default=False,
+              help='Convert again even if already converted, and re-index it in its collections')
+def convert_document(document_id, force):
     print(f"Converting document id: {document_id}")
     document_service = DocumentService()
     try:
-        document_service.convert_document(document_id)
+        document_service.convert_document(document_id, force=force)
     except Exception as e:
         print(e)
         exit(1)
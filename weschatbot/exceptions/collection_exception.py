@@ -16,3 +16,11 @@ class DocumentNotFoundError(Exception):
 
 class MilvusCollectionException(Exception):
     pass
+
+
+class NoPreviousGenerationException(Exception):
+    pass
+
+
+class CollectionLockedException(Exception):
+    pass
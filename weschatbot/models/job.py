@@ -15,6 +15,9 @@ class Job(Base):
     name = Column(String(63), nullable=False)
     class_name = Column(String(511), nullable=False)
     params = Column(String(511), nullable=True)
+    # reported by long running tasks, percent done and current step
+    progress = Column(Integer, nullable=True)
+    detail = Column(String(1023), nullable=True)
 
     status: Mapped["JobStatus"] = relationship(back_populates="jobs")
     status_id = Column(Integer, ForeignKey("job_statuses.id"), nullable=False)
@@ -27,6 +30,8 @@ class Job(Base):
             "params": self.params,
             "class_name": self.class_name,
             "status": self.status.name,
+            "progress": self.progress,
+            "detail": self.detail,
         }
 
 
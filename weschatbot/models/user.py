@@ -181,6 +181,11 @@ class ChatSession(Base):
     status: Mapped["ChatStatus"] = relationship(back_populates="chats")  # noqa
     status_id = Column(Integer, ForeignKey('chat_statuses.id'), nullable=False)
 
+    __table_args__ = (
+        # session index of the chatbot sidebar
+        Index("ix_chats_user_status", "user_id", "status_id"),
+    )
+
     def to_dict(self, session=None):
         return {
             "id": self.id,
@@ -193,6 +198,24 @@ class ChatSession(Base):
         }
 
 
+@basic_fields
+class ChatTurn(Base):
+    """A turn written by ChatTurnWriter, so a turn delivered twice is written once."""
+    __tablename__ = "chat_turns"
+
+    # uuid given to the turn when it was submitted
+    id = Column(String(36), primary_key=True, nullable=False)
+    chat_id = Column(Integer, ForeignKey('chats.id'), nullable=False)
+    # microseconds since the epoch when the turn was submitted; turns are written in any order
+    submitted_at = Column(BigInteger, nullable=False)
+
+    messages: Mapped[List["ChatMessage"]] = relationship(back_populates="turn")
+
+    __table_args__ = (
+        Index("ix_chat_turns_chat_submitted", "chat_id", "submitted_at"),
+    )
+
+
 @basic_fields
 class ChatMessage(Base):
     __tablename__ = "messages"
@@ -205,6 +228,10 @@ class ChatMessage(Base):
     chat: Mapped["ChatSession"] = relationship(back_populates="messages")
     chat_id = Column(Integer, ForeignKey('chats.id'), nullable=False)
 
+    # None for messages written before turns were recorded
+    turn: Mapped["ChatTurn"] = relationship(back_populates="messages")
+    turn_id = Column(String(36), ForeignKey('chat_turns.id'), nullable=True)
+
     queries: Mapped[List["Query"]] = relationship(back_populates="message")
 
     def to_dict(self, session=None):
@@ -266,6 +293,14 @@ class Collection(Base):
     status_id = Column(Integer, ForeignKey("collection_statuses.id"), nullable=False)
     status: Mapped["CollectionStatus"] = relationship(back_populates="collections")
 
+    # when the vector index was last built and loaded, and the current or last index build step
+    ready_at = Column(DateTime, nullable=True)
+    index_detail = Column(String(1023), nullable=True)
+
+    # the Milvus collection ``name`` is an alias of, see CollectionAlias; the previous one is kept for rollbacks
+    generation = Column(Integer, nullable=False, default=0, server_default="0")
+    previous_generation = Column(Integer, nullable=True)
+
     documents_link: Mapped[List["CollectionDocument"]] = relationship(back_populates="collection")
 
     queries: Mapped[List["Query"]] = relationship(back_populates="collection")
@@ -283,7 +318,11 @@ class Collection(Base):
         return {
             'id': self.id,
             'name': self.name,
-            'status': self.status.name
+            'status': self.status.name,
+            'ready_at': self.ready_at,
+            'index_detail': self.index_detail,
+            'generation': self.generation,
+            'previous_generation': self.previous_generation,
         }
 
 
@@ -294,6 +333,7 @@ class Document(Base):
     name = Column(String(255), nullable=False)
     path = Column(String(2047), nullable=False)
     converted_path = Column(String(2047), nullable=True)
+    content_hash = Column(String(64), nullable=True, index=True)
     is_used = Column(Boolean, nullable=False, default=False)
     status_id = Column(Integer, ForeignKey('document_statuses.id'), nullable=False)
     status: Mapped["DocumentStatus"] = relationship(back_populates="documents")
@@ -311,6 +351,7 @@ class Document(Base):
             "is_used": self.is_used,
             "status": self.status.name,
             "converted_path": self.converted_path,
+            "content_hash": self.content_hash,
         }
 
 
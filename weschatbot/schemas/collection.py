@@ -33,7 +33,8 @@ class CollectionDesc:
             }
         }
 
-    def __init__(self, collection_id, collection_name, description, num_entities, fields, indexes, status):
+    def __init__(self, collection_id, collection_name, description, num_entities, fields, indexes, status,
+                 ready_at=None, index_detail=None):
         self.collection_id = collection_id
         self.collection_name = collection_name
         self.description = description
@@ -41,6 +42,20 @@ class CollectionDesc:
         self.fields = [CollectionDesc.make_field(x) for x in fields]
         self.indexes = [CollectionDesc.make_index(x) for x in indexes]
         self.status = status
+        self.ready_at = ready_at
+        self.index_detail = index_detail
+        self.stats = {}
+
+    @classmethod
+    def from_stats(cls, collection_id, stats, status, ready_at=None, index_detail=None):
+        """Build from a cached statistics snapshot, see ``collect_stats``."""
+        desc = cls(collection_id, stats["collection_name"], stats["description"], stats["num_entities"], [], [],
+                   status, ready_at=ready_at, index_detail=index_detail)
+        desc.fields = stats["fields"]
+        desc.indexes = stats["indexes"]
+        desc.stats = {key: stats.get(key) for key in
+                      ("num_segments", "memory_size", "indexed_rows", "total_rows", "updated_at")}
+        return desc
 
     def to_dict(self):
         return {
@@ -51,6 +66,9 @@ class CollectionDesc:
             "fields": self.fields,
             "indexes": self.indexes,
             "status": self.status,
+            "ready_at": self.ready_at,
+            "index_detail": self.index_detail,
+            "stats": self.stats,
         }
 
 
@@ -70,3 +88,54 @@ class MilvusNotFoundCollectionDesc:
             "indexes": {},
             "status": 404,
         }
+
+
+class TokenLengthReport:
+    """Distribution of chunk lengths, in tokens, over a collection."""
+
+    buckets = [64, 128, 256, 512, 1024, 2048]
+
+    def __init__(self, collection_id, collection_name, token_counts, unknown=0, min_tokens=None, max_tokens=None):
+        counts = sorted(token_counts)
+        self.collection_id = collection_id
+        self.collection_name = collection_name
+        self.count = len(counts)
+        self.unknown = unknown
+        self.min = counts[0] if counts else None
+        self.max = counts[-1] if counts else None
+        self.mean = round(sum(counts) / len(counts), 1) if counts else None
+        self.percentiles = {f"p{p}": TokenLengthReport.percentile(counts, p) for p in (50, 90, 99)}
+        self.histogram = TokenLengthReport.make_histogram(counts)
+        self.below_min = sum(1 for x in counts if min_tokens is not None and x < min_tokens)
+        self.above_max = sum(1 for x in counts if max_tokens is not None and x > max_tokens)
+
+    @staticmethod
+    def percentile(sorted_counts, p):
+        if not sorted_counts:
+            return None
+        return sorted_counts[min(len(sorted_counts) - 1, len(sorted_counts) * p // 100)]
+
+    @staticmethod
+    def make_histogram(sorted_counts):
+        res = {}
+        lower = 0
+        for upper in TokenLengthReport.buckets:
+            res[f"{lower}-{upper}"] = sum(1 for x in sorted_counts if lower <= x < upper)
+            lower = upper
+        res[f"{lower}+"] = sum(1 for x in sorted_counts if x >= lower)
+        return res
+
+    def to_dict(self):
+        return {
+            "collection_id": self.collection_id,
+            "collection_name": self.collection_name,
+            "count": self.count,
+            "unknown": self.unknown,
+            "min": self.min,
+            "max": self.max,
+            "mean": self.mean,
+            "percentiles": self.percentiles,
+            "histogram": self.histogram,
+            "below_min": self.below_min,
+            "above_max": self.above_max,
+        }
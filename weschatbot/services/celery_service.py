@@ -1,34 +1,74 @@
 import asyncio
+import inspect
 import logging
-import subprocess
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
 from functools import wraps
 
+from celery import chord
+from pymilvus import Collection as MilvusCollection, connections, utility
+from sqlalchemy.orm import joinedload
+
+from weschatbot.exceptions.collection_exception import CollectionLockedException
 from weschatbot.models.job import Job, JobStatus
-from weschatbot.models.user import Collection, CollectionStatus
+from weschatbot.models.user import Collection, CollectionDocument, CollectionDocumentStatus, CollectionStatus
+from weschatbot.services.collection_stats import CollectionStatsCache
+from weschatbot.services.document.bulk_import import MilvusBulkImporter
+from weschatbot.services.document.collection_alias import CollectionAlias, generation_name
+from weschatbot.services.document.collection_index import CollectionIndexBuilder, VECTOR_FIELD
+from weschatbot.services.document.columnar_insert import collection_schema
+from weschatbot.services.document.conversion_worker import ConversionWorkerPool
+from weschatbot.services.document.document_removal import DocumentRemover
 from weschatbot.services.document.index_document_service import PipelineMilvusStore, \
-    IndexDocumentWithoutConverterService
+    IndexDocumentService, IndexDocumentWithoutConverterService, document_paths
 from weschatbot.utils.config import config
 from weschatbot.utils.db import provide_session
+from weschatbot.utils.redis_config import DB_CACHE, get_redis_client
 from weschatbot.worker.celery_worker import celery_app
 
 app = celery_app()
 
+conversion_pool = ConversionWorkerPool(
+    max_jobs=config.getint("convert", "worker_max_jobs", fallback=50),
+    max_memory_mb=config.getint("convert", "worker_max_memory_mb", fallback=0)
+)
+
 logger = logging.getLogger(__name__)
 
+COLLECTION_LOCK_FMT = "lock:collection:{collection_id}"
+# attempts of a document removal task before it gives up, the documents stay "removing"
+REMOVAL_MAX_FAILURES = 5
+
+
+@provide_session
+def set_job_status(job_id, status, session=None):
+    status_entity = session.query(JobStatus).filter(JobStatus.name == status).one_or_none()
+    if not status_entity:
+        raise ValueError(f"Unknown status '{status}'. Please run command 'alembic upgrade head' to upgrade db.")
+    job_run = session.get(Job, job_id)
+    job_run.status = status_entity
+
+
+@provide_session
+def update_job_progress(job_id, progress, detail=None, session=None):
+    job_run = session.get(Job, job_id)
+    job_run.progress = progress
+    job_run.detail = detail[:1023] if detail else detail
+
 
 def update_job_status(func):
-    @provide_session
-    def update(job_id, status, session=None):
-        status_entity = session.query(JobStatus).filter(JobStatus.name == status).one_or_none()
-        if not status_entity:
-            raise ValueError(f"Unknown status '{status}'. Please run command 'alembic upgrade head' to upgrade db.")
-        job_run = session.get(Job, job_id)
-        job_run.status = status_entity
+    # tasks declaring a job_id parameter get it, to report their progress
+    pass_job_id = "job_id" in inspect.signature(func).parameters
 
     @wraps(func)
     def wrapper(job_id, *args, **kwargs):
         try:
+            set_job_status(job_id, "running")
             logger.info(f"Running {func.__name__}; job run {job_id}")
+            if pass_job_id:
+                kwargs["job_id"] = job_id
             func(*args, **kwargs)
             status = "done"
             logger.info(f"Finished {func.__name__}; job run {job_id}")
@@ -36,24 +76,36 @@ def update_job_status(func):
             logger.error(e)
             status = "failed"
             logger.error(f"Failed {func.__name__}; job run {job_id}")
-        update(job_id, status)
+        set_job_status(job_id, status)
 
     return wrapper
 
 
-def update_collection_status(func):
-    @provide_session
-    def update(collection_id, status, session=None):
-        status_entity = session.query(CollectionStatus).filter(CollectionStatus.name == status).one_or_none()
-        if not status_entity:
-            raise ValueError(f"Unknown status '{status}'. Please run command 'alembic upgrade head' to upgrade db.")
-        collection = session.get(Collection, collection_id)
-        collection.status = status_entity
+@provide_session
+def set_collection_readiness(collection_id, detail, ready=None, session=None):
+    """
+    :param ready: True once the collection is query-ready, False while it is not, None to keep the previous state
+    """
+    collection = session.get(Collection, collection_id)
+    collection.index_detail = detail[:1023] if detail else detail
+    if ready is not None:
+        collection.ready_at = datetime.now() if ready else None
+
+
+@provide_session
+def set_collection_status(collection_id, status, session=None):
+    status_entity = session.query(CollectionStatus).filter(CollectionStatus.name == status).one_or_none()
+    if not status_entity:
+        raise ValueError(f"Unknown status '{status}'. Please run command 'alembic upgrade head' to upgrade db.")
+    collection = session.get(Collection, collection_id)
+    collection.status = status_entity
 
+
+def update_collection_status(func):
     @wraps(func)
     def wrapper(collection_id, *args, **kwargs):
         try:
-            update(collection_id, "running")
+            set_collection_status(collection_id, "running")
             logger.info(f"Running {func.__name__}; job run {collection_id}")
             func(collection_id, *args, **kwargs)
             status = "done"
@@ -62,39 +114,411 @@ def update_collection_status(func):
             logger.error(e)
             status = "failed"
             logger.error(f"Failed {func.__name__}; job run {collection_id}")
-        update(collection_id, status)
+        set_collection_status(collection_id, status)
 
     return wrapper
 
 
-@app.task(queue="index")
-@update_collection_status
-def index_collection_to_milvus(collection_id, collection_name):
+def collection_lock_timeout():
+    # a run lost with its worker is delivered again after the visibility timeout, its lock must be gone by then
+    return config.getint("celery", "visibility_timeout", fallback=3600)
+
+
+def lock_collection(collection_id, owner):
+    """Take the indexing lock of a collection (Redis SET NX); False when another run holds it."""
+    return bool(get_redis_client(DB_CACHE).set(COLLECTION_LOCK_FMT.format(collection_id=collection_id), owner,
+                                               nx=True, ex=collection_lock_timeout()))
+
+
+def unlock_collection(collection_id):
+    get_redis_client(DB_CACHE).delete(COLLECTION_LOCK_FMT.format(collection_id=collection_id))
+
+
+@contextmanager
+def collection_locked(collection_id):
+    """Renew the indexing lock of a collection while the body runs, so a run longer than its timeout keeps it."""
+    key = COLLECTION_LOCK_FMT.format(collection_id=collection_id)
+    timeout = collection_lock_timeout()
+    stop = threading.Event()
+
+    def renew():
+        while not stop.wait(timeout / 3):
+            try:
+                get_redis_client(DB_CACHE).expire(key, timeout)
+            except Exception as e:
+                logger.error(f"Failed renewing the lock of collection {collection_id}: {e}")
+
+    thread = threading.Thread(target=renew, name=f"lock-collection-{collection_id}", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+@contextmanager
+def exclusive_collection_run(collection_id, owner):
+    """Hold the indexing lock of a collection for the body; raises CollectionLockedException if another run does."""
+    if not lock_collection(collection_id, owner):
+        raise CollectionLockedException(f"Collection {collection_id} is being indexed by another run")
+    try:
+        with collection_locked(collection_id):
+            yield
+    finally:
+        unlock_collection(collection_id)
+
+
+def index_collection(collection_id, collection_name, insert_mode, progress=None, document_ids=None, finalize=True):
+    """:return: the number of rows inserted, deleted or rewritten in the collection"""
     async def run_indexing():
+        bulk_importer = None
+        if insert_mode == "bulk_import":
+            bulk_importer = MilvusBulkImporter(
+                collection_name=collection_name,
+                staging_folder=config.get("bulk_import", "staging_folder", fallback="/tmp/weschatbot/bulk_import"),
+                endpoint=config.get("bulk_import", "minio_endpoint", fallback="localhost:9000"),
+                access_key=config.get("bulk_import", "minio_access_key", fallback="minioadmin"),
+                secret_key=config.get("bulk_import", "minio_secret_key", fallback="minioadmin"),
+                bucket=config.get("bulk_import", "bucket", fallback="a-bucket"),
+                secure=config.getboolean("bulk_import", "minio_secure", fallback=False),
+                max_rows_per_file=config.getint("bulk_import", "max_rows_per_file", fallback=100000),
+                poll_interval=config.getfloat("bulk_import", "poll_interval", fallback=5.0),
+                defer_index=config.getboolean("bulk_import", "defer_index", fallback=True)
+            )
         pipeline = PipelineMilvusStore(
             collection_name=collection_name,
             milvus_host=config["milvus"]["host"],
-            milvus_port=config["milvus"]["port"]
+            milvus_port=config["milvus"]["port"],
+            chunking_workers=config.getint("index", "chunking_workers", fallback=0),
+            dedup_enabled=config.getboolean("index", "dedup_enabled", fallback=True),
+            dedup_max_distance=config.getint("index", "dedup_max_distance", fallback=3),
+            tokenizer_name=config.get("index", "tokenizer", fallback=None) or None,
+            insert_mode=insert_mode,
+            bulk_importer=bulk_importer
         )
         indexer = IndexDocumentWithoutConverterService(
             converter=None,
             pipeline=pipeline,
             collection_name=collection_name,
-            collection_id=collection_id
+            collection_id=collection_id,
+            batch_size=config.getint("index", "batch_size", fallback=10),
+            queue_size=config.getint("index", "pipeline_queue_size", fallback=2),
+            progress=progress
         )
-        indexer.index()
+        try:
+            indexer.index(document_ids=document_ids)
+        finally:
+            pipeline.close()
+
+        if finalize:
+            # a bulk import may have dropped the index: finalize it fully
+            finalize_collection(collection_id, collection_name,
+                                rows_written=None if pipeline.deferred else pipeline.rows_written)
+        return pipeline.rows_written
 
     return asyncio.run(run_indexing())
 
 
-@app.task(queue="convert")
-def convert_document(document):
-    logger.info(f"Start converting - Document ID {document['id']}, calling sub process")
-    result = subprocess.run(
-        ["weschatbot", "document", "convert", "--id", f"{document['id']}"],
-        capture_output=True
+def refresh_stats(collection_id, collection_name):
+    """Cache fresh statistics of a collection after a job changed it; a failure here never fails the job."""
+    try:
+        CollectionStatsCache().refresh(collection_id, collection_name)
+    except Exception as e:
+        logger.error(f"Failed refreshing the statistics of collection {collection_id}: {e}")
+
+
+def finalize_collection(collection_id, collection_name, rows_written=None):
+    """
+    Build the vector index, compact and load the collection after writing, recording when it is query-ready.
+
+    :param rows_written: rows changed by the run, None when unknown; nothing is done when no row changed
+    """
+    if rows_written == 0:
+        logger.info(f"No row of collection '{collection_name}' changed, it is not finalized again")
+        return
+    connections.connect(alias="default", host=config["milvus"]["host"], port=config["milvus"]["port"])
+    builder = CollectionIndexBuilder(
+        collection_name=collection_name,
+        compact=config.getboolean("index", "compact_after_indexing", fallback=True),
+        compact_min_rows=config.getint("index", "compact_min_rows", fallback=10000),
+        timeout=config.getint("index", "finalize_timeout", fallback=0) or None
+    )
+    started = time.perf_counter()
+    durations = builder.finalize(
+        progress=lambda step, percent, detail: set_collection_readiness(collection_id, f"{step}: {detail}"),
+        rows_written=rows_written
     )
-    if result.returncode != 0:
-        logger.info(f"Sub process failed with code {result.returncode}")
+    set_collection_readiness(
+        collection_id,
+        f"query-ready in {time.perf_counter() - started:.1f}s (" + ", ".join(
+            f"{step} {seconds:.1f}s" for step, seconds in durations.items()) + ")",
+        ready=True
+    )
+    refresh_stats(collection_id, collection_name)
+
+
+@update_collection_status
+def index_whole_collection(collection_id, collection_name, insert_mode):
+    index_collection(collection_id, collection_name, insert_mode)
+
+
+# acknowledged once done: a run lost with its worker is delivered again after [celery] visibility_timeout and
+# resumes from the documents in progress. Runs of a collection are serialized by its lock, so a task delivered
+# again while the first delivery still runs waits for it instead of indexing the same documents twice.
+@app.task(bind=True, queue="index", acks_late=True, max_retries=None)
+def index_collection_to_milvus(self, collection_id, collection_name):
+    """
+    Index the pending documents of a collection. Large collections are split into shards of ``[index] shard_size``
+    documents indexed by parallel sub-tasks on the ``index`` queue; a chord callback finalizes the collection and
+    sets its status once every shard is done, and releases the lock of the collection.
+    """
+    if not lock_collection(collection_id, self.request.id):
+        countdown = config.getint("celery", "collection_lock_retry", fallback=300)
+        logger.info(f"Collection {collection_id} is being indexed by another run, retrying in {countdown}s")
+        raise self.retry(countdown=countdown)
+
+    chorded = False
+    try:
+        insert_mode = config.get("index", "insert_mode", fallback="direct")
+        shard_size = config.getint("index", "shard_size", fallback=200)
+        indexer = IndexDocumentService(converter=None, pipeline=None, collection_name=collection_name,
+                                       collection_id=collection_id)
+        document_ids = indexer.pending_document_ids()
+
+        # a bulk import loads everything at once, it is not split
+        if insert_mode == "bulk_import" or not shard_size or len(document_ids) <= shard_size:
+            with collection_locked(collection_id):
+                return index_whole_collection(collection_id, collection_name, insert_mode)
+
+        set_collection_status(collection_id, "running")
+        shards = [document_ids[i:i + shard_size] for i in range(0, len(document_ids), shard_size)]
+        logger.info(f"Indexing {len(document_ids)} documents of collection {collection_id} as {len(shards)} shards")
+        chord(
+            index_collection_shard.s(collection_id, collection_name, shard, insert_mode) for shard in shards
+        )(finish_collection_indexing.s(collection_id, collection_name))
+        # held until the chord callback
+        chorded = True
+    finally:
+        if not chorded:
+            unlock_collection(collection_id)
+
+
+@app.task(queue="index", acks_late=True)
+def index_collection_shard(collection_id, collection_name, document_ids, insert_mode):
+    """Index a shard of the in-progress documents of a collection; errors are reported to the chord callback."""
+    try:
+        with collection_locked(collection_id):
+            rows = index_collection(collection_id, collection_name, insert_mode, document_ids=document_ids,
+                                    finalize=False)
+        return {"documents": len(document_ids), "rows": rows, "error": None}
+    except Exception as e:
+        logger.error(f"Failed indexing shard of {len(document_ids)} documents of collection {collection_id}: {e}")
+        # rows may have been written before the failure
+        return {"documents": len(document_ids), "rows": None, "error": str(e)}
+
+
+@app.task(queue="index")
+def finish_collection_indexing(results, collection_id, collection_name):
+    """Chord callback: finalize the collection once every shard is indexed, set its final status and unlock it."""
+    failed = [result for result in results if result["error"]]
+    status = "failed" if failed else "done"
+    rows = [result.get("rows") for result in results]
+    try:
+        with collection_locked(collection_id):
+            finalize_collection(collection_id, collection_name, rows_written=None if None in rows else sum(rows))
+    except Exception as e:
+        logger.error(e)
+        status = "failed"
+    try:
+        logger.info(f"Indexed collection {collection_id}: {len(results) - len(failed)}/{len(results)} shards done")
+        set_collection_status(collection_id, status)
+    finally:
+        unlock_collection(collection_id)
+
+
+@app.task(queue="index")
+@update_job_status
+def bulk_load_collection(collection_id, collection_name, job_id=None):
+    """Job task: index the new documents of a collection through Milvus bulk import."""
+    with exclusive_collection_run(collection_id, f"job {job_id}"):
+        set_collection_status(collection_id, "running")
+        if config.getboolean("bulk_import", "defer_index", fallback=True):
+            set_collection_readiness(collection_id, "bulk load running, the index is rebuilt afterwards", ready=False)
+        try:
+            index_collection(collection_id, collection_name, "bulk_import",
+                             progress=lambda percent, detail: update_job_progress(job_id, percent, detail))
+        except Exception:
+            set_collection_status(collection_id, "failed")
+            raise
+        set_collection_status(collection_id, "done")
+        update_job_progress(job_id, 100, "bulk import done")
+
+
+@provide_session
+def collection_generations(collection_id, session=None):
+    collection = session.get(Collection, collection_id)
+    return collection.generation, collection.previous_generation
+
+
+@provide_session
+def set_collection_generation(collection_id, generation, previous_generation, session=None):
+    collection = session.get(Collection, collection_id)
+    collection.generation = generation
+    collection.previous_generation = previous_generation
+
+
+@app.task(queue="index")
+@update_job_status
+def rebuild_collection(collection_id, collection_name, job_id=None):
+    """
+    Job task: index every document of a collection into a new Milvus collection (generation), build and load its
+    index, then repoint the alias ``collection_name`` to it. The live collection serves queries meanwhile and the
+    previous generation is kept for a rollback.
+    """
+    with exclusive_collection_run(collection_id, f"job {job_id}"):
+        connections.connect(alias="default", host=config["milvus"]["host"], port=config["milvus"]["port"])
+        insert_mode = config.get("index", "insert_mode", fallback="direct")
+        alias = CollectionAlias(collection_name)
+        live = alias.target()
+        generation, previous_generation = collection_generations(collection_id)
+        new_generation = max(generation, previous_generation or 0) + 1
+        shadow = generation_name(collection_name, new_generation)
+
+        dim = 1024
+        if live is not None:
+            dim = next(field.params["dim"] for field in MilvusCollection(live).schema.fields
+                       if field.name == VECTOR_FIELD)
+        if utility.has_collection(shadow):
+            # left over by a failed rebuild
+            utility.drop_collection(shadow)
+        MilvusCollection(shadow, schema=collection_schema(dim))
+        # indexed and loaded up front, so the pipeline can query it, sized for the rows of the live generation
+        shadow_index = CollectionIndexBuilder(shadow)
+        shadow_index.create_index(MilvusCollection(live).num_entities if live is not None else 0)
+        shadow_index.ensure_loaded()
+
+        indexer = IndexDocumentService(converter=None, pipeline=None, collection_name=shadow,
+                                       collection_id=collection_id)
+        statuses = indexer.mark_all_in_progress()
+        set_collection_status(collection_id, "running")
+        update_job_progress(job_id, 0, f"indexing {len(statuses)} documents into '{shadow}'")
+        try:
+            index_collection(collection_id, shadow, insert_mode, finalize=False,
+                             progress=lambda percent, detail: update_job_progress(job_id, percent, detail))
+            durations = CollectionIndexBuilder(
+                collection_name=shadow,
+                compact=config.getboolean("index", "compact_after_indexing", fallback=True),
+                timeout=config.getint("index", "finalize_timeout", fallback=0) or None
+            ).finalize(progress=lambda step, percent, detail: update_job_progress(job_id, percent, f"{step}: {detail}"))
+        except Exception:
+            utility.drop_collection(shadow)
+            # documents marked done in the dropped shadow are not in the live collection
+            indexer.restore_statuses(statuses)
+            set_collection_status(collection_id, "failed")
+            raise
+
+        alias.swap(shadow)
+        set_collection_generation(collection_id, new_generation, generation)
+        if previous_generation is not None and previous_generation != generation:
+            # only the generation just replaced is kept for a rollback
+            alias.drop(generation_name(collection_name, previous_generation))
+        set_collection_readiness(collection_id, f"generation {new_generation} live, built in " + ", ".join(
+            f"{step} {seconds:.1f}s" for step, seconds in durations.items()), ready=True)
+        refresh_stats(collection_id, collection_name)
+        set_collection_status(collection_id, "done")
+        update_job_progress(job_id, 100, f"'{collection_name}' now serves '{shadow}'")
+
+
+@provide_session
+def all_collections(session=None):
+    return [(collection.id, collection.name) for collection in session.query(Collection).all()]
+
+
+@app.task(queue="index")
+def refresh_collection_stats():
+    """Scheduled: cache the statistics of every collection for the management UI."""
+    connections.connect(alias="default", host=config["milvus"]["host"], port=config["milvus"]["port"])
+    for collection_id, collection_name in all_collections():
+        if utility.has_collection(collection_name):
+            refresh_stats(collection_id, collection_name)
+
+
+@provide_session
+def unlink_removed_documents(collection_id, document_ids, session=None):
+    """Delete the "removing" links of documents whose chunks are gone; documents left in no collection are unused."""
+    links = (
+        session.query(CollectionDocument)
+        .options(joinedload(CollectionDocument.document))
+        .join(CollectionDocumentStatus)
+        .filter(CollectionDocument.collection_id == collection_id)
+        .filter(CollectionDocument.document_id.in_(document_ids))
+        .filter(CollectionDocumentStatus.name == "removing")
+        .all()
+    )
+    for link in links:
+        session.delete(link)
+    session.flush()
+
+    still_used = {document_id for (document_id,) in session.query(CollectionDocument.document_id)
+                  .filter(CollectionDocument.document_id.in_([link.document_id for link in links]))
+                  .distinct()}
+    for link in links:
+        if link.document_id not in still_used:
+            link.document.is_used = False
+
+
+# acknowledged once done and retried on failure: the documents stay "removing" until their chunks are deleted.
+# Runs under the lock of the collection: rows deleted from the live generation during a rebuild would come back
+# with the rebuilt one.
+@app.task(bind=True, queue="index", acks_late=True, max_retries=None)
+def remove_documents_from_milvus(self, collection_name, file_paths, collection_id=None, failures=0):
+    """
+    Delete the chunks of documents removed from a collection, ``file_paths`` maps their ids to their paths, then
+    unlink them from the collection.
+
+    :param failures: failed attempts so far; waiting for the lock of the collection is not a failure
+    """
+    try:
+        with exclusive_collection_run(collection_id, self.request.id) if collection_id is not None \
+                else nullcontext():
+            connections.connect(alias="default", host=config["milvus"]["host"], port=config["milvus"]["port"])
+            deleted = 0
+            in_milvus = utility.has_collection(collection_name)
+            if in_milvus:
+                remover = DocumentRemover(
+                    collection_name=collection_name,
+                    compact=config.getboolean("index", "compact_after_removal", fallback=True),
+                    document_paths=document_paths
+                )
+                deleted = len(remover.remove(file_paths).to_delete)
+            else:
+                logger.info(f"Collection '{collection_name}' is not in Milvus, nothing to remove")
+            if collection_id is not None:
+                unlink_removed_documents(collection_id, [int(doc_id) for doc_id in file_paths])
+    except CollectionLockedException:
+        countdown = config.getint("celery", "collection_lock_retry", fallback=300)
+        logger.info(f"Collection {collection_id} is being indexed, removing documents from it in {countdown}s")
+        raise self.retry(countdown=countdown)
+    except Exception as e:
+        logger.error(f"Failed removing {len(file_paths)} documents from collection '{collection_name}': {e}")
+        if failures + 1 >= REMOVAL_MAX_FAILURES:
+            raise
+        raise self.retry(exc=e, countdown=60, kwargs={"collection_id": collection_id, "failures": failures + 1})
+    if collection_id is not None and in_milvus:
+        refresh_stats(collection_id, collection_name)
+    return deleted
+
+
+@app.task(queue="convert")
+def convert_document(document, force=False):
+    logger.info(f"Start converting - Document ID {document['id']}")
+    try:
+        result = conversion_pool.convert(document['id'], force=force)
+    except Exception as e:
+        logger.error(e)
         logger.info(f"Document ID {document['id']} is not converted.")
-    logger.info(f"Done - Document ID {document['id']}")
+        return None
+    logger.info(f"Done - Document ID {document['id']} converted in {result.seconds:.1f}s, "
+                f"conversion process peak memory {result.peak_rss_mb:.0f} MB")
+    return result.to_dict()
@@ -0,0 +1,206 @@
+import pickle
+import time
+import uuid
+from typing import Callable, Iterable, List, Optional
+
+import msgpack
+from redis.exceptions import WatchError
+
+from weschatbot.log.logging_mixin import LoggingMixin
+from weschatbot.schemas.chat import Message
+from weschatbot.utils.config import config
+from weschatbot.utils.redis_config import provide_redis, DB_CHAT
+
+CHARS_PER_TOKEN = 4
+
+
+def pack_message(message: Message) -> bytes:
+    return msgpack.packb([message.sender, message.receiver, message.message], use_bin_type=True)
+
+
+def unpack_message(entry: bytes) -> Message:
+    sender, receiver, text = msgpack.unpackb(entry, raw=False)[:3]
+    return Message(sender=sender, receiver=receiver, message=text)
+
+
+def make_turn(user_id: int, chat_id: str, messages: Iterable[Message], query_results: Iterable = ()) -> dict:
+    """A turn of a chat as queued for the database: its messages and the query results of its question."""
+    return {
+        "id": str(uuid.uuid4()),
+        # orders the turns of a chat, whichever writer commits them first
+        "submitted_at": time.time_ns() // 1000,
+        "user_id": user_id,
+        "chat_id": chat_id,
+        "messages": [[message.sender, message.receiver, message.message] for message in messages],
+        "queries": [[int(result.document_id), int(result.row_id), result.document_text, float(result.cosine_score),
+                     int(result.rank), int(result.collection_id)] for result in query_results],
+    }
+
+
+def pack_turn(turn: dict) -> bytes:
+    return msgpack.packb(turn, use_bin_type=True)
+
+
+def unpack_turn(entry: bytes) -> dict:
+    return msgpack.unpackb(entry, raw=False)
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count of a message, without a round trip to the model's tokenizer."""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def truncate_message(message: Message, max_tokens: int) -> Message:
+    """The message cut to about ``max_tokens`` estimated tokens."""
+    text = message.message[:max(0, max_tokens - 1) * CHARS_PER_TOKEN]
+    return Message(sender=message.sender, receiver=message.receiver, message=text)
+
+
+class ChatHistory(LoggingMixin):
+    """
+    Messages of a chat as a Redis list of msgpack entries ``[sender, receiver, message]``.
+
+    A turn is appended with a single RPUSH, so concurrent turns never overwrite each other, and readers fetch
+    only the trailing entries they need with LRANGE instead of the whole conversation.
+
+    Lists expire ``[chat_history] ttl`` seconds after the chat was last used, so Redis only holds active chats.
+    The history of a chat that is not in Redis is read again with ``loader`` (from the database), except for
+    chats recorded by ``create``, which are known to have no messages until their first turn.
+    """
+
+    KEY_FMT = "chat:{chat_id}:messages"
+    # set for a new chat until its first turn, Redis lists cannot be empty
+    EMPTY_KEY_FMT = "chat:{chat_id}:empty"
+    # whole message list pickled into one string, before chat histories were lists
+    LEGACY_KEY_FMT = "ss_{chat_id}"
+
+    def __init__(self, ttl: Optional[int] = None, loader: Optional[Callable[[str], List[Message]]] = None):
+        self.ttl = ttl if ttl is not None else config.getint("chat_history", "ttl", fallback=86400)
+        self.loader = loader
+
+    def key(self, chat_id: str) -> str:
+        return self.KEY_FMT.format(chat_id=chat_id)
+
+    def empty_key(self, chat_id: str) -> str:
+        return self.EMPTY_KEY_FMT.format(chat_id=chat_id)
+
+    @provide_redis(DB_CHAT)
+    def create(self, chat_id: str, redis_client=None):
+        """Record a new chat as empty, so reading it before its first turn does not query the database."""
+        redis_client.set(self.empty_key(chat_id), 1, ex=self.ttl or None)
+
+    @provide_redis(DB_CHAT)
+    def append(self, chat_id: str, messages: Iterable[Message], redis_client=None) -> int:
+        """:return: the number of messages of the chat after appending"""
+        entries = [pack_message(message) for message in messages]
+        if not entries:
+            return redis_client.llen(self.key(chat_id))
+        length = self._touch(redis_client.pipeline(transaction=False).rpushx(self.key(chat_id), *entries),
+                             chat_id).execute()[0]
+        if length:
+            return length
+        # not in Redis: load the earlier messages first
+        self._load(chat_id, redis_client)
+        pipeline = redis_client.pipeline(transaction=False).rpush(self.key(chat_id), *entries)
+        return self._touch(pipeline, chat_id).delete(self.empty_key(chat_id)).execute()[0]
+
+    @provide_redis(DB_CHAT)
+    def replace(self, chat_id: str, messages: Iterable[Message], redis_client=None):
+        entries = [pack_message(message) for message in messages]
+        pipeline = redis_client.pipeline(transaction=True)
+        pipeline.delete(self.key(chat_id))
+        if entries:
+            self._touch(pipeline.rpush(self.key(chat_id), *entries), chat_id)
+        pipeline.execute()
+
+    @provide_redis(DB_CHAT)
+    def delete(self, chat_id: str, redis_client=None):
+        redis_client.delete(self.key(chat_id), self.empty_key(chat_id), self.LEGACY_KEY_FMT.format(chat_id=chat_id))
+
+    @provide_redis(DB_CHAT)
+    def tail(self, chat_id: str, count: Optional[int] = None, redis_client=None) -> List[Message]:
+        """The last ``count`` messages of the chat, oldest first; all of them when ``count`` is None."""
+        if count is not None and count <= 0:
+            return []
+        entries = self._range(chat_id, 0 if count is None else -count, -1, redis_client)
+        if not entries and self._load(chat_id, redis_client):
+            entries = self._range(chat_id, 0 if count is None else -count, -1, redis_client)
+        return [unpack_message(entry) for entry in entries]
+
+    @provide_redis(DB_CHAT)
+    def window(self, chat_id: str, max_messages: Optional[int] = None, max_tokens: Optional[int] = None,
+               page_size: int = 8, redis_client=None) -> List[Message]:
+        """
+        The trailing messages of the chat, oldest first, that fit in ``max_messages`` and ``max_tokens``
+        (estimated with ``estimate_tokens``). Entries are read backwards ``page_size`` at a time, so the cost
+        depends on the window and not on the length of the conversation. The most recent message is always kept,
+        cut to ``max_tokens`` if it is longer; the budget only drops older ones.
+        """
+        if max_tokens is None:
+            return self.tail(chat_id, max_messages, redis_client=redis_client)
+        window, tokens, read = [], 0, 0
+        while max_messages is None or len(window) < max_messages:
+            entries = self._range(chat_id, -(read + page_size), -(read + 1), redis_client, touch=not read)
+            if not entries and not read and self._load(chat_id, redis_client):
+                continue
+            for entry in reversed(entries):
+                message = unpack_message(entry)
+                tokens += estimate_tokens(message.message)
+                if not window and tokens > max_tokens:
+                    return [truncate_message(message, max_tokens)]
+                if tokens > max_tokens or (max_messages is not None and len(window) >= max_messages):
+                    return window[::-1]
+                window.append(message)
+            if len(entries) < page_size:
+                break
+            read += page_size
+        return window[::-1]
+
+    @provide_redis(DB_CHAT)
+    def length(self, chat_id: str, redis_client=None) -> int:
+        return redis_client.llen(self.key(chat_id))
+
+    def _touch(self, pipeline, chat_id: str):
+        """Restart the expiry of the chat (sliding TTL)."""
+        if self.ttl:
+            pipeline.expire(self.key(chat_id), self.ttl)
+        return pipeline
+
+    def _range(self, chat_id: str, start: int, end: int, redis_client, touch: bool = True) -> List[bytes]:
+        pipeline = redis_client.pipeline(transaction=False).lrange(self.key(chat_id), start, end)
+        if touch:
+            self._touch(pipeline, chat_id)
+        return pipeline.execute()[0]
+
+    def _load(self, chat_id: str, redis_client) -> bool:
+        """Put the history of a chat missing from Redis back in it; returns whether it has messages."""
+        if redis_client.exists(self.empty_key(chat_id)):
+            return False
+        legacy_key = self.LEGACY_KEY_FMT.format(chat_id=chat_id)
+        legacy = redis_client.get(legacy_key)
+        if legacy is not None:
+            messages = pickle.loads(legacy)
+            self.log.info(f"Converting the pickled history of chat {chat_id} ({len(messages)} messages) to a list")
+        elif self.loader is not None:
+            messages = self.loader(chat_id)
+        else:
+            return False
+        if messages:
+            self._fill(chat_id, messages, redis_client)
+        if legacy is not None:
+            redis_client.delete(legacy_key)
+        return bool(messages)
+
+    def _fill(self, chat_id: str, messages: List[Message], redis_client):
+        """Store a loaded history, unless messages were appended to the chat in the meantime."""
+        key = self.key(chat_id)
+        with redis_client.pipeline(transaction=True) as pipeline:
+            try:
+                pipeline.watch(key)
+                if pipeline.exists(key):
+                    return
+                pipeline.multi()
+                self._touch(pipeline.rpush(key, *[pack_message(message) for message in messages]), chat_id)
+                pipeline.execute()
+            except WatchError:
+                pass
@@ -0,0 +1,257 @@
+import os
+import socket
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import msgpack
+from redis.exceptions import RedisError, ResponseError
+from sqlalchemy import insert
+from sqlalchemy.exc import OperationalError
+
+from weschatbot.log.logging_mixin import LoggingMixin
+from weschatbot.models.user import ChatMessage, ChatSession, ChatTurn, Query
+from weschatbot.schemas.chat import Message
+from weschatbot.services.chat_history import make_turn, pack_turn, unpack_turn
+from weschatbot.utils.config import config
+from weschatbot.utils.db import provide_session
+from weschatbot.utils.redis_config import DB_CHAT, get_redis_client
+
+
+class ChatTurnWriter(LoggingMixin):
+    """
+    Write-behind persistence of chat turns.
+
+    ``submit`` adds a turn (its messages and the query results of its question) to a Redis stream, so the
+    websocket handler does not wait for MySQL. A background thread reads the stream with a consumer group and
+    writes each batch of turns in one transaction, the query results with a single bulk insert.
+
+    A turn stays in the stream until it is written: turns read by a worker that died are claimed again after
+    ``[chat_history] write_claim_idle`` seconds, turns the database rejects are moved to ``FAILED_KEY`` and turns
+    are written synchronously when Redis is unavailable. Delivery is at least once, so each written turn is
+    recorded as a ChatTurn row in the same transaction and a turn already recorded is skipped. Its messages are
+    ordered by the time the turn was submitted, since writers may commit the turns of a chat out of order.
+
+    Failed turns are reported every ``[chat_history] failed_alert_interval`` seconds until they are put back in
+    the stream with ``requeue_failed`` (``weschatbot chatbot requeue_failed_turns``).
+    """
+
+    STREAM_KEY = "chat:turns"
+    FAILED_KEY = "chat:turns:failed"
+    GROUP = "writers"
+    # (id, sender) of the messages of a written turn
+    TURN_KEY_FMT = "chat:turn:{turn_id}"
+    TURN_TTL = 3600
+
+    def __init__(self, batch_size: Optional[int] = None, interval: Optional[float] = None,
+                 claim_idle: Optional[float] = None, failed_alert_interval: Optional[float] = None):
+        self.batch_size = batch_size or config.getint("chat_history", "write_batch_size", fallback=100)
+        self.interval = interval if interval is not None else config.getfloat("chat_history", "write_interval",
+                                                                              fallback=1)
+        self.claim_idle = claim_idle if claim_idle is not None else config.getfloat("chat_history",
+                                                                                    "write_claim_idle", fallback=60)
+        self.failed_alert_interval = failed_alert_interval if failed_alert_interval is not None else \
+            config.getfloat("chat_history", "failed_alert_interval", fallback=300)
+        self.consumer = f"{socket.gethostname()}:{os.getpid()}"
+        self._group_ready = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def redis(self):
+        return get_redis_client(DB_CHAT)
+
+    def submit(self, user_id: int, chat_id: str, messages: List[Message], query_results: Iterable = ()) -> str:
+        """Queue a turn for the database; returns its id, see ``message_ids``."""
+        turn = make_turn(user_id, chat_id, messages, query_results)
+        try:
+            self.redis.xadd(self.STREAM_KEY, {"turn": pack_turn(turn)})
+        except RedisError as e:
+            self.log.warning(f"Could not queue turn {turn['id']} of chat {chat_id}, writing it now: {e}")
+            written = self.persist([turn])
+            try:
+                self._remember(written)
+            except RedisError as e:
+                # the turn is written, only its message ids are not cached
+                self.log.warning(f"Could not remember the message ids of turn {turn['id']}: {e}")
+        return turn["id"]
+
+    def message_ids(self, turn_id: str) -> Optional[List[Tuple[int, str]]]:
+        """(id, sender) of the messages of a turn, None while it is not written yet."""
+        packed = self.redis.get(self.TURN_KEY_FMT.format(turn_id=turn_id))
+        return [tuple(x) for x in msgpack.unpackb(packed)] if packed else None
+
+    @provide_session
+    def persist(self, turns: List[dict], session=None) -> Dict[str, List[Tuple[int, str]]]:
+        """
+        Write turns in one transaction, skipping those already written; returns the (id, sender) of the messages
+        of each turn.
+        """
+        turns = list({turn["id"]: turn for turn in turns}.values())
+        written = {turn_id: [] for (turn_id,) in
+                   session.query(ChatTurn.id).filter(ChatTurn.id.in_([turn["id"] for turn in turns]))}
+        if written:
+            self.log.info(f"Skipping {len(written)} chat turns delivered again, they are already written")
+            for turn_id, message_id, sender in (session.query(ChatMessage.turn_id, ChatMessage.id, ChatMessage.sender)
+                                                .filter(ChatMessage.turn_id.in_(list(written)))
+                                                .order_by(ChatMessage.id)):
+                written[turn_id].append((message_id, sender))
+            turns = [turn for turn in turns if turn["id"] not in written]
+        if not turns:
+            return written
+
+        uuids = {turn["chat_id"] for turn in turns}
+        chat_ids = dict(session.query(ChatSession.uuid, ChatSession.id).filter(ChatSession.uuid.in_(uuids)).all())
+
+        for turn in turns:
+            if turn["chat_id"] not in chat_ids:
+                chat = ChatSession(name=turn["messages"][0][2][0:31], uuid=turn["chat_id"], user_id=turn["user_id"],
+                                   status_id=1)
+                session.add(chat)
+                session.flush()
+                chat_ids[chat.uuid] = chat.id
+        # a turn written concurrently by another writer fails this flush on its primary key
+        session.add_all([ChatTurn(id=turn["id"], chat_id=chat_ids[turn["chat_id"]],
+                                  submitted_at=turn.get("submitted_at") or time.time_ns() // 1000)
+                         for turn in turns])
+        session.flush()
+
+        turn_messages = [[
+            ChatMessage(name=text[0:31], content=text, sender=sender, chat_id=chat_ids[turn["chat_id"]],
+                        turn_id=turn["id"])
+            for sender, _, text in turn["messages"]
+        ] for turn in turns]
+        session.add_all([message for messages in turn_messages for message in messages])
+        session.flush()
+
+        query_rows = []
+        for turn, messages in zip(turns, turn_messages):
+            questions = [message for message in messages if message.sender == "user"]
+            if not questions:
+                continue
+            query_rows.extend({
+                "message_id": questions[-1].id,
+                "document_id": document_id,
+                "row_id": row_id,
+                "document_text": document_text,
+                "cosine_score": cosine_score,
+                "rank": rank,
+                "collection_id": collection_id,
+            } for document_id, row_id, document_text, cosine_score, rank, collection_id in turn["queries"])
+        if query_rows:
+            session.execute(insert(Query), query_rows)
+
+        written.update({turn["id"]: [(message.id, message.sender) for message in messages]
+                        for turn, messages in zip(turns, turn_messages)})
+        return written
+
+    def drain(self, block_ms: Optional[int] = None) -> int:
+        """
+        Write one batch of turns, those abandoned by a dead worker first, waiting up to ``block_ms`` for new ones.
+        Returns the number of turns read.
+        """
+        self._ensure_group()
+        entries = self.redis.xautoclaim(self.STREAM_KEY, self.GROUP, self.consumer, int(self.claim_idle * 1000),
+                                        start_id="0-0", count=self.batch_size)[1]
+        if not entries:
+            response = self.redis.xreadgroup(self.GROUP, self.consumer, {self.STREAM_KEY: ">"},
+                                             count=self.batch_size, block=block_ms)
+            entries = response[0][1] if response else []
+        if not entries:
+            return 0
+
+        entry_ids = [entry_id for entry_id, _ in entries]
+        # entries deleted from the stream while pending have no fields
+        turns = [unpack_turn(fields[b"turn"]) for _, fields in entries if fields]
+        written = self._write(turns) if turns else {}
+
+        pipeline = self.redis.pipeline()
+        self._remember(written, pipeline)
+        pipeline.xack(self.STREAM_KEY, self.GROUP, *entry_ids)
+        pipeline.xdel(self.STREAM_KEY, *entry_ids)
+        pipeline.execute()
+        return len(turns)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="chat-turn-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 30):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def failed_count(self) -> int:
+        return self.redis.xlen(self.FAILED_KEY)
+
+    def requeue_failed(self, count: Optional[int] = None) -> int:
+        """Put turns the database rejected back in the stream, oldest first; returns the number requeued."""
+        entries = self.redis.xrange(self.FAILED_KEY, count=count)
+        for entry_id, fields in entries:
+            pipeline = self.redis.pipeline()
+            pipeline.xadd(self.STREAM_KEY, {"turn": fields[b"turn"]})
+            pipeline.xdel(self.FAILED_KEY, entry_id)
+            pipeline.execute()
+        return len(entries)
+
+    def _run(self):
+        next_alert = 0
+        while not self._stop.is_set():
+            try:
+                self.drain(block_ms=int(self.interval * 1000))
+                if self.failed_alert_interval and time.monotonic() >= next_alert:
+                    next_alert = time.monotonic() + self.failed_alert_interval
+                    failed = self.failed_count()
+                    if failed:
+                        self.log.error(f"{failed} chat turns could not be written to the database, see "
+                                       f"'{self.FAILED_KEY}'; requeue them with 'weschatbot chatbot "
+                                       f"requeue_failed_turns' once the cause is fixed")
+            except Exception as e:
+                self.log.error(f"Failed writing chat turns, retrying in {self.interval}s: {e}")
+                self._stop.wait(self.interval)
+        # turns queued before stopping; any left over are claimed by another worker
+        try:
+            while self.drain():
+                pass
+        except Exception as e:
+            self.log.error(f"Failed writing the last chat turns: {e}")
+
+    def _ensure_group(self):
+        if self._group_ready:
+            return
+        try:
+            self.redis.xgroup_create(self.STREAM_KEY, self.GROUP, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+        self._group_ready = True
+
+    def _write(self, turns: List[dict]) -> Dict[str, List[Tuple[int, str]]]:
+        try:
+            return self.persist(turns)
+        except OperationalError:
+            # database unavailable: leave the batch pending, it is claimed again later
+            raise
+        except Exception as e:
+            self.log.error(f"Failed writing {len(turns)} chat turns together, writing them one by one: {e}")
+
+        written = {}
+        for turn in turns:
+            try:
+                written.update(self.persist([turn]))
+            except OperationalError:
+                raise
+            except Exception as e:
+                self.log.exception(f"Failed writing turn {turn['id']} of chat {turn['chat_id']}: {e}")
+                self.redis.xadd(self.FAILED_KEY, {"turn": pack_turn(turn), "error": str(e)})
+        return written
+
+    def _remember(self, written: Dict[str, List[Tuple[int, str]]], pipeline=None):
+        client = pipeline if pipeline is not None else self.redis
+        for turn_id, message_ids in written.items():
+            client.setex(self.TURN_KEY_FMT.format(turn_id=turn_id), self.TURN_TTL, msgpack.packb(message_ids))
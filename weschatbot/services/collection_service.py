@@ -1,124 +1,104 @@
-import base64
+import json
 import logging
 
-from pymilvus import connections, FieldSchema, CollectionSchema, DataType, utility, Collection
+from pymilvus import utility, Collection
 from pymilvus import list_collections
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import joinedload
 
 from weschatbot.exceptions.collection_exception import CollectionNotFoundException, \
-    ExistingCollectionDocumentException, StatusNotFound
+    ExistingCollectionDocumentException, StatusNotFound, NoPreviousGenerationException
 from weschatbot.log.logging_mixin import LoggingMixin
+from weschatbot.models.job import Job, JobStatus
 from weschatbot.models.user import Collection as WCollection, Document, DocumentStatus, CollectionDocumentStatus, \
     CollectionDocument
-from weschatbot.schemas.collection import CollectionDesc, MilvusNotFoundCollectionDesc
-from weschatbot.services.celery_service import index_collection_to_milvus
+from weschatbot.schemas.collection import CollectionDesc, MilvusNotFoundCollectionDesc, TokenLengthReport
+from weschatbot.services.celery_service import index_collection_to_milvus, bulk_load_collection, \
+    rebuild_collection, remove_documents_from_milvus
+from weschatbot.services.document.collection_alias import CollectionAlias, generation_name
+from weschatbot.services.document.collection_index import CollectionIndexBuilder
+from weschatbot.services.collection_stats import CollectionStatsCache, collect_token_counts
+from weschatbot.services.document.columnar_insert import collection_schema
+from weschatbot.services.entity_browser import EntityBrowser, browse_fields, decode_token
+from weschatbot.services.milvus_handles import MilvusHandleManager
 from weschatbot.utils.db import provide_session
 
 logger = logging.getLogger(__name__)
 
 
-class Base64URL:
-    @staticmethod
-    def decode(data):
-        missing_padding = len(data) % 4
-        if missing_padding:
-            data += '=' * (4 - missing_padding)
-        return base64.urlsafe_b64decode(data).decode('utf-8')
-
-    @staticmethod
-    def encode(data):
-        return base64.urlsafe_b64encode(data.encode()).decode().rstrip("=")
-
-
 class CollectionService(LoggingMixin):
     def __init__(self, host, port):
         self.host = host
         self.port = port
+        self.handles = MilvusHandleManager()
+        self.browser = EntityBrowser(self.handles)
+        self.stats_cache = CollectionStatsCache()
 
     def connect(self):
-        connections.connect(host=self.host, port=self.port)
+        self.handles.connect(host=self.host, port=self.port)
 
     def all_collections(self):
-        connections.connect(host=self.host, port=self.port)
+        self.connect()
         collections = list_collections()
         return collections
 
     def get_entities_by_token(self, token, output_fields=None, **kwargs):
-        decoded = Base64URL.decode(token)
-        min_row_id, limit, *collection_names = decoded.split(':')
-        collection_name = ":".join(collection_names)
-
+        after_row_id, limit, collection_name = decode_token(token)
         self.connect()
-        collection = Collection(collection_name)
-        collection.load()
-
-        if output_fields is None:
-            output_fields = [field.name for field in collection.schema.fields]
-
-        results = collection.query(limit=int(limit), expr=f"row_id > {int(min_row_id)}", output_fields=output_fields)
-        max_row_id = results[-1]["row_id"]
-        if len(results) < int(limit):
-            return results, None
-        next_token = f"{max_row_id}:{limit}:{collection_name}"
-        return results, Base64URL.encode(next_token)
+        return self.browser.page(collection_name, after_row_id=after_row_id, limit=limit,
+                                 output_fields=output_fields, token=token)
 
-    def get_entity_by_row_id(self, collection_name, row_id, output_fields=None, **kwargs):
+    def get_entity_by_row_id(self, collection_name, row_id, output_fields=None, with_vectors=False, **kwargs):
+        """Look up one entity; its vectors are only returned with ``with_vectors``."""
         self.connect()
-        collection = Collection(collection_name)
-        collection.load()
+        collection = self.handles.collection(collection_name)
 
         if output_fields is None:
-            output_fields = [field.name for field in collection.schema.fields]
+            output_fields = [field.name for field in collection.schema.fields] if with_vectors \
+                else browse_fields(collection.schema)
 
-        result = collection.query(
+        result = self.handles.query(
+            collection_name,
             expr=f"row_id == {int(row_id)}",
-            out_fields=output_fields
+            output_fields=output_fields
         )
         return result, None
 
     def get_entities(self, collection_name, output_fields=None, limit=20, **kwargs):
         self.connect()
-        collection = Collection(collection_name)
-
-        collection.load()
-
-        if output_fields is None:
-            output_fields = [field.name for field in collection.schema.fields]
-
-        results = collection.query(
-            expr="row_id >= 0",
-            output_fields=output_fields,
-            limit=limit
-        )
-
-        max_row_id = results[-1]["row_id"]
-        if len(results) < limit:
-            return results, None
-        next_token = f"{max_row_id}:{limit}:{collection_name}"
-        return results, Base64URL.encode(next_token)
+        return self.browser.page(collection_name, limit=limit, output_fields=output_fields)
 
     @provide_session
     def get_collection(self, collection_id, session=None):
         collection = session.query(WCollection).filter(WCollection.id == collection_id).one_or_none()
         if collection:
-            self.connect()
             collection_name = collection.name
-            if not utility.has_collection(collection_name):
-                # raise CollectionNotFoundException(f"Collection {collection_name} is not found")
-                return MilvusNotFoundCollectionDesc(collection_id, collection_name)
-            res = Collection(collection_name)
-            return CollectionDesc(collection_id=collection_id, collection_name=collection_name,
-                                  description=res.description,
-                                  num_entities=res.num_entities, fields=res.schema.fields, indexes=res.indexes,
-                                  status=collection.status.name)
+            stats = self.stats_cache.get(collection_id)
+            if stats is None:
+                self.connect()
+                if not utility.has_collection(collection_name):
+                    return MilvusNotFoundCollectionDesc(collection_id, collection_name)
+                stats = self.stats_cache.refresh(collection_id, collection_name)
+            return CollectionDesc.from_stats(collection_id, stats, status=collection.status.name,
+                                             ready_at=collection.ready_at, index_detail=collection.index_detail)
 
         raise CollectionNotFoundException(f"Collection {collection_id} is not found in DB")
 
+    @provide_session
+    def token_length_report(self, collection_id, batch_size=1000, min_tokens=256, max_tokens=1024, session=None):
+        collection = session.get(WCollection, collection_id)
+        if collection is None:
+            raise CollectionNotFoundException(f"Collection {collection_id} is not found")
+        self.connect()
+        token_counts, legacy = collect_token_counts(self.handles.collection(collection.name), batch_size)
+        return TokenLengthReport(collection_id, collection.name, token_counts, unknown=legacy,
+                                 min_tokens=min_tokens, max_tokens=max_tokens)
+
     def delete_milvus_collection(self, collection_name):
         self.connect()
-        if utility.has_collection(collection_name):
-            utility.drop_collection(collection_name)
+        alias = CollectionAlias(collection_name)
+        if alias.target() is not None:
+            alias.drop()
             return True
         else:
             raise CollectionNotFoundException(f"Collection {collection_name} is not found")
@@ -129,8 +109,11 @@ class CollectionService(LoggingMixin):
         if collection:
             collection_name = collection.name
             self.connect()
-            if utility.has_collection(collection_name):
-                utility.drop_collection(collection_name)
+            alias = CollectionAlias(collection_name)
+            if collection.previous_generation is not None:
+                self.handles.drop_collection(generation_name(collection_name, collection.previous_generation))
+            alias.drop()
+            self.stats_cache.forget(collection_id)
             try:
                 session.query(CollectionDocument) \
                     .filter_by(collection_id=collection_id) \
@@ -150,52 +133,25 @@ class CollectionService(LoggingMixin):
             milvus_port: int = 19530,
             overwrite: bool = False
     ):
-        connections.connect(
-            alias="default",
-            host=milvus_host,
-            port=milvus_port
-        )
+        handles = MilvusHandleManager()
+        handles.connect(host=milvus_host, port=milvus_port)
 
         if utility.has_collection(collection_name):
             if overwrite:
-                utility.drop_collection(collection_name)
+                CollectionAlias(collection_name).drop()
                 logger.info(f"Dropped existing collection '{collection_name}'")
             else:
                 logger.info(f"Collection '{collection_name}' already exists, will refer to this collection.")
                 return True
 
-        fields = [
-            FieldSchema(name="row_id", dtype=DataType.INT64, is_primary=True, auto_id=True),
-            FieldSchema(name="doc_id", dtype=DataType.VARCHAR, max_length=128),
-            FieldSchema(name="document_name", dtype=DataType.VARCHAR, max_length=512),
-            FieldSchema(name="modified_date", dtype=DataType.VARCHAR, max_length=128, nullable=True),
-            FieldSchema(name="text", dtype=DataType.VARCHAR, max_length=65535, nullable=True),
-            FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=dim),
-            FieldSchema(name="file_path", dtype=DataType.VARCHAR, max_length=1024),
-            FieldSchema(name="created_at", dtype=DataType.VARCHAR, max_length=128, nullable=True),
-        ]
-
-        schema = CollectionSchema(
-            fields=fields,
-            description="Document collection with chunked text and embeddings"
-        )
+        schema = collection_schema(dim)
 
-        schema.enable_dynamic_field = True
-
-        collection = Collection(
+        Collection(
             name=collection_name,
             schema=schema,
         )
-
-        index_params = {
-            "metric_type": "COSINE",
-            "index_type": "IVF_FLAT",
-            "params": {"nlist": 128}
-        }
-        collection.create_index(
-            field_name="embedding",
-            index_params=index_params
-        )
+        # indexed and loaded up front: indexing queries the stored rows before writing
+        CollectionIndexBuilder(collection_name).ensure_loaded()
 
         logger.info(f"Successfully created collection '{collection_name}' with custom schema (dim={dim})")
         return True
@@ -271,21 +227,43 @@ class CollectionService(LoggingMixin):
 
     @provide_session
     def remove_document_from_collection(self, collection_id: int, document_id: int, session=None):
-        link = session.query(CollectionDocument).filter_by(
-            collection_id=collection_id,
-            document_id=document_id
-        ).first()
-
-        if not link:
+        if not self.remove_documents_from_collection(collection_id, [document_id], session=session):
             raise ExistingCollectionDocumentException("Document is not in collection")
 
-        session.delete(link)
+    @provide_session
+    def remove_documents_from_collection(self, collection_id: int, document_ids, session=None) -> int:
+        """
+        Mark documents "removing" in a collection and queue the deletion of their chunks from Milvus as one task,
+        which unlinks them once their chunks are gone. Removing them again queues the task again.
+
+        :return: the number of documents removed, ids not linked to the collection are ignored
+        """
+        collection = session.get(WCollection, collection_id)
+        if collection is None:
+            raise CollectionNotFoundException(f"Collection {collection_id} is not found")
+        removing = session.query(CollectionDocumentStatus).filter(
+            CollectionDocumentStatus.name == "removing"
+        ).one_or_none()
+        if removing is None:
+            raise StatusNotFound("'removing' status not found. Please run command 'alembic upgrade head'.")
+
+        links = (
+            session.query(CollectionDocument)
+            .options(joinedload(CollectionDocument.document))
+            .filter(CollectionDocument.collection_id == collection_id)
+            .filter(CollectionDocument.document_id.in_(document_ids))
+            .all()
+        )
+        if not links:
+            return 0
+
+        file_paths = {str(link.document_id): link.document.path for link in links}
+        for link in links:
+            link.status = removing
+        session.commit()
 
-        remaining_links = session.query(CollectionDocument).filter_by(document_id=document_id).count()
-        if remaining_links == 0:
-            doc = session.get(Document, document_id)
-            if doc:
-                doc.is_used = False
+        remove_documents_from_milvus.delay(collection.name, file_paths, collection_id=collection_id)
+        return len(links)
 
     @provide_session
     def index_collection(self, collection_id: int, session=None):
@@ -294,17 +272,62 @@ class CollectionService(LoggingMixin):
             collection_name = collection.name
             index_collection_to_milvus.delay(collection_id, collection_name)
 
+    @staticmethod
+    def _queue_collection_job(collection_id: int, task, name: str, session=None) -> int:
+        """Create an approved job running ``task`` on a collection; returns the job id."""
+        collection = session.get(WCollection, collection_id)
+        if collection is None:
+            raise CollectionNotFoundException(f"Collection {collection_id} is not found")
+        approved = session.query(JobStatus).filter(JobStatus.name == "approved").one_or_none()
+        if approved is None:
+            raise StatusNotFound("'approved' status not found. Please run command 'alembic upgrade head'.")
+
+        job = Job(
+            name=f"{name} {collection.name}"[:63],
+            class_name=task.name,
+            params=json.dumps({"collection_id": collection.id, "collection_name": collection.name}),
+            status=approved,
+        )
+        session.add(job)
+        session.commit()
+        return job.id
+
+    @provide_session
+    def bulk_load_collection(self, collection_id: int, session=None) -> int:
+        """Queue a bulk import of the new documents of a collection as an approved job; returns the job id."""
+        return self._queue_collection_job(collection_id, bulk_load_collection, "bulk load", session=session)
+
+    @provide_session
+    def rebuild_collection(self, collection_id: int, session=None) -> int:
+        """Queue a blue/green rebuild of a collection as an approved job; returns the job id."""
+        return self._queue_collection_job(collection_id, rebuild_collection, "rebuild", session=session)
+
+    @provide_session
+    def rollback_collection(self, collection_id: int, session=None) -> int:
+        """Point a collection back at its previous generation; returns the generation now live."""
+        collection = session.get(WCollection, collection_id)
+        if collection is None:
+            raise CollectionNotFoundException(f"Collection {collection_id} is not found")
+        if collection.previous_generation is None:
+            raise NoPreviousGenerationException(f"Collection {collection.name} has no previous generation")
+
+        self.connect()
+        previous = generation_name(collection.name, collection.previous_generation)
+        if not utility.has_collection(previous):
+            raise CollectionNotFoundException(f"Collection {previous} is not found")
+        CollectionAlias(collection.name).swap(previous)
+        collection.generation, collection.previous_generation = collection.previous_generation, collection.generation
+        session.commit()
+        return collection.generation
+
     @provide_session
     def flush(self, collection_id, session=None):
         collection = session.get(WCollection, collection_id)
         if collection:
             collection_name = collection.name
             self.connect()
-            if utility.has_collection(collection_name):
-                collection = Collection(collection_name)
-                collection.flush()
-            else:
-                raise CollectionNotFoundException(f"Collection {collection_name} is not found")
+            self.handles.collection(collection_name, load=False).flush()
+            self.stats_cache.refresh(collection_id, collection_name)
         else:
             raise CollectionNotFoundException(f"Collection {collection_id} is not found")
 
@@ -315,9 +338,9 @@ class CollectionService(LoggingMixin):
             if collection:
                 self.connect()
                 collection_name = collection.name
-                milvus_collection = Collection(collection_name)
+                milvus_collection = self.handles.collection(collection_name, load=False)
+                # not flushed: the delete is visible to queries right away
                 milvus_collection.delete(expr=f"row_id == {int(row_id)}")
-                milvus_collection.flush()
             else:
                 raise CollectionNotFoundException(f"Collection {collection_id} is not found")
         except ValueError as e:
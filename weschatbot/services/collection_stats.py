@@ -0,0 +1,114 @@
+import json
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from pymilvus import Collection, utility
+
+from weschatbot.log.logging_mixin import LoggingMixin
+from weschatbot.schemas.collection import CollectionDesc
+from weschatbot.utils.config import config
+from weschatbot.utils.redis_config import DB_CACHE, get_redis_client
+
+
+def collect_stats(collection_name: str, using: str = "default") -> dict:
+    """
+    Snapshot of a collection as shown by the management UI: schema, indexes, entity count, loaded segments,
+    their memory size and the index build progress. Figures Milvus cannot report are None.
+    """
+    collection = Collection(collection_name, using=using)
+    stats = {
+        "collection_name": collection_name,
+        "description": collection.description,
+        "fields": [CollectionDesc.make_field(field) for field in collection.schema.fields],
+        "indexes": [CollectionDesc.make_index(index) for index in collection.indexes],
+        "num_entities": collection.num_entities,
+        "num_segments": None,
+        "memory_size": None,
+        "indexed_rows": None,
+        "total_rows": None,
+        "updated_at": datetime.now().isoformat(timespec="seconds"),
+    }
+    try:
+        segments = utility.get_query_segment_info(collection_name, using=using)
+        stats["num_segments"] = len(segments)
+        stats["memory_size"] = sum(segment.mem_size for segment in segments)
+    except Exception:
+        # not loaded, or not supported by the server
+        pass
+    if collection.has_index():
+        progress = utility.index_building_progress(collection_name, using=using)
+        stats["indexed_rows"] = progress.get("indexed_rows")
+        stats["total_rows"] = progress.get("total_rows")
+    return stats
+
+
+def collect_token_counts(collection: Collection, batch_size: int = 1000) -> Tuple[List[int], int]:
+    """
+    Token counts of the chunks of a collection, and the number of legacy rows without one.
+
+    ``token_count`` is a nullable INT64 field of ``collection_schema``: it is null for rows written without a
+    count. Collections created before the field was declared do not have it, all their rows are legacy rows.
+    """
+    if "token_count" not in {field.name for field in collection.schema.fields}:
+        return [], _count_rows(collection, "")
+
+    legacy = _count_rows(collection, "token_count is null")
+    iterator = collection.query_iterator(batch_size=batch_size, expr="token_count is not null",
+                                         output_fields=["token_count"])
+    token_counts = []
+    try:
+        while True:
+            rows = iterator.next()
+            if not rows:
+                break
+            token_counts.extend(int(row["token_count"]) for row in rows)
+    finally:
+        iterator.close()
+    return token_counts, legacy
+
+
+def _count_rows(collection: Collection, expr: str) -> int:
+    return collection.query(expr=expr, output_fields=["count(*)"])[0]["count(*)"]
+
+
+class CollectionStatsCache(LoggingMixin):
+    """
+    Collection statistics cached in Redis, so detail views and status polls do not query Milvus.
+
+    Snapshots are refreshed every ``[collection_stats] refresh_interval`` seconds by the scheduler and after
+    index jobs; one older than ``max_age`` seconds expires and is collected again on the next read.
+    """
+
+    key_prefix = "collection_stats:"
+
+    def __init__(self, max_age: Optional[int] = None):
+        self.max_age = max_age if max_age is not None else config.getint("collection_stats", "max_age", fallback=600)
+
+    @property
+    def redis(self):
+        return get_redis_client(DB_CACHE)
+
+    def get(self, collection_id: int) -> Optional[dict]:
+        try:
+            cached = self.redis.get(f"{self.key_prefix}{collection_id}")
+        except Exception as e:
+            self.log.error(f"Failed reading the statistics of collection {collection_id}: {e}")
+            return None
+        return json.loads(cached) if cached else None
+
+    def put(self, collection_id: int, stats: dict):
+        try:
+            self.redis.setex(f"{self.key_prefix}{collection_id}", self.max_age, json.dumps(stats))
+        except Exception as e:
+            self.log.error(f"Failed caching the statistics of collection {collection_id}: {e}")
+
+    def refresh(self, collection_id: int, collection_name: str, using: str = "default") -> dict:
+        stats = collect_stats(collection_name, using=using)
+        self.put(collection_id, stats)
+        return stats
+
+    def forget(self, collection_id: int):
+        try:
+            self.redis.delete(f"{self.key_prefix}{collection_id}")
+        except Exception as e:
+            self.log.error(f"Failed removing the statistics of collection {collection_id}: {e}")
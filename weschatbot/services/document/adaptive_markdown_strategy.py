@@ -1,5 +1,5 @@
 import re
-from typing import List, Dict
+from typing import List, Dict, Optional
 
 from llama_index.core import Document as LlamaDocument
 from llama_index.core.node_parser import (
@@ -8,6 +8,21 @@ from llama_index.core.node_parser import (
 )
 
 from weschatbot.services.document.base_chunking import BaseChunkingStrategy
+from weschatbot.services.document.token_counter import TokenCounter
+
+IMAGE_PATTERNS = [
+    # (cheap substring that must be present for the pattern to match, compiled pattern)
+    ('![', re.compile(r'!\[.*?\]\(.*?\.(jpg|jpeg|png|gif|svg|bmp|webp|ico).*?\)', flags=re.IGNORECASE)),
+    ('<', re.compile(r'<img[^>]*>', flags=re.IGNORECASE)),
+    ('://', re.compile(r'https?://\S+\.(jpg|jpeg|png|gif|svg|bmp|webp|ico)\b', flags=re.IGNORECASE)),
+]
+
+TABLE_SEPARATOR_PATTERN = re.compile(r'^\s*\|?[\s\-:|]+\|[\s\-:|]*$')
+
+# Line kinds produced by the single-pass scanner
+LINE_TEXT = 0
+LINE_BLANK = 1
+LINE_TABLE = 2
 
 
 class AdaptiveMarkdownStrategy(BaseChunkingStrategy):
@@ -28,7 +43,9 @@ class AdaptiveMarkdownStrategy(BaseChunkingStrategy):
             table_context_lines_after: int = 2,
             min_words_per_chunk: int = 30,
             remove_image_references: bool = True,
-            merge_short_chunks: bool = True
+            merge_short_chunks: bool = True,
+            tokenizer_name: Optional[str] = None,
+            token_counter: Optional[TokenCounter] = None
     ):
         super().__init__(chunk_size, chunk_overlap, min_chunk_size, max_chunk_size)
         self.min_tokens = min_tokens
@@ -44,16 +61,29 @@ class AdaptiveMarkdownStrategy(BaseChunkingStrategy):
         self.remove_image_references = remove_image_references
         self.merge_short_chunks = merge_short_chunks
 
-        # LlamaIndex parsers with token-based sizing
-        # Approximate: 1 token ≈ 0.75 words, so adjust chunk_size accordingly
-        token_based_chunk_size = int(max_tokens * 0.75)  # ~768 words for 1024 tokens
+        # Exact token counts from the embedding model's tokenizer when available, otherwise estimated
+        if token_counter is None and tokenizer_name:
+            token_counter = TokenCounter.from_pretrained(tokenizer_name)
+        self.token_counter = token_counter
 
         self.markdown_parser = MarkdownNodeParser()
-        self.sentence_splitter = SentenceSplitter(
-            chunk_size=token_based_chunk_size,
-            chunk_overlap=int(chunk_overlap * 0.75),
-            paragraph_separator="\n\n"
-        )
+        if self.token_counter is not None:
+            self.sentence_splitter = SentenceSplitter(
+                chunk_size=max_tokens,
+                chunk_overlap=chunk_overlap,
+                paragraph_separator="\n\n",
+                tokenizer=self.token_counter.tokenize
+            )
+        else:
+            # LlamaIndex parsers with token-based sizing
+            # Approximate: 1 token ≈ 0.75 words, so adjust chunk_size accordingly
+            token_based_chunk_size = int(max_tokens * 0.75)  # ~768 words for 1024 tokens
+
+            self.sentence_splitter = SentenceSplitter(
+                chunk_size=token_based_chunk_size,
+                chunk_overlap=int(chunk_overlap * 0.75),
+                paragraph_separator="\n\n"
+            )
 
     def chunk_markdown(self, content: str, metadata: Dict = None) -> List[LlamaDocument]:
         metadata = metadata or {}
@@ -75,12 +105,23 @@ class AdaptiveMarkdownStrategy(BaseChunkingStrategy):
         return self.add_context_to_chunks(chunks)
 
     def _estimate_tokens(self, text: str) -> int:
+        if self.token_counter is not None:
+            return self.token_counter.count(text)
         return len(text) // 4
 
+    def count_tokens(self, texts: List[str]) -> List[int]:
+        if self.token_counter is not None:
+            return self.token_counter.count_batch(texts)
+        return [self._estimate_tokens(text) for text in texts]
+
     def _validate_token_limits(self, chunks: List[LlamaDocument]) -> List[LlamaDocument]:
         validated = []
         i = 0
 
+        if self.token_counter is not None:
+            # one batched tokenizer call; the per-chunk counts below are served from the cache
+            self.token_counter.count_batch([chunk.text for chunk in chunks])
+
         while i < len(chunks):
             current = chunks[i]
             token_count = self._estimate_tokens(current.text)
@@ -124,18 +165,35 @@ class AdaptiveMarkdownStrategy(BaseChunkingStrategy):
 
         # Use SentenceSplitter to split intelligently
         nodes = self.sentence_splitter.get_nodes_from_documents([doc])
+        if self.token_counter is not None:
+            self.token_counter.count_batch([node.text for node in nodes])
 
         chunks = []
         for node in nodes:
             node_tokens = self._estimate_tokens(node.text)
             if node_tokens > self.max_tokens:
                 sentences = node.text.split('. ')
+                if self.token_counter is not None:
+                    self.token_counter.count_batch(sentences)
                 current_chunk = []
                 current_tokens = 0
 
                 for sentence in sentences:
                     sentence_tokens = self._estimate_tokens(sentence)
 
+                    if sentence_tokens > self.max_tokens and self.token_counter is not None:
+                        # a single sentence over the limit: cut it at token boundaries
+                        if current_chunk:
+                            chunks.append(LlamaDocument(
+                                text='. '.join(current_chunk) + '.',
+                                metadata={**metadata}
+                            ))
+                            current_chunk = []
+                            current_tokens = 0
+                        for piece in self.token_counter.split(sentence, self.max_tokens):
+                            chunks.append(LlamaDocument(text=piece, metadata={**metadata}))
+                        continue
+
                     if current_tokens + sentence_tokens <= self.max_tokens:
                         current_chunk.append(sentence)
                         current_tokens += sentence_tokens
@@ -162,25 +220,37 @@ class AdaptiveMarkdownStrategy(BaseChunkingStrategy):
         return chunks
 
     def _remove_images(self, content: str) -> str:
-        patterns = [
-            r'!\[.*?\]\(.*?\.(jpg|jpeg|png|gif|svg|bmp|webp|ico).*?\)',
-            r'<img[^>]*>',
-            r'https?://\S+\.(jpg|jpeg|png|gif|svg|bmp|webp|ico)\b'
-        ]
-        for pattern in patterns:
-            content = re.sub(pattern, '', content, flags=re.IGNORECASE)
+        for marker, pattern in IMAGE_PATTERNS:
+            if marker in content:
+                content = pattern.sub('', content)
         return content
 
+    def _classify_lines(self, lines: List[str]) -> tuple:
+        """Classify every line once: returns (kinds, separators) aligned with ``lines``."""
+        kinds = []
+        separators = []
+        for line in lines:
+            pipes = line.count('|')
+            if pipes >= 3:
+                kinds.append(LINE_TABLE)
+            elif line.strip():
+                kinds.append(LINE_TEXT)
+            else:
+                kinds.append(LINE_BLANK)
+            separators.append(pipes > 0 and TABLE_SEPARATOR_PATTERN.match(line) is not None)
+        return kinds, separators
+
     def _split_tables_and_text(self, content: str) -> List[Dict]:
         sections = []
         lines = content.split('\n')
+        kinds, separators = self._classify_lines(lines)
         i = 0
 
         while i < len(lines):
-            if self._is_table_line(lines[i]):
-                section, i = self._extract_table_section(lines, i)
+            if kinds[i] == LINE_TABLE:
+                section, i = self._extract_table_section(lines, i, kinds, separators)
             else:
-                section, i = self._extract_text_section(lines, i)
+                section, i = self._extract_text_section(lines, i, kinds)
 
             if section['content'].strip():
                 sections.append(section)
@@ -188,28 +258,29 @@ class AdaptiveMarkdownStrategy(BaseChunkingStrategy):
         return sections
 
     def _is_table_line(self, line: str) -> bool:
-        return '|' in line and line.count('|') >= 3
+        return line.count('|') >= 3
 
     def _is_table_separator(self, line: str) -> bool:
-        return bool(re.match(r'^\s*\|?[\s\-:|]+\|[\s\-:|]*$', line))
+        return '|' in line and TABLE_SEPARATOR_PATTERN.match(line) is not None
 
-    def _extract_table_section(self, lines: List[str], start: int) -> tuple:
+    def _extract_table_section(self, lines: List[str], start: int, kinds: List[int],
+                               separators: List[bool]) -> tuple:
         ctx_before = [
             lines[j] for j in range(max(0, start - self.table_context_lines_before), start)
-            if lines[j].strip() and not self._is_table_line(lines[j])
+            if kinds[j] == LINE_TEXT
         ]
 
-        table_lines = []
+        table_indices = []
         header = None
         i = start
 
         while i < len(lines):
-            if self._is_table_line(lines[i]):
-                table_lines.append(lines[i])
-                if not header and i + 1 < len(lines) and self._is_table_separator(lines[i + 1]):
+            if kinds[i] == LINE_TABLE:
+                table_indices.append(i)
+                if not header and i + 1 < len(lines) and separators[i + 1]:
                     header = [lines[i], lines[i + 1]]
                 i += 1
-            elif not lines[i].strip() and i + 1 < len(lines) and self._is_table_line(lines[i + 1]):
+            elif kinds[i] == LINE_BLANK and i + 1 < len(lines) and kinds[i + 1] == LINE_TABLE:
                 i += 1
             else:
                 i += 1
@@ -217,25 +288,26 @@ class AdaptiveMarkdownStrategy(BaseChunkingStrategy):
 
         ctx_after = [
             lines[j] for j in range(i, min(i + self.table_context_lines_after, len(lines)))
-            if lines[j].strip() and not self._is_table_line(lines[j])
+            if kinds[j] == LINE_TEXT
         ]
 
+        # Table lines always contain '|' so they are never blank
+        row_count = sum(1 for j in table_indices if not separators[j])
+
         return {
             'type': 'table',
-            'content': '\n'.join(table_lines),
+            'content': '\n'.join(lines[j] for j in table_indices),
             'header': header,
-            'row_count': sum(1 for d in table_lines if d.strip() and not self._is_table_separator(d)),
+            'row_count': row_count,
             'context_before': '\n'.join(ctx_before[-self.table_context_lines_before:]),
             'context_after': '\n'.join(ctx_after[:self.table_context_lines_after])
         }, i
 
-    def _extract_text_section(self, lines: List[str], start: int) -> tuple:
-        text_lines = []
+    def _extract_text_section(self, lines: List[str], start: int, kinds: List[int]) -> tuple:
         i = start
-        while i < len(lines) and not self._is_table_line(lines[i]):
-            text_lines.append(lines[i])
+        while i < len(lines) and kinds[i] != LINE_TABLE:
             i += 1
-        return {'type': 'text', 'content': '\n'.join(text_lines)}, i
+        return {'type': 'text', 'content': '\n'.join(lines[start:i])}, i
 
     def _chunk_text_with_llamaindex(self, content: str, metadata: Dict) -> List[LlamaDocument]:
         if not content.strip():
@@ -329,8 +401,7 @@ class AdaptiveMarkdownStrategy(BaseChunkingStrategy):
 
         while i < len(chunks):
             current = chunks[i]
-            word_count = len(current.text.split())
-            if word_count < self.min_words_per_chunk and i + 1 < len(chunks):
+            if i + 1 < len(chunks) and self._has_fewer_words(current.text, self.min_words_per_chunk):
                 next_chunk = chunks[i + 1]
                 combined_text = f"{current.text}\n\n{next_chunk.text}"
 
@@ -353,10 +424,9 @@ class AdaptiveMarkdownStrategy(BaseChunkingStrategy):
                     i += 2
                     continue
 
-            # Split oversized chunks
+            # Split oversized chunks; the splitter only reads the document, so no copy is needed
             if len(current.text) > self.max_chunk_size:
-                doc = LlamaDocument(text=current.text, metadata=current.metadata)
-                split_nodes = self.sentence_splitter.get_nodes_from_documents([doc])
+                split_nodes = self.sentence_splitter.get_nodes_from_documents([current])
                 for node in split_nodes:
                     merged.append(LlamaDocument(
                         text=node.text,
@@ -369,3 +439,8 @@ class AdaptiveMarkdownStrategy(BaseChunkingStrategy):
             i += 1
 
         return merged
+
+    @staticmethod
+    def _has_fewer_words(text: str, limit: int) -> bool:
+        # Same answer as len(text.split()) < limit without splitting the whole chunk
+        return len(text.split(maxsplit=limit)) < limit
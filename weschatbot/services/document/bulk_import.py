@@ -0,0 +1,207 @@
+import json
+import shutil
+import time
+import uuid
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from pymilvus import BulkInsertState, Collection, DataType, utility
+
+from weschatbot.log.logging_mixin import LoggingMixin
+from weschatbot.services.document.collection_index import CollectionIndexBuilder
+from weschatbot.services.document.columnar_insert import ColumnBatch
+
+# column holding the dynamic fields of a row, as a JSON object
+DYNAMIC_FIELD = "$meta"
+
+
+def _arrow_type(field):
+    import pyarrow as pa
+
+    if field.dtype == DataType.FLOAT_VECTOR:
+        return pa.list_(pa.float32())
+    if field.dtype == DataType.INT64:
+        return pa.int64()
+    # VARCHAR, and JSON which Milvus reads from a string column
+    return pa.string()
+
+
+class ParquetChunkWriter:
+    """
+    Write chunk batches as Parquet files matching a collection schema, rolling to a new file every
+    ``max_rows_per_file`` rows.
+
+    Batch columns the schema does not declare go to the ``$meta`` column when the collection has dynamic fields.
+    """
+
+    def __init__(self, fields, folder: str, enable_dynamic_field: bool = True, max_rows_per_file: int = 100000):
+        import pyarrow as pa
+
+        self.fields = [field for field in fields if not field.auto_id]
+        self.generated = {field.name for field in fields if field.auto_id}
+        self.folder = Path(folder)
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self.enable_dynamic_field = enable_dynamic_field
+        self.max_rows_per_file = max_rows_per_file
+        columns = [pa.field(field.name, _arrow_type(field)) for field in self.fields]
+        if enable_dynamic_field:
+            columns.append(pa.field(DYNAMIC_FIELD, pa.string()))
+        self.schema = pa.schema(columns)
+        self.files: List[Path] = []
+        self.rows = 0
+        self._writer = None
+        self._file_rows = 0
+
+    def _table(self, batch: ColumnBatch):
+        import pyarrow as pa
+
+        arrays = []
+        for field in self.fields:
+            values = batch.column(field.name)
+            if field.dtype == DataType.FLOAT_VECTOR:
+                arrays.append(pa.FixedSizeListArray.from_arrays(values.reshape(-1), values.shape[1])
+                              .cast(pa.list_(pa.float32())))
+            elif field.dtype == DataType.JSON:
+                arrays.append(pa.array([json.dumps(x) if x is not None else None for x in values], pa.string()))
+            else:
+                arrays.append(pa.array(values, _arrow_type(field)))
+        if self.enable_dynamic_field:
+            declared = {field.name for field in self.fields} | self.generated
+            extra = [name for name in batch.columns if name not in declared]
+            arrays.append(pa.array([
+                json.dumps({name: batch.columns[name][i] for name in extra if batch.columns[name][i] is not None})
+                for i in range(len(batch))
+            ], pa.string()))
+        return pa.Table.from_arrays(arrays, schema=self.schema)
+
+    def write(self, batch: ColumnBatch):
+        import pyarrow.parquet as pq
+
+        start = 0
+        while start < len(batch):
+            if self._writer is None:
+                path = self.folder / f"part-{len(self.files):05d}.parquet"
+                self._writer = pq.ParquetWriter(str(path), self.schema)
+                self.files.append(path)
+                self._file_rows = 0
+            stop = min(len(batch), start + self.max_rows_per_file - self._file_rows)
+            self._writer.write_table(self._table(batch.slice(start, stop)))
+            self._file_rows += stop - start
+            self.rows += stop - start
+            start = stop
+            if self._file_rows >= self.max_rows_per_file:
+                self.close()
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+class MilvusBulkImporter(LoggingMixin):
+    """
+    Load chunk rows into a collection with Milvus bulk import instead of insert calls.
+
+    Batches are staged as local Parquet files; ``run`` uploads them to the object storage bucket of Milvus,
+    submits one import task per file and waits for all of them, reporting progress through ``progress``.
+    With ``defer_index`` the vector index is dropped before importing, to be built once by
+    ``CollectionIndexBuilder.finalize``.
+    """
+
+    def __init__(self, collection_name: str, staging_folder: str, endpoint: str, access_key: str, secret_key: str,
+                 bucket: str = "a-bucket", secure: bool = False, max_rows_per_file: int = 100000,
+                 poll_interval: float = 5.0, defer_index: bool = True, using: str = "default"):
+        self.collection_name = collection_name
+        self.run_id = uuid.uuid4().hex
+        self.staging_folder = Path(staging_folder) / self.run_id
+        self.endpoint = endpoint
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.bucket = bucket
+        self.secure = secure
+        self.max_rows_per_file = max_rows_per_file
+        self.poll_interval = poll_interval
+        self.defer_index = defer_index
+        self.using = using
+        self._writer: Optional[ParquetChunkWriter] = None
+
+    @property
+    def writer(self) -> ParquetChunkWriter:
+        if self._writer is None:
+            schema = Collection(self.collection_name, using=self.using).schema
+            self._writer = ParquetChunkWriter(schema.fields, str(self.staging_folder),
+                                              enable_dynamic_field=schema.enable_dynamic_field,
+                                              max_rows_per_file=self.max_rows_per_file)
+        return self._writer
+
+    @property
+    def rows(self) -> int:
+        return self._writer.rows if self._writer is not None else 0
+
+    def write(self, batch: ColumnBatch):
+        if len(batch):
+            self.writer.write(batch)
+
+    def _client(self):
+        from minio import Minio
+
+        return Minio(self.endpoint, access_key=self.access_key, secret_key=self.secret_key, secure=self.secure)
+
+    def upload(self) -> List[str]:
+        client = self._client()
+        if not client.bucket_exists(self.bucket):
+            raise ValueError(f"Bucket '{self.bucket}' not found, it must be the bucket Milvus stores its data in")
+        remote_files = []
+        for path in self._writer.files:
+            remote = f"bulk_import/{self.collection_name}/{self.run_id}/{path.name}"
+            client.fput_object(self.bucket, remote, str(path))
+            remote_files.append(remote)
+        self.log.info(f"Uploaded {len(remote_files)} Parquet files ({self.rows} rows) to bucket '{self.bucket}'")
+        return remote_files
+
+    def wait(self, task_ids: List[int], progress: Optional[Callable[[int, str], None]] = None) -> int:
+        states: Dict[int, BulkInsertState] = {}
+        while True:
+            for task_id in task_ids:
+                states[task_id] = utility.get_bulk_insert_state(task_id, using=self.using)
+
+            failed = [state for state in states.values()
+                      if state.state in (BulkInsertState.ImportFailed, BulkInsertState.ImportFailedAndCleaned)]
+            if failed:
+                raise RuntimeError(f"Bulk import task {failed[0].task_id} failed: {failed[0].failed_reason}")
+
+            done = sum(1 for state in states.values() if state.state == BulkInsertState.ImportCompleted)
+            percent = sum(state.progress for state in states.values()) // len(task_ids)
+            rows = sum(state.row_count for state in states.values())
+            if progress is not None:
+                progress(percent, f"bulk import: {done}/{len(task_ids)} files done, {rows}/{self.rows} rows")
+            if done == len(task_ids):
+                return rows
+            time.sleep(self.poll_interval)
+
+    def run(self, progress: Optional[Callable[[int, str], None]] = None) -> int:
+        """Import the staged rows and wait for the import to complete; returns the number of imported rows."""
+        if not self.rows:
+            return 0
+        self._writer.close()
+        try:
+            remote_files = self.upload()
+            if self.defer_index:
+                # imported segments are indexed once afterwards instead of one by one
+                CollectionIndexBuilder(self.collection_name, using=self.using).drop_index()
+            task_ids = [utility.do_bulk_insert(self.collection_name, files=[remote], using=self.using)
+                        for remote in remote_files]
+            self.log.info(f"Submitted {len(task_ids)} bulk import tasks to collection '{self.collection_name}'")
+            rows = self.wait(task_ids, progress)
+            client = self._client()
+            for remote in remote_files:
+                client.remove_object(self.bucket, remote)
+            self.log.info(f"Bulk imported {rows} rows into collection '{self.collection_name}'")
+            return rows
+        finally:
+            self.cleanup()
+
+    def cleanup(self):
+        if self._writer is not None:
+            self._writer.close()
+        shutil.rmtree(self.staging_folder, ignore_errors=True)
@@ -0,0 +1,181 @@
+import hashlib
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from llama_index.core import Document as LlamaDocument
+
+
+def chunk_hash(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def chunk_id(doc_id: str, chunk_index: int, content_hash: str) -> int:
+    """
+    Deterministic row id of a chunk, so writing the same chunk again overwrites its row.
+
+    :return: a positive 63-bit integer derived from the doc id, the chunk index and the content hash
+    """
+    digest = hashlib.sha256(f"{doc_id}:{chunk_index}:{content_hash}".encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') & 0x7FFFFFFFFFFFFFFF
+
+
+class ChunkDiff:
+    """
+    Difference between freshly chunked documents and the rows already stored for them.
+
+    ``to_insert`` are the chunks whose content is not stored yet, ``to_delete`` the row ids of chunks that
+    vanished from every document referencing them and ``to_rewrite`` maps row ids of shared (deduplicated)
+    chunks to their remaining ``(doc_id, source_doc_ids)``.
+    """
+
+    def __init__(self, to_insert: List[LlamaDocument], to_delete: List[int], to_rewrite: Dict[int, Tuple[str, list]],
+                 unchanged: int):
+        self.to_insert = to_insert
+        self.to_delete = to_delete
+        self.to_rewrite = to_rewrite
+        self.unchanged = unchanged
+
+    @staticmethod
+    def sources(row) -> List[str]:
+        return list(row.get('source_doc_ids') or [str(row['doc_id'])])
+
+    @classmethod
+    def compute(cls, chunks_by_doc: Dict[str, List[LlamaDocument]], file_paths: Dict[str, str],
+                stored_rows: List[dict]) -> 'ChunkDiff':
+        """
+        :param chunks_by_doc: new chunks per doc id, each carrying ``chunk_hash`` metadata
+        :param file_paths: file path per doc id, used to find rows indexed before chunk hashes existed
+        :param stored_rows: rows with ``row_id``, ``doc_id``, ``file_path`` and optionally ``chunk_hash`` and
+            ``source_doc_ids``
+        """
+        doc_by_path = {path: doc_id for doc_id, path in file_paths.items()}
+        rows = {row['row_id']: row for row in stored_rows}
+        sources = {row_id: cls.sources(row) for row_id, row in rows.items()}
+
+        def referenced_by(row):
+            docs = {doc_id for doc_id in sources[row['row_id']] if doc_id in chunks_by_doc}
+            if row.get('chunk_hash') is None and row.get('file_path') in doc_by_path:
+                docs.add(doc_by_path[row['file_path']])
+            return docs
+
+        stored_hashes: Dict[str, set] = {doc_id: set() for doc_id in chunks_by_doc}
+        references = {}
+        for row_id, row in rows.items():
+            references[row_id] = referenced_by(row)
+            for doc_id in references[row_id]:
+                if row.get('chunk_hash') is not None:
+                    stored_hashes[doc_id].add(row['chunk_hash'])
+
+        to_insert = []
+        unchanged = 0
+        new_hashes: Dict[str, set] = {}
+        for doc_id, chunks in chunks_by_doc.items():
+            new_hashes[doc_id] = {chunk.metadata['chunk_hash'] for chunk in chunks}
+            for chunk in chunks:
+                if chunk.metadata['chunk_hash'] in stored_hashes[doc_id]:
+                    unchanged += 1
+                else:
+                    to_insert.append(chunk)
+
+        to_delete = []
+        to_rewrite = {}
+        for row_id, row in rows.items():
+            vanished_for = {doc_id for doc_id in references[row_id]
+                            if row.get('chunk_hash') not in new_hashes[doc_id]}
+            if not vanished_for:
+                continue
+
+            if row.get('chunk_hash') is None:
+                # indexed before chunk hashes: it cannot be matched, so the new chunks replace it
+                to_delete.append(row_id)
+                continue
+
+            remaining = [doc_id for doc_id in sources[row_id] if doc_id not in vanished_for]
+            if not remaining:
+                to_delete.append(row_id)
+            else:
+                doc_id = str(row['doc_id'])
+                to_rewrite[row_id] = (doc_id if doc_id in remaining else remaining[0], remaining)
+
+        return cls(to_insert, to_delete, to_rewrite, unchanged)
+
+
+def merge_changes(to_delete: List[int], to_rewrite: Dict[int, Tuple[str, list]], diff: ChunkDiff):
+    """
+    Add the deletes and rewrites of ``diff`` to changes held back from earlier diffs. Every diff is computed
+    against the same stored rows, so a shared chunk rewritten by several of them keeps only the sources they all
+    keep, and is deleted once none remain.
+    """
+    deleted = set(to_delete)
+    for row_id in diff.to_delete:
+        to_rewrite.pop(row_id, None)
+        if row_id not in deleted:
+            deleted.add(row_id)
+            to_delete.append(row_id)
+
+    for row_id, (doc_id, remaining) in diff.to_rewrite.items():
+        if row_id in deleted:
+            continue
+        if row_id not in to_rewrite:
+            to_rewrite[row_id] = (doc_id, remaining)
+            continue
+        owner, sources = to_rewrite[row_id]
+        kept = [x for x in sources if x in remaining]
+        if not kept:
+            del to_rewrite[row_id]
+            deleted.add(row_id)
+            to_delete.append(row_id)
+        else:
+            to_rewrite[row_id] = (owner if owner in kept else kept[0], kept)
+
+
+def quote(value: str) -> str:
+    """A string literal of a Milvus filter expression."""
+    return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def stored_rows(collection, file_paths: Dict[str, str], batch_size: int = 1000) -> List[dict]:
+    """
+    Rows stored in a Milvus collection for the given documents, including chunks shared with them and rows
+    indexed before chunk hashes existed (found by their file path), as needed by ``ChunkDiff.compute``.
+    """
+    if not file_paths:
+        return []
+
+    doc_ids = ", ".join(quote(doc_id) for doc_id in file_paths)
+    paths = ", ".join(quote(path) for path in file_paths.values() if path)
+    expr = f"doc_id in [{doc_ids}] or json_contains_any(source_doc_ids, [{doc_ids}])"
+    if paths:
+        expr += f" or file_path in [{paths}]"
+
+    iterator = collection.query_iterator(batch_size=batch_size, expr=expr,
+                                         output_fields=["row_id", "doc_id", "file_path", "chunk_hash",
+                                                        "source_doc_ids"])
+    rows = []
+    try:
+        while True:
+            batch = iterator.next()
+            if not batch:
+                break
+            rows.extend(batch)
+    finally:
+        iterator.close()
+    return rows
+
+
+def reassign(rows: List[dict], to_rewrite: Dict[int, Tuple[str, list]],
+             document_paths: Optional[Callable[[List[str]], Dict[str, str]]] = None) -> List[dict]:
+    """
+    Apply ``ChunkDiff.to_rewrite`` to full rows of shared chunks. A row changing owner also takes the file path
+    and document name of its new owner, looked up with ``document_paths`` (file path per doc id).
+    """
+    owners = sorted({to_rewrite[row["row_id"]][0] for row in rows
+                     if to_rewrite[row["row_id"]][0] != str(row["doc_id"])})
+    paths = document_paths(owners) if owners and document_paths is not None else {}
+    for row in rows:
+        doc_id, sources = to_rewrite[row["row_id"]]
+        if doc_id != str(row["doc_id"]) and paths.get(doc_id):
+            row["file_path"] = paths[doc_id]
+            row["document_name"] = Path(paths[doc_id]).name
+        row["doc_id"], row["source_doc_ids"] = doc_id, sources
+    return rows
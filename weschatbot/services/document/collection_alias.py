@@ -0,0 +1,67 @@
+from typing import Optional
+
+from pymilvus import Collection, MilvusException, utility
+
+from weschatbot.log.logging_mixin import LoggingMixin
+from weschatbot.services.milvus_handles import MilvusHandleManager
+
+
+def generation_name(name: str, generation: int) -> str:
+    """Milvus collection holding one build (generation) of the collection ``name``."""
+    return f"{name}__g{generation}"
+
+
+class CollectionAlias(LoggingMixin):
+    """
+    A collection name served through a Milvus alias, so a rebuilt collection replaces the live one atomically.
+
+    Readers (retrieval, management pages) keep using ``name``; ``swap`` points it at another generation and
+    returns the previous one, which stays loaded for an instant rollback with another ``swap``.
+    Collections created before rebuilds are a plain collection called ``name``: the first swap renames it to
+    generation 0 and creates the alias in its place.
+    """
+
+    def __init__(self, name: str, using: str = "default"):
+        self.name = name
+        self.using = using
+
+    def target(self) -> Optional[str]:
+        """The Milvus collection ``name`` resolves to, ``name`` itself when it is not an alias yet."""
+        try:
+            return Collection(self.name, using=self.using).describe()["collection_name"]
+        except MilvusException:
+            return None
+
+    def swap(self, collection_name: str) -> Optional[str]:
+        """Point the alias at ``collection_name``; returns the collection it pointed at before, if any."""
+        previous = self.target()
+        if previous == collection_name:
+            return previous
+        if previous is None:
+            utility.create_alias(collection_name, self.name, using=self.using)
+        elif previous == self.name:
+            retired = generation_name(self.name, 0)
+            utility.rename_collection(self.name, retired, using=self.using)
+            utility.create_alias(collection_name, self.name, using=self.using)
+            previous = retired
+        else:
+            utility.alter_alias(collection_name, self.name, using=self.using)
+        MilvusHandleManager().invalidate(self.name, self.using)
+        self.log.info(f"Collection '{self.name}' now serves '{collection_name}' (was '{previous}')")
+        return previous
+
+    def drop(self, collection_name: Optional[str] = None):
+        """Drop a generation, or the alias and the collection it points at when ``collection_name`` is None."""
+        handles = MilvusHandleManager()
+        if collection_name is not None:
+            if collection_name == self.target():
+                raise ValueError(f"'{collection_name}' is the live collection of '{self.name}'")
+            handles.drop_collection(collection_name, self.using)
+            return
+        target = self.target()
+        if target is None:
+            return
+        if target != self.name:
+            utility.drop_alias(self.name, using=self.using)
+        handles.drop_collection(target, self.using)
+        handles.invalidate(self.name, self.using)
@@ -0,0 +1,141 @@
+import math
+import time
+from typing import Callable, Dict, Optional
+
+from pymilvus import Collection, utility
+from pymilvus.client.types import LoadState
+
+from weschatbot.log.logging_mixin import LoggingMixin
+
+VECTOR_FIELD = "embedding"
+
+
+def vector_index_params(rows: int) -> dict:
+    """IVF_FLAT parameters for ``rows`` vectors: about 4 * sqrt(rows) clusters, no fewer than 128."""
+    return {
+        "metric_type": "COSINE",
+        "index_type": "IVF_FLAT",
+        "params": {"nlist": min(65536, max(128, int(4 * math.sqrt(rows))))}
+    }
+
+
+class CollectionIndexBuilder(LoggingMixin):
+    """
+    Make a collection query-ready once data has been written: flush, compact, build the vector index over the
+    loaded data and load the collection into memory.
+
+    The index is only created when missing, sized from the row count, so a collection filled before its index
+    exists (a bulk load, a rebuilt generation) is indexed once instead of segment by segment while it is written.
+    After an incremental run only ``rows_written`` rows changed: compaction is skipped below ``compact_min_rows``
+    and an existing index is not waited for, its new segments are indexed in the background.
+    """
+
+    def __init__(self, collection_name: str, index_params: Optional[dict] = None, compact: bool = True,
+                 compact_min_rows: int = 0, poll_interval: float = 2.0, timeout: Optional[float] = None,
+                 using: str = "default"):
+        self.collection_name = collection_name
+        self.index_params = index_params
+        self.compact = compact
+        self.compact_min_rows = compact_min_rows
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.using = using
+
+    @property
+    def collection(self) -> Collection:
+        return Collection(self.collection_name, using=self.using)
+
+    def create_index(self, rows: Optional[int] = None):
+        collection = self.collection
+        rows = collection.num_entities if rows is None else rows
+        params = self.index_params or vector_index_params(rows)
+        self.log.info(f"Building the vector index of collection '{self.collection_name}' for {rows} rows: {params}")
+        collection.create_index(field_name=VECTOR_FIELD, index_params=params)
+
+    def is_loaded(self) -> bool:
+        return utility.load_state(self.collection_name, using=self.using) == LoadState.Loaded
+
+    def ensure_loaded(self):
+        """Make the collection queryable: load it, first building its vector index if it has none."""
+        if self.is_loaded():
+            return
+        collection = self.collection
+        if not collection.has_index():
+            collection.flush()
+            self.create_index()
+        collection.load()
+
+    def drop_index(self):
+        """Release the collection and drop its vector index, so the next writes are indexed once by ``finalize``."""
+        collection = self.collection
+        if collection.has_index():
+            collection.release()
+            collection.drop_index()
+            self.log.info(f"Dropped the vector index of collection '{self.collection_name}' until it is finalized")
+
+    def _poll(self, step: str, check: Callable[[], tuple], progress: Optional[Callable[[str, int, str], None]]):
+        """Call ``check`` until it reports completion; ``check`` returns ``(percent, detail)``."""
+        started = time.monotonic()
+        while True:
+            percent, detail = check()
+            if progress is not None:
+                progress(step, percent, detail)
+            if percent >= 100:
+                return
+            if self.timeout is not None and time.monotonic() - started > self.timeout:
+                raise TimeoutError(f"{step} of collection '{self.collection_name}' did not complete "
+                                   f"in {self.timeout}s: {detail}")
+            time.sleep(self.poll_interval)
+
+    def _index_progress(self):
+        state = utility.index_building_progress(self.collection_name, using=self.using)
+        total = state.get("total_rows", 0)
+        indexed = state.get("indexed_rows", 0)
+        pending = state.get("pending_index_rows", 0)
+        percent = 100 if not pending and indexed >= total else (indexed * 100 // total if total else 0)
+        return percent, f"{indexed}/{total} rows indexed"
+
+    def _load_progress(self):
+        state = utility.loading_progress(self.collection_name, using=self.using)
+        percent = int(str(state.get("loading_progress", "0")).rstrip("%") or 0)
+        return percent, f"{percent}% loaded"
+
+    def finalize(self, progress: Optional[Callable[[str, int, str], None]] = None,
+                 rows_written: Optional[int] = None) -> Dict[str, float]:
+        """
+        :param progress: called with ``(step, percent, detail)`` while a step runs
+        :param rows_written: rows inserted, deleted or rewritten since the last finalize, None when unknown
+        :return: seconds spent in each step
+        """
+        collection = self.collection
+        durations: Dict[str, float] = {}
+
+        started = time.perf_counter()
+        collection.flush()
+        durations["flush"] = time.perf_counter() - started
+
+        if self.compact and (rows_written is None or rows_written >= self.compact_min_rows):
+            started = time.perf_counter()
+            if progress is not None:
+                progress("compact", 0, "compacting segments")
+            collection.compact()
+            collection.wait_for_compaction_completed(timeout=self.timeout)
+            durations["compact"] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        created = not collection.has_index()
+        if created:
+            self.create_index(collection.num_entities)
+        if created or rows_written is None:
+            self._poll("index", self._index_progress, progress)
+            durations["index"] = time.perf_counter() - started
+
+        if created or rows_written is None or not self.is_loaded():
+            started = time.perf_counter()
+            collection.load(_async=True)
+            self._poll("load", self._load_progress, progress)
+            durations["load"] = time.perf_counter() - started
+
+        self.log.info(f"Collection '{self.collection_name}' is query-ready: " + ", ".join(
+            f"{step} {seconds:.1f}s" for step, seconds in durations.items()))
+        return durations
@@ -0,0 +1,153 @@
+from typing import Dict, List, Optional
+
+import numpy as np
+from llama_index.core import Document as LlamaDocument
+from pymilvus import Collection, CollectionSchema, DataType, FieldSchema
+
+from weschatbot.log.logging_mixin import LoggingMixin
+from weschatbot.services.document.chunk_diff import chunk_hash, chunk_id
+
+# primary key, a deterministic chunk id; generated by Milvus in collections created with auto_id
+ROW_ID_FIELD = "row_id"
+# Fields of collection_schema after the row id, in schema order
+CHUNK_FIELDS = ["doc_id", "document_name", "modified_date", "text", "embedding", "file_path", "created_at"]
+# Chunk bookkeeping, declared in collections created since direct insert and dynamic in older ones
+BOOKKEEPING_FIELDS = ["chunk_index", "chunk_hash", "simhash", "source_doc_ids", "token_count"]
+
+# below the 64 MB default gRPC message limit of Milvus
+MAX_INSERT_BYTES = 48 * 1024 * 1024
+
+
+def collection_schema(dim: int = 1024) -> CollectionSchema:
+    """Schema of the chunk collections created by ``CollectionService.create_collection``."""
+    fields = [
+        FieldSchema(name="row_id", dtype=DataType.INT64, is_primary=True, auto_id=False),
+        FieldSchema(name="doc_id", dtype=DataType.VARCHAR, max_length=128),
+        FieldSchema(name="document_name", dtype=DataType.VARCHAR, max_length=512),
+        FieldSchema(name="modified_date", dtype=DataType.VARCHAR, max_length=128, nullable=True),
+        FieldSchema(name="text", dtype=DataType.VARCHAR, max_length=65535, nullable=True),
+        FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=dim),
+        FieldSchema(name="file_path", dtype=DataType.VARCHAR, max_length=1024),
+        FieldSchema(name="created_at", dtype=DataType.VARCHAR, max_length=128, nullable=True),
+        # chunk bookkeeping, declared so chunks can be inserted column-wise
+        FieldSchema(name="chunk_index", dtype=DataType.INT64, nullable=True),
+        FieldSchema(name="chunk_hash", dtype=DataType.VARCHAR, max_length=64, nullable=True),
+        FieldSchema(name="simhash", dtype=DataType.VARCHAR, max_length=16, nullable=True),
+        FieldSchema(name="source_doc_ids", dtype=DataType.JSON, nullable=True),
+        FieldSchema(name="token_count", dtype=DataType.INT64, nullable=True),
+    ]
+
+    schema = CollectionSchema(
+        fields=fields,
+        description="Document collection with chunked text and embeddings"
+    )
+
+    schema.enable_dynamic_field = True
+    return schema
+
+
+class ColumnBatch:
+    """Chunk rows as columns, with the embeddings as one float32 matrix."""
+
+    def __init__(self, columns: Dict[str, list], embeddings: np.ndarray):
+        self.columns = columns
+        self.embeddings = embeddings
+
+    @classmethod
+    def from_chunks(cls, chunks: List[LlamaDocument], embeddings: List[List[float]]) -> "ColumnBatch":
+        columns = {name: [] for name in [ROW_ID_FIELD] + CHUNK_FIELDS + BOOKKEEPING_FIELDS if name != "embedding"}
+        for chunk in chunks:
+            metadata = chunk.metadata
+            doc_id = str(metadata.get("doc_id", chunk.id_))
+            columns[ROW_ID_FIELD].append(chunk_id(doc_id, metadata.get("chunk_index", 0),
+                                                  metadata.get("chunk_hash") or chunk_hash(chunk.text)))
+            columns["text"].append(chunk.text)
+            columns["doc_id"].append(doc_id)
+            for name in ["document_name", "file_path"]:
+                columns[name].append(str(metadata.get(name) or ""))
+            for name in ["modified_date", "created_at"] + BOOKKEEPING_FIELDS:
+                columns[name].append(metadata.get(name))
+        return cls(columns, np.asarray(embeddings, dtype=np.float32))
+
+    def __len__(self):
+        return len(self.columns["text"])
+
+    def slice(self, start: int, stop: int) -> "ColumnBatch":
+        return ColumnBatch({name: values[start:stop] for name, values in self.columns.items()},
+                           self.embeddings[start:stop])
+
+    def column(self, name: str):
+        return self.embeddings if name == "embedding" else self.columns[name]
+
+    def row_bytes(self) -> int:
+        text_bytes = sum(len(x.encode("utf-8")) for x in self.columns["text"])
+        return (self.embeddings.nbytes + text_bytes) // max(1, len(self)) + 512
+
+    def rows(self, with_ids: bool = True) -> List[dict]:
+        names = [name for name in self.columns if with_ids or name != ROW_ID_FIELD]
+        res = []
+        for i in range(len(self)):
+            row = {name: self.columns[name][i] for name in names if self.columns[name][i] is not None}
+            row["embedding"] = self.embeddings[i]
+            res.append(row)
+        return res
+
+
+class ColumnarInserter(LoggingMixin):
+    """
+    Write chunk rows straight into a Milvus collection with large ``Collection.upsert`` calls.
+
+    Rows are keyed on their deterministic chunk id, so writing a batch again, e.g. when an interrupted indexing
+    run is resumed, overwrites the rows instead of duplicating them. Collections created with ``auto_id`` row ids
+    only support inserts.
+
+    When the collection declares every field of the batch, the batch is sent as columns; collections created
+    before the bookkeeping fields were declared keep them as dynamic fields, which Milvus only accepts in rows.
+    """
+
+    def __init__(self, collection_name: str, max_rows: int = 10000, using: str = "default"):
+        self.collection_name = collection_name
+        self.max_rows = max_rows
+        self.using = using
+        self._collection: Optional[Collection] = None
+        self._field_order: Optional[List[str]] = None
+        self._upsert = False
+
+    @property
+    def collection(self) -> Collection:
+        if self._collection is None:
+            self._collection = Collection(self.collection_name, using=self.using)
+            fields = self._collection.schema.fields
+            self._upsert = not next(field for field in fields if field.is_primary).auto_id
+            names = [field.name for field in fields if not field.auto_id]
+            expected = set(CHUNK_FIELDS + BOOKKEEPING_FIELDS) | ({ROW_ID_FIELD} if self._upsert else set())
+            if set(names) == expected:
+                self._field_order = names
+        return self._collection
+
+    @property
+    def columnar(self) -> bool:
+        return self.collection is not None and self._field_order is not None
+
+    @property
+    def upsert(self) -> bool:
+        """True when rows are keyed on the deterministic chunk id."""
+        return self.collection is not None and self._upsert
+
+    def _insert(self, batch: ColumnBatch):
+        if self.columnar:
+            data = [batch.column(name) for name in self._field_order]
+        else:
+            data = batch.rows(with_ids=self.upsert)
+        if self.upsert:
+            self.collection.upsert(data)
+        else:
+            self.collection.insert(data)
+
+    def insert(self, batch: ColumnBatch) -> int:
+        if not len(batch):
+            return 0
+        rows_per_call = max(1, min(self.max_rows, MAX_INSERT_BYTES // batch.row_bytes()))
+        for start in range(0, len(batch), rows_per_call):
+            self._insert(batch.slice(start, start + rows_per_call))
+        return len(batch)
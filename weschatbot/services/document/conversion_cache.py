@@ -0,0 +1,61 @@
+import hashlib
+import os
+import tempfile
+from importlib import metadata
+from typing import Optional
+
+from weschatbot.log.logging_mixin import LoggingMixin
+from weschatbot.utils.config import config
+
+# bump when the conversion itself changes (text layer reading, stitching, ...) so cached markdown is not reused
+CONVERSION_REVISION = 1
+
+
+def file_hash(path: str, chunk_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _package_version(name: str) -> str:
+    try:
+        return metadata.version(name)
+    except metadata.PackageNotFoundError:
+        return "none"
+
+
+def converter_version() -> str:
+    text_layer = config.getboolean("convert", "text_layer", fallback=True)
+    return (f"r{CONVERSION_REVISION}-marker{_package_version('marker-pdf')}"
+            f"-markitdown{_package_version('markitdown')}-text_layer{int(text_layer)}")
+
+
+class ConversionCache(LoggingMixin):
+    """
+    Converted markdown keyed by the sha256 of the source file and the converter version.
+
+    Documents with the same content share one converted file; a new converter version misses the cache.
+    """
+
+    def __init__(self, folder: Optional[str] = None, version: Optional[str] = None):
+        self.folder = folder or os.path.join(config["core"]["converted_file_folder"], "cache")
+        self.version = version or converter_version()
+        self.version_key = hashlib.sha256(self.version.encode("utf-8")).hexdigest()[:12]
+
+    def path(self, content_hash: str) -> str:
+        return os.path.join(self.folder, f"{content_hash}.{self.version_key}.converted.md")
+
+    def get(self, content_hash: str) -> Optional[str]:
+        path = self.path(content_hash)
+        return path if os.path.exists(path) else None
+
+    def put(self, content_hash: str, markdown: str) -> str:
+        os.makedirs(self.folder, exist_ok=True)
+        path = self.path(content_hash)
+        # written aside and renamed, a reader never sees a partial file
+        with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=self.folder, delete=False) as f:
+            f.write(markdown)
+        os.replace(f.name, path)
+        return path
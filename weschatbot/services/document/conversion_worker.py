@@ -0,0 +1,101 @@
+import multiprocessing
+import resource
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+from weschatbot.log.logging_mixin import LoggingMixin
+
+
+def _load_models():
+    # imported here so only the conversion process pays for torch and the Marker models
+    from weschatbot.services.document.converting import MarkerConverter, MarkitdownConverter
+    MarkerConverter()
+    MarkitdownConverter()
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _convert_in_worker(document_id, force=False):
+    from weschatbot.services.document.document_service import DocumentService
+
+    started = time.perf_counter()
+    DocumentService().convert_document(document_id, force=force)
+    return time.perf_counter() - started, _peak_rss_mb()
+
+
+class ConversionResult:
+    def __init__(self, document_id, seconds, peak_rss_mb):
+        self.document_id = document_id
+        self.seconds = seconds
+        self.peak_rss_mb = peak_rss_mb
+
+    def to_dict(self):
+        return {
+            "document_id": self.document_id,
+            "seconds": round(self.seconds, 3),
+            "peak_rss_mb": round(self.peak_rss_mb, 1),
+        }
+
+
+class ConversionWorkerPool(LoggingMixin):
+    """
+    Long-lived conversion process holding the Marker and MarkItDown models.
+
+    The models are loaded once when the process starts and reused by every job. The process is recycled after
+    ``max_jobs`` conversions or once its peak memory exceeds ``max_memory_mb``; a crashed process is replaced on
+    the next job.
+    """
+
+    def __init__(self, max_jobs: int = 50, max_memory_mb: int = 0, initializer=_load_models, job=_convert_in_worker):
+        self.max_jobs = max_jobs
+        self.max_memory_mb = max_memory_mb
+        self.initializer = initializer
+        self.job = job
+        self.jobs_done = 0
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn: the Celery worker runs threads, forking it would copy held locks into the child
+            self._executor = ProcessPoolExecutor(
+                max_workers=1,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=self.initializer,
+            )
+            self.jobs_done = 0
+        return self._executor
+
+    def _should_recycle(self, peak_rss_mb: float) -> Optional[str]:
+        if self.max_jobs and self.jobs_done >= self.max_jobs:
+            return f"{self.jobs_done} jobs done"
+        if self.max_memory_mb and peak_rss_mb > self.max_memory_mb:
+            return f"peak memory {peak_rss_mb:.0f} MB over {self.max_memory_mb} MB"
+        return None
+
+    def convert(self, document_id, force=False) -> ConversionResult:
+        with self._lock:
+            try:
+                seconds, peak_rss_mb = self._get_executor().submit(self.job, document_id, force).result()
+            except BrokenProcessPool:
+                self.log.error(f"Conversion process died on document {document_id}, restarting it")
+                self.shutdown()
+                raise
+
+            self.jobs_done += 1
+            reason = self._should_recycle(peak_rss_mb)
+            if reason:
+                self.log.info(f"Recycling conversion process: {reason}")
+                self.shutdown()
+            return ConversionResult(document_id, seconds, peak_rss_mb)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
@@ -8,7 +8,10 @@ from marker.output import text_from_rendered
 from markitdown import MarkItDown
 
 from weschatbot.log.logging_mixin import LoggingMixin
+from weschatbot.services.document.page_range_conversion import ParallelPdfConverter, stitch
+from weschatbot.services.document.text_layer import TextLayerConverter, read_text_layer
 from weschatbot.utils.common import SingletonMeta
+from weschatbot.utils.config import config
 
 logger = logging.getLogger(__name__)
 
@@ -24,12 +27,17 @@ class Converter:
 
 class MarkerConverter(Converter, metaclass=SingletonMeta):
     def __init__(self):
+        self.artifact_dict = create_model_dict()
         self.converter = PdfConverter(
-            artifact_dict=create_model_dict(),
+            artifact_dict=self.artifact_dict,
         )
 
-    def convert(self, document_path: str) -> str:
-        rendered = self.converter(str(document_path))
+    def convert(self, document_path: str, page_range=None) -> str:
+        converter = self.converter
+        if page_range is not None:
+            # the models are shared, only the processors are rebuilt for the page range
+            converter = PdfConverter(artifact_dict=self.artifact_dict, config={"page_range": list(page_range)})
+        rendered = converter(str(document_path))
 
         markdown_text, metadata, images = text_from_rendered(rendered)
         return markdown_text
@@ -44,7 +52,41 @@ class MarkitdownConverter(Converter, metaclass=SingletonMeta):
         return rendered.text_content
 
 
+class PageRangeConverter(ParallelPdfConverter, metaclass=SingletonMeta):
+    def __init__(self):
+        super().__init__(
+            workers=config.getint("convert", "pdf_workers", fallback=1),
+            pages_per_range=config.getint("convert", "pdf_pages_per_range", fallback=25),
+            min_pages=config.getint("convert", "pdf_parallel_min_pages", fallback=50),
+            worker_memory_mb=config.getint("convert", "pdf_worker_memory_mb", fallback=4096)
+        )
+
+
 class DocumentConverter(LoggingMixin):
+    @staticmethod
+    def convert_from_text_layer(document_path: str):
+        """Markdown of a PDF whose born-digital pages are read from the text layer, None if it has none."""
+        try:
+            parts = TextLayerConverter(
+                min_chars=config.getint("convert", "text_layer_min_chars", fallback=200)
+            ).plan(read_text_layer(document_path))
+        except Exception as e:
+            logger.warning(f"Cannot read the text layer of {document_path}, converting with Marker: {e}")
+            return None
+
+        text_pages = sum(1 for kind, _ in parts if kind == "text")
+        if not text_pages:
+            return None
+        logger.info(f"{document_path}: {text_pages} pages read from the text layer, "
+                    f"{sum(len(content) for kind, content in parts if kind == 'marker')} pages sent to Marker")
+        marker_parts = [content for kind, content in parts if kind == "marker"]
+        if not torch.cuda.is_available() and PageRangeConverter().should_split_pages(sum(map(len, marker_parts))):
+            converted = iter(PageRangeConverter().convert_pages(document_path, marker_parts))
+        else:
+            # Marker is only loaded when some pages need it
+            converted = (MarkerConverter().convert(document_path, page_range=content) for content in marker_parts)
+        return stitch([content if kind == "text" else next(converted) for kind, content in parts])
+
     @staticmethod
     @torch.no_grad()
     def convert(document_path: str) -> str:
@@ -55,7 +97,15 @@ class DocumentConverter(LoggingMixin):
         file_ext = input_path.suffix.lower()
 
         try:
-            if file_ext == '.pdf':
+            if file_ext == '.pdf' and config.getboolean("convert", "text_layer", fallback=True):
+                res = DocumentConverter.convert_from_text_layer(document_path)
+                if res is not None:
+                    return res
+
+            if file_ext == '.pdf' and not torch.cuda.is_available() \
+                    and PageRangeConverter().should_split(document_path):
+                return PageRangeConverter().convert(document_path)
+            elif file_ext == '.pdf':
                 with MarkerConverter() as converter:
                     res = converter.convert(document_path)
                 return res
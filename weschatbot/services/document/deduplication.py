@@ -0,0 +1,136 @@
+import hashlib
+import re
+from typing import Dict, List, Set, Tuple
+
+from llama_index.core import Document as LlamaDocument
+
+from weschatbot.log.logging_mixin import LoggingMixin
+
+SIMHASH_BITS = 64
+
+_TOKEN_PATTERN = re.compile(r'\w+', flags=re.UNICODE)
+
+
+def _feature_hash(feature: str) -> int:
+    return int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def simhash(text: str, shingle_size: int = 3) -> int:
+    """64-bit SimHash over lower-cased word shingles of ``text``."""
+    tokens = _TOKEN_PATTERN.findall(text.lower())
+    if len(tokens) > shingle_size:
+        features = [' '.join(tokens[i:i + shingle_size]) for i in range(len(tokens) - shingle_size + 1)]
+    else:
+        features = [' '.join(tokens)]
+
+    weights = [0] * SIMHASH_BITS
+    for feature in features:
+        h = _feature_hash(feature)
+        for bit in range(SIMHASH_BITS):
+            if h >> bit & 1:
+                weights[bit] += 1
+            else:
+                weights[bit] -= 1
+
+    value = 0
+    for bit in range(SIMHASH_BITS):
+        if weights[bit] > 0:
+            value |= 1 << bit
+    return value
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+class _Canonical:
+    def __init__(self, fingerprint: int, chunk: LlamaDocument):
+        self.fingerprint = fingerprint
+        self.chunk = chunk
+        self.inserted = False
+
+    @property
+    def key(self) -> str:
+        return self.chunk.metadata['simhash']
+
+
+class ChunkDeduplicator(LoggingMixin):
+    """
+    Near-duplicate chunk detector used at index time.
+
+    Two chunks are near duplicates when the Hamming distance of their SimHash fingerprints is at most
+    ``max_distance``. Only the first (canonical) chunk is embedded; its ``source_doc_ids`` metadata lists every
+    document the chunk appeared in. Candidates are found with ``max_distance + 1`` bands of the fingerprint, so
+    by the pigeonhole principle every pair within the threshold shares at least one band.
+
+    The detector keeps its state for its whole lifetime so repeated boilerplate is caught across batches of
+    one indexing job. A duplicate of a chunk that was already inserted is returned as a late reference, to be
+    added to the stored canonical row.
+
+    The band index only holds the chunks of that job (or shard of a sharded job): a chunk duplicating one stored
+    by an earlier run is kept and embedded again. Stored rows only carry the whole fingerprint, which cannot find
+    near duplicates, and a stored row may be deleted by a diff of the same run before a late reference reaches it.
+    """
+
+    def __init__(self, max_distance: int = 3, shingle_size: int = 3):
+        if not 0 <= max_distance < SIMHASH_BITS // 2:
+            raise ValueError(f"max_distance must be between 0 and {SIMHASH_BITS // 2 - 1}")
+        self.max_distance = max_distance
+        self.shingle_size = shingle_size
+        self.bands = max_distance + 1
+        self.band_bits = SIMHASH_BITS // self.bands
+        self._buckets: Dict[Tuple[int, int], List[_Canonical]] = {}
+        self._pending: List[_Canonical] = []
+        self.duplicates = 0
+
+    def _band_keys(self, fingerprint: int):
+        mask = (1 << self.band_bits) - 1
+        for band in range(self.bands):
+            yield band, fingerprint >> (band * self.band_bits) & mask
+
+    def _find(self, fingerprint: int):
+        for key in self._band_keys(fingerprint):
+            for candidate in self._buckets.get(key, []):
+                if hamming_distance(candidate.fingerprint, fingerprint) <= self.max_distance:
+                    return candidate
+        return None
+
+    def _add(self, canonical: _Canonical):
+        for key in self._band_keys(canonical.fingerprint):
+            self._buckets.setdefault(key, []).append(canonical)
+        self._pending.append(canonical)
+
+    def deduplicate(self, chunks: List[LlamaDocument]) -> Tuple[List[LlamaDocument], Dict[str, Set[str]]]:
+        """
+        :return: the chunks to embed and insert, and late references ``{simhash: {doc_id, ...}}`` for
+            canonical chunks inserted by an earlier call
+        """
+        unique = []
+        late_references: Dict[str, Set[str]] = {}
+
+        for chunk in chunks:
+            doc_id = str(chunk.metadata.get('doc_id', ''))
+            fingerprint = simhash(chunk.text, self.shingle_size)
+            canonical = self._find(fingerprint)
+
+            if canonical is None:
+                chunk.metadata['simhash'] = f"{fingerprint:016x}"
+                chunk.metadata['source_doc_ids'] = [doc_id]
+                canonical = _Canonical(fingerprint, chunk)
+                self._add(canonical)
+                unique.append(chunk)
+                continue
+
+            self.duplicates += 1
+            sources = canonical.chunk.metadata['source_doc_ids']
+            if doc_id not in sources:
+                sources.append(doc_id)
+                if canonical.inserted:
+                    late_references.setdefault(canonical.key, set()).add(doc_id)
+
+        return unique, late_references
+
+    def mark_inserted(self):
+        for canonical in self._pending:
+            canonical.inserted = True
+        self._pending = []
@@ -0,0 +1,69 @@
+from typing import Callable, Dict, List, Optional
+
+from pymilvus import Collection
+
+from weschatbot.log.logging_mixin import LoggingMixin
+from weschatbot.services.document.chunk_diff import ChunkDiff, reassign, stored_rows
+
+
+class DocumentRemover(LoggingMixin):
+    """
+    Remove the chunks of documents leaving a collection.
+
+    Chunks only these documents reference are deleted with ``row_id in [...]`` expressions of up to
+    ``batch_size`` ids; shared (deduplicated) chunks keep their row and lose the removed documents from their
+    references. Nothing is flushed: deletes are visible to queries right away and segments are sealed by
+    Milvus on its own schedule. With ``compact`` a compaction is requested afterwards, without waiting for it,
+    to reclaim the deleted rows. A shared chunk owned by a removed document moves to a remaining one, and takes
+    its file path from ``document_paths`` (file path per doc id).
+    """
+
+    def __init__(self, collection_name: str, batch_size: int = 1000, compact: bool = False,
+                 using: str = "default", document_paths: Optional[Callable[[List[str]], Dict[str, str]]] = None):
+        self.collection_name = collection_name
+        self.batch_size = batch_size
+        self.compact = compact
+        self.using = using
+        self.document_paths = document_paths
+
+    @property
+    def collection(self) -> Collection:
+        return Collection(self.collection_name, using=self.using)
+
+    def _delete(self, collection: Collection, row_ids: List[int]):
+        for start in range(0, len(row_ids), self.batch_size):
+            ids = ", ".join(str(row_id) for row_id in row_ids[start:start + self.batch_size])
+            collection.delete(expr=f"row_id in [{ids}]")
+
+    def _rewrite(self, collection: Collection, to_rewrite: Dict[int, tuple]):
+        row_ids = list(to_rewrite)
+        for start in range(0, len(row_ids), self.batch_size):
+            ids = ", ".join(str(row_id) for row_id in row_ids[start:start + self.batch_size])
+            rows = reassign(collection.query(expr=f"row_id in [{ids}]", output_fields=["*"]), to_rewrite,
+                            self.document_paths)
+            if not collection.primary_field.auto_id:
+                collection.upsert(rows)
+                continue
+            # row_id is auto generated, so updating a field means re-inserting the row
+            collection.delete(expr=f"row_id in [{', '.join(str(row.pop('row_id')) for row in rows)}]")
+            collection.insert(rows)
+
+    def remove(self, file_paths: Dict[str, str]) -> ChunkDiff:
+        """
+        :param file_paths: file path per removed doc id, to find rows indexed before chunk hashes existed
+        :return: the applied diff, with the deleted row ids and the rewritten shared chunks
+        """
+        file_paths = {str(doc_id): path for doc_id, path in file_paths.items()}
+        if not file_paths:
+            return ChunkDiff([], [], {}, 0)
+        collection = self.collection
+        # no new chunks for these documents: every chunk they reference vanishes for them
+        diff = ChunkDiff.compute({doc_id: [] for doc_id in file_paths}, file_paths,
+                                 stored_rows(collection, file_paths, self.batch_size))
+        self._delete(collection, diff.to_delete)
+        self._rewrite(collection, diff.to_rewrite)
+        if self.compact and diff.to_delete:
+            collection.compact()
+        self.log.info(f"Removed {len(file_paths)} documents from collection '{self.collection_name}': "
+                      f"{len(diff.to_delete)} chunks deleted, {len(diff.to_rewrite)} shared chunks updated")
+        return diff
@@ -1,6 +1,7 @@
 from weschatbot.exceptions.collection_exception import DocumentNotFoundError
 from weschatbot.log.logging_mixin import LoggingMixin
-from weschatbot.models.user import Document, DocumentStatus
+from weschatbot.models.user import Document, DocumentStatus, CollectionDocument, CollectionDocumentStatus
+from weschatbot.services.document.conversion_cache import ConversionCache, file_hash
 from weschatbot.services.document.converting import DocumentConverter
 from weschatbot.utils.config import config
 from weschatbot.utils.db import provide_session
@@ -10,7 +11,7 @@ class DocumentService(LoggingMixin):
     converted_file_folder = config["core"]["converted_file_folder"]
 
     @provide_session
-    def convert_document(self, document_id, session=None):
+    def convert_document(self, document_id, force=False, session=None):
         try:
             std_document_id = int(document_id)
         except ValueError as e:
@@ -19,18 +20,23 @@ class DocumentService(LoggingMixin):
         if document is None:
             raise DocumentNotFoundError(f"Document ID {std_document_id} not found")
 
-        if document.status.name != "new":
+        if document.status.name != "new" and not force:
             self.log.info("This document is already converted")
             return
 
         document_path = document.path
-        file_name = document_path.split("/")[-1]
-        converted_path = f"{self.converted_file_folder}/{file_name}.converted.md"
+        if document.content_hash is None:
+            document.content_hash = file_hash(document_path)
 
         try:
-            res = DocumentConverter.convert(document_path)
-            with open(converted_path, "w", encoding="utf-8") as f:
-                f.write(res)
+            cache = ConversionCache()
+            converted_path = None if force else cache.get(document.content_hash)
+            if converted_path is None:
+                res = DocumentConverter.convert(document_path)
+                converted_path = cache.put(document.content_hash, res)
+            else:
+                self.log.info(f"Document ID {std_document_id} has the content of an already converted file, "
+                              f"reusing {converted_path}")
 
             done_status = session.query(DocumentStatus).filter(
                 DocumentStatus.name == "done"
@@ -39,9 +45,32 @@ class DocumentService(LoggingMixin):
             document.status = done_status
             document.converted_path = converted_path
 
+            if force:
+                self.mark_collections_for_reindex(document, session=session)
+
         except DocumentNotFoundError:
             raise
 
+    @provide_session
+    def mark_collections_for_reindex(self, document, session=None):
+        """
+        Queue an indexed document again in every collection holding it.
+
+        Indexing diffs the new chunks against the stored ones, so only the edited chunks are re-embedded.
+        """
+        new_status = session.query(CollectionDocumentStatus).filter(
+            CollectionDocumentStatus.name == "new"
+        ).one_or_none()
+        links = (
+            session.query(CollectionDocument)
+            .join(CollectionDocumentStatus)
+            .filter(CollectionDocument.document_id == document.id)
+            .filter(CollectionDocumentStatus.name == "done")
+            .all()
+        )
+        for link in links:
+            link.status = new_status
+
     @provide_session
     def convert_all_documents(self, session=None):
         self.mark_in_progress(session=session)
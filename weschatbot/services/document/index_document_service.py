@@ -1,19 +1,53 @@
+import threading
 from datetime import datetime
 from pathlib import Path
-from typing import List, Optional
+from typing import Callable, Dict, List, Optional, Set, Tuple
 
-from llama_index.core import VectorStoreIndex, StorageContext
-from llama_index.vector_stores.milvus import MilvusVectorStore
+from llama_index.core import Document as LlamaDocument, StorageContext
+from llama_index.core.schema import MetadataMode, NodeRelationship, TextNode
+from llama_index.vector_stores.milvus import IndexManagement, MilvusVectorStore
+from pymilvus import Collection, connections
 from sqlalchemy.orm import joinedload
 
 from weschatbot.exceptions.collection_exception import MilvusCollectionException
 from weschatbot.log.logging_mixin import LoggingMixin
 from weschatbot.models.user import Document, CollectionDocumentStatus, CollectionDocument
-from weschatbot.services.document.adaptive_markdown_strategy import AdaptiveMarkdownStrategy
+from weschatbot.services.document.bulk_import import MilvusBulkImporter
+from weschatbot.services.document.chunk_diff import ChunkDiff, chunk_hash, merge_changes, quote, reassign, stored_rows
+from weschatbot.services.document.collection_index import CollectionIndexBuilder
+from weschatbot.services.document.columnar_insert import ColumnarInserter, ColumnBatch
+from weschatbot.services.document.deduplication import ChunkDeduplicator
+from weschatbot.services.document.parallel_chunking import ParallelChunker
+from weschatbot.services.document.staged_pipeline import StagedPipeline
 from weschatbot.services.vllm_embedding_service import VLLMEmbeddingService, VLLMEmbeddingAdapter
 from weschatbot.utils.db import provide_session
 
 
+# Chunk metadata used for bookkeeping only; kept out of the embedded and LLM text
+BOOKKEEPING_METADATA_KEYS = ["chunk_hash", "simhash", "source_doc_ids", "token_count"]
+
+
+@provide_session
+def document_paths(doc_ids: List[str], session=None) -> Dict[str, str]:
+    """File path per doc id, for the new owners of shared chunks."""
+    return {str(doc_id): path for doc_id, path in
+            session.query(Document.id, Document.path).filter(Document.id.in_([int(x) for x in doc_ids]))}
+
+
+class IndexBatch:
+    """A batch of documents moving through the indexing stages."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.failed: List[int] = []
+        self.chunks_by_doc: Dict[str, List[LlamaDocument]] = {}
+        self.file_paths: Dict[str, str] = {}
+        self.diff: Optional[ChunkDiff] = None
+        self.chunks: List[LlamaDocument] = []
+        self.late_references: Dict[str, Set[str]] = {}
+        self.embeddings: List[List[float]] = []
+
+
 class Pipeline:
     def __init__(self, *args, **kwargs):
         pass
@@ -31,6 +65,13 @@ class PipelineMilvusStore(Pipeline, LoggingMixin):
             milvus_host: Optional[str] = None,
             milvus_port: Optional[int] = None,
             metrics: str = "COSINE",
+            chunking_workers: Optional[int] = None,
+            dedup_enabled: bool = True,
+            dedup_max_distance: int = 3,
+            query_batch_size: int = 1000,
+            tokenizer_name: Optional[str] = None,
+            insert_mode: str = "direct",
+            bulk_importer: Optional[MilvusBulkImporter] = None,
             *args, **kwargs
     ):
         super().__init__(*args, **kwargs)
@@ -49,6 +90,7 @@ class PipelineMilvusStore(Pipeline, LoggingMixin):
         self.milvus_host = milvus_host if milvus_host is not None else 'localhost'
         self.milvus_port = milvus_port if milvus_port is not None else 19530
         self.metrics = metrics
+        self.query_batch_size = query_batch_size
 
         try:
             self.log.info(f"Similarity: {self.metrics}")
@@ -60,69 +102,248 @@ class PipelineMilvusStore(Pipeline, LoggingMixin):
                 similarity_metric=self.metrics,
                 text_key="text",
                 output_fields=["doc_id", "document_name", "modified_date", "text", "file_path", "created_at"],
+                # the vector index is managed by CollectionIndexBuilder
+                index_management=IndexManagement.NO_VALIDATION,
             )
             self.log.info(f"Connected to Milvus collection '{self.collection_name}' with dimension {self.dim}")
         except Exception as e:
             raise MilvusCollectionException("Error creating Milvus vector store") from e
 
         self.storage_context = StorageContext.from_defaults(vector_store=self.vector_store)
-        self.chunking_strategy = AdaptiveMarkdownStrategy()
+        if insert_mode not in ("direct", "llama_index", "bulk_import"):
+            raise ValueError(f"Unknown insert mode '{insert_mode}', expected 'direct', 'llama_index' or 'bulk_import'")
+        if insert_mode == "bulk_import" and bulk_importer is None:
+            raise ValueError("The bulk_import insert mode needs a bulk importer")
+        self.insert_mode = insert_mode
+        self.bulk_importer = bulk_importer
+        self._late_references: Dict[str, Set[str]] = {}
+        self._late_deletes: List[int] = []
+        self._late_rewrites: Dict[int, Tuple[str, list]] = {}
+        connections.connect(alias="default", host=self.milvus_host, port=self.milvus_port)
+        self.inserter = ColumnarInserter(collection_name=self.collection_name)
+        # plan() queries the stored rows: a collection left without index by a failed bulk load is indexed again
+        CollectionIndexBuilder(self.collection_name).ensure_loaded()
+        # inserted, deleted and rewritten rows, to decide how much finalizing the collection needs
+        self.rows_written = 0
+        self.chunker = ParallelChunker(
+            workers=chunking_workers,
+            strategy_kwargs={"tokenizer_name": tokenizer_name} if tokenizer_name else None
+        )
+        self.chunking_strategy = self.chunker.strategy
+        self.deduplicator = ChunkDeduplicator(max_distance=dedup_max_distance) if dedup_enabled else None
+        self._store_lock = threading.Lock()
 
     def run(self, documents: List[str], metadata_list: List[dict] = None):
+        """
+        Chunk, embed and insert ``documents``.
+
+        :return: indexes of the documents that could not be chunked; the others are indexed
+        """
         if not documents:
             self.log.warning("No documents provided to index")
+            return []
+
+        batch = self.plan(self.chunk(documents, metadata_list))
+        self.store(self.embed(batch))
+        return batch.failed
+
+    def chunk(self, documents: List[str], metadata_list: List[dict] = None) -> "IndexBatch":
+        """Chunk ``documents``; CPU bound, runs on the chunking process pool."""
+        metadatas = []
+        for i, content in enumerate(documents):
+            if metadata_list and i < len(metadata_list):
+                metadata = metadata_list[i]
+            else:
+                metadata = {
+                    "doc_id": metadata_list[i]['doc_id'],
+                    "file_path": metadata_list[i]['file_path'],
+                    "file_name": metadata_list[i]['file_name'],
+                    "document_name": metadata_list[i]['document_name'],
+                    "created_at": metadata_list[i]['created_at'],
+                    "modified_date": metadata_list[i]['modified_date'],
+                }
+            metadatas.append(metadata)
+
+        batch = IndexBatch(len(documents))
+        for i, chunks in enumerate(self.chunker.chunk(documents, metadatas)):
+            if chunks is None:
+                batch.failed.append(i)
+                continue
+
+            doc_id = str(metadatas[i]['doc_id'])
+            chunks = self.chunking_strategy.add_context_to_chunks(chunks)
+            for chunk_idx, chunk in enumerate(chunks):
+                chunk.metadata['chunk_index'] = chunk_idx
+                chunk.metadata['chunk_hash'] = chunk_hash(chunk.text)
+                chunk.excluded_embed_metadata_keys.extend(BOOKKEEPING_METADATA_KEYS)
+                chunk.excluded_llm_metadata_keys.extend(BOOKKEEPING_METADATA_KEYS)
+                # llama_index writes the source document id into the `doc_id` field
+                chunk.id_ = doc_id
+
+            batch.chunks_by_doc[doc_id] = chunks
+            batch.file_paths[doc_id] = metadatas[i].get('file_path')
+        return batch
+
+    def plan(self, batch: "IndexBatch") -> "IndexBatch":
+        """Diff the chunks against the stored rows and drop near duplicates."""
+        # serialized with store() because both use the deduplicator. It does not order them: this batch may be
+        # planned before the previous one is stored. That is fine: the diff only reads rows of this batch's own
+        # documents, and a duplicate of a chunk not stored yet is added to that chunk's sources (late references
+        # are only returned for chunks already inserted)
+        with self._store_lock:
+            batch.diff = ChunkDiff.compute(batch.chunks_by_doc, batch.file_paths, self._stored_rows(batch.file_paths))
+            self.log.info(f"{batch.diff.unchanged} chunks unchanged, {len(batch.diff.to_insert)} new, "
+                          f"{len(batch.diff.to_delete)} vanished, {len(batch.diff.to_rewrite)} shared chunks to update")
+            batch.chunks = batch.diff.to_insert
+
+            if self.deduplicator is not None and batch.chunks:
+                total = len(batch.chunks)
+                batch.chunks, batch.late_references = self.deduplicator.deduplicate(batch.chunks)
+                self.log.info(f"Dropped {total - len(batch.chunks)} near-duplicate chunks out of {total}")
+        return batch
+
+    def embed(self, batch: "IndexBatch") -> "IndexBatch":
+        """Embed the chunks to insert; bound by the embedding service."""
+        if batch.chunks:
+            texts = [chunk.get_content(metadata_mode=MetadataMode.EMBED) for chunk in batch.chunks]
+            batch.embeddings = self.embed_model.get_text_embedding_batch(texts)
+        return batch
+
+    def store(self, batch: "IndexBatch") -> "IndexBatch":
+        """Insert the embedded chunks and apply the deletions and reference updates of the diff."""
+        with self._store_lock:
+            if batch.chunks:
+                self.log.info(f"Indexing {len(batch.chunks)} chunks from {batch.size} documents "
+                              f"into collection '{self.collection_name}'")
+                # built under the lock: the deduplicator may have added sources to these chunks meanwhile
+                if self.insert_mode == "direct":
+                    self.inserter.insert(ColumnBatch.from_chunks(batch.chunks, batch.embeddings))
+                elif self.insert_mode == "bulk_import":
+                    self.bulk_importer.write(ColumnBatch.from_chunks(batch.chunks, batch.embeddings))
+                elif self.inserter.upsert:
+                    raise ValueError(f"Collection '{self.collection_name}' is keyed on chunk ids, "
+                                     f"the llama_index insert mode only supports auto_id collections")
+                else:
+                    self.vector_store.add([self._to_node(chunk, embedding)
+                                           for chunk, embedding in zip(batch.chunks, batch.embeddings)])
+                self.log.info(f"Successfully {'staged' if self.deferred else 'indexed'} {len(batch.chunks)} chunks")
+                if self.deduplicator is not None:
+                    self.deduplicator.mark_inserted()
+            else:
+                self.log.info("No new chunks to index after processing")
+
+            self.rows_written += len(batch.chunks)
+            if self.deferred:
+                # the replacements and canonical chunks are still staged: the old rows change once they are
+                # imported, so a failed import leaves the previous chunks in place
+                merge_changes(self._late_deletes, self._late_rewrites, batch.diff)
+                for key, doc_ids in batch.late_references.items():
+                    self._late_references.setdefault(key, set()).update(doc_ids)
+            else:
+                self._delete_rows(batch.diff.to_delete)
+                self._rewrite_sources(batch.diff.to_rewrite)
+                self._add_source_references(batch.late_references)
+        return batch
+
+    @staticmethod
+    def _to_node(chunk: LlamaDocument, embedding: List[float]) -> TextNode:
+        return TextNode(
+            text=chunk.text,
+            metadata=dict(chunk.metadata),
+            excluded_embed_metadata_keys=list(chunk.excluded_embed_metadata_keys),
+            excluded_llm_metadata_keys=list(chunk.excluded_llm_metadata_keys),
+            relationships={NodeRelationship.SOURCE: chunk.as_related_node_info()},
+            embedding=embedding,
+        )
+
+    def _stored_rows(self, file_paths):
+        """Rows currently stored for the given documents, including chunks shared with them."""
+        return stored_rows(Collection(self.collection_name), file_paths, self.query_batch_size)
+
+    def _delete_rows(self, row_ids):
+        if not row_ids:
+            return
+        for start in range(0, len(row_ids), self.query_batch_size):
+            self.vector_store.client.delete(self.collection_name, ids=row_ids[start:start + self.query_batch_size])
+        self.rows_written += len(row_ids)
+        self.log.info(f"Deleted {len(row_ids)} vanished chunks")
+
+    def _rewrite_rows(self, rows):
+        client = self.vector_store.client
+        self.rows_written += len(rows)
+        if self.inserter.upsert:
+            client.upsert(self.collection_name, rows)
             return
+        # row_id is auto generated, so updating a dynamic field means re-inserting the row
+        client.delete(self.collection_name, ids=[row.pop("row_id") for row in rows])
+        client.insert(self.collection_name, rows)
 
-        try:
-            all_chunks = []
-            for i, content in enumerate(documents):
-                if content:
-                    if metadata_list and i < len(metadata_list):
-                        metadata = metadata_list[i]
-                    else:
-                        metadata = {
-                            "doc_id": metadata_list[i]['doc_id'],
-                            "file_path": metadata_list[i]['file_path'],
-                            "file_name": metadata_list[i]['file_name'],
-                            "document_name": metadata_list[i]['document_name'],
-                            "created_at": metadata_list[i]['created_at'],
-                            "modified_date": metadata_list[i]['modified_date'],
-                        }
-
-                    chunks = self.chunking_strategy.chunk_markdown(content, metadata)
-                    chunks = self.chunking_strategy.add_context_to_chunks(chunks)
-
-                    for chunk_idx, chunk in enumerate(chunks):
-                        chunk.metadata['chunk_index'] = chunk_idx
-
-                    all_chunks.extend(chunks)
-
-            if not all_chunks:
-                self.log.warning("No valid chunks to index after processing")
-                return
-
-            self.log.info(
-                f"Indexing {len(all_chunks)} chunks from {len(documents)} documents into collection '{self.collection_name}'")  # noqa E501
-
-            VectorStoreIndex.from_documents(
-                all_chunks,
-                storage_context=self.storage_context,
-                embed_model=self.embed_model,
-                show_progress=True
-            )
+    def _rewrite_sources(self, to_rewrite):
+        """Drop references to documents that no longer contain a shared chunk."""
+        if not to_rewrite:
+            return
 
-            self.log.info(f"Successfully indexed {len(all_chunks)} chunks")
+        rows = reassign(self.vector_store.client.query(self.collection_name, ids=list(to_rewrite), output_fields=["*"]),
+                        to_rewrite, document_paths)
+        self._rewrite_rows(rows)
+        self.log.info(f"Updated source references of {len(rows)} shared chunks")
 
-        except Exception as e:
-            raise e
+    def _add_source_references(self, late_references):
+        """Add doc ids to canonical chunks that were inserted by an earlier batch."""
+        if not late_references:
+            return
+
+        keys = ", ".join(quote(key) for key in late_references)
+        rows = self.vector_store.client.query(self.collection_name, filter=f"simhash in [{keys}]", output_fields=["*"])
+        if not rows:
+            return
+
+        for row in rows:
+            sources = ChunkDiff.sources(row)
+            sources.extend(x for x in sorted(late_references.get(row["simhash"], ())) if x not in sources)
+            row["source_doc_ids"] = sources
+
+        self._rewrite_rows(rows)
+        self.log.info(f"Added late source references to {len(rows)} canonical chunks")
+
+    @property
+    def deferred(self) -> bool:
+        """True when stored chunks only reach the collection on ``finish``."""
+        return self.insert_mode == "bulk_import"
+
+    def finish(self, progress: Optional[Callable[[int, str], None]] = None):
+        """
+        Load the chunks staged by ``store`` in bulk import mode, then delete and update the stored rows they
+        replace.
+        """
+        if self.deferred:
+            self.bulk_importer.run(progress)
+            if self._late_deletes or self._late_rewrites or self._late_references:
+                # the import may have dropped the vector index and released the collection
+                CollectionIndexBuilder(self.collection_name).ensure_loaded()
+            self._delete_rows(self._late_deletes)
+            self._rewrite_sources(self._late_rewrites)
+            self._add_source_references(self._late_references)
+            self._late_deletes = []
+            self._late_rewrites = {}
+            self._late_references = {}
+
+    def close(self):
+        self.chunker.shutdown()
+        if self.bulk_importer is not None:
+            self.bulk_importer.cleanup()
 
 
 class IndexDocumentService(LoggingMixin):
-    def __init__(self, converter, pipeline, collection_name, collection_id, *args, **kwargs):
+    def __init__(self, converter, pipeline, collection_name, collection_id, batch_size: int = 10,
+                 queue_size: int = 2, progress: Optional[Callable[[int, str], None]] = None, *args, **kwargs):
         self.converter = converter
         self.pipeline = pipeline
         self.collection_name = collection_name
         self.collection_id = collection_id
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.progress = progress
 
     @provide_session
     def get_pending_documents_by_collection(self, collection_id: int, session=None):
@@ -157,6 +378,61 @@ class IndexDocumentService(LoggingMixin):
             link.status = in_progress_status
 
         session.commit()
+        return len(links)
+
+    @provide_session
+    def mark_all_in_progress(self, session=None) -> Dict[int, int]:
+        """
+        Mark every document of the collection in progress, so a rebuild indexes all of them again.
+
+        :return: the previous status id of each document, for ``restore_statuses`` when the rebuild fails
+        """
+        in_progress_status = session.query(CollectionDocumentStatus).filter(
+            CollectionDocumentStatus.name == "in progress"
+        ).one_or_none()
+
+        if in_progress_status is None:
+            raise ValueError("'in progress' status not found. Please upgrade the db by command 'alembic upgrade head'.")
+
+        links = (
+            session.query(CollectionDocument)
+            .join(CollectionDocumentStatus)
+            .filter(CollectionDocument.collection_id == self.collection_id)
+            # being removed from the collection
+            .filter(CollectionDocumentStatus.name != "removing")
+            .all()
+        )
+        statuses = {link.document_id: link.status_id for link in links}
+        for link in links:
+            link.status = in_progress_status
+
+        session.commit()
+        return statuses
+
+    @provide_session
+    def restore_statuses(self, statuses: Dict[int, int], session=None):
+        """
+        Put back the statuses saved by ``mark_all_in_progress`` after a failed rebuild: documents that were new,
+        or linked during the rebuild, are new again since the live collection does not hold them.
+        """
+        new_status = session.query(CollectionDocumentStatus).filter(
+            CollectionDocumentStatus.name == "new"
+        ).one_or_none()
+
+        if new_status is None:
+            raise ValueError("'new' status not found. Please upgrade the db by command 'alembic upgrade head'.")
+
+        links = (
+            session.query(CollectionDocument)
+            .join(CollectionDocumentStatus)
+            .filter(CollectionDocument.collection_id == self.collection_id)
+            .filter(CollectionDocumentStatus.name != "removing")
+            .all()
+        )
+        for link in links:
+            link.status_id = statuses.get(link.document_id, new_status.id)
+
+        session.commit()
 
     @provide_session
     def mark_done(self, documents, session=None):
@@ -171,8 +447,11 @@ class IndexDocumentService(LoggingMixin):
 
         links = (
             session.query(CollectionDocument)
+            .join(CollectionDocumentStatus)
             .filter(CollectionDocument.collection_id == self.collection_id)
             .filter(CollectionDocument.document_id.in_(document_ids))
+            # removed from the collection while being indexed, unlinked once their chunks are deleted
+            .filter(CollectionDocumentStatus.name != "removing")
             .all()
         )
 
@@ -181,50 +460,144 @@ class IndexDocumentService(LoggingMixin):
 
         session.commit()
 
-    def convert(self, doc):
-        return self.converter.convert(doc.path)
+    @provide_session
+    def mark_failed(self, documents, session=None):
+        failed_status = session.query(CollectionDocumentStatus).filter(
+            CollectionDocumentStatus.name == "failed"
+        ).one_or_none()
+
+        if failed_status is None:
+            raise ValueError("'failed' status not found. Please upgrade the db by command 'alembic upgrade head'.")
+
+        document_ids = [doc.id for doc in documents]
+
+        links = (
+            session.query(CollectionDocument)
+            .join(CollectionDocumentStatus)
+            .filter(CollectionDocument.collection_id == self.collection_id)
+            .filter(CollectionDocument.document_id.in_(document_ids))
+            # removed from the collection while being indexed, unlinked once their chunks are deleted
+            .filter(CollectionDocumentStatus.name != "removing")
+            .all()
+        )
+
+        for link in links:
+            link.status = failed_status
+
+        session.commit()
 
     @provide_session
-    def index(self, session=None):
-        self.log.info("Start indexing documents...")
+    def pending_document_ids(self, session=None) -> List[int]:
+        """Mark the new documents in progress; returns the ids of every in-progress document, new or resumed."""
         self.mark_in_progress(session)
-        doc_entities = self.get_documents(session)
-        while doc_entities:
-            converted_docs = []
-            metadata_list = []
+        return [doc.id for doc in self.get_documents(limit=None, session=session) or []]
 
-            for doc in doc_entities:
-                converted_content = self.convert(doc)
-                converted_docs.append(converted_content)
+    def convert(self, doc):
+        return self.converter.convert(doc.path)
 
-                file_path = Path(doc.path)
-                metadata = {
-                    "doc_id": str(doc.id),
-                    "document_name": file_path.name,
-                    "modified_date": datetime.fromtimestamp(
-                        file_path.stat().st_mtime).isoformat() if file_path.exists() else datetime.now().isoformat(),
-                    "file_path": doc.path,
-                    "created_at": str(doc.created_at) if hasattr(doc, 'created_at') else "",
-                }
-                metadata_list.append(metadata)
+    def read(self, doc_entities):
+        converted_docs = []
+        metadata_list = []
+
+        for doc in doc_entities:
+            converted_content = self.convert(doc)
+            converted_docs.append(converted_content)
+
+            file_path = Path(doc.path)
+            metadata = {
+                "doc_id": str(doc.id),
+                "document_name": file_path.name,
+                "modified_date": datetime.fromtimestamp(
+                    file_path.stat().st_mtime).isoformat() if file_path.exists() else datetime.now().isoformat(),
+                "file_path": doc.path,
+                "created_at": str(doc.created_at) if hasattr(doc, 'created_at') else "",
+            }
+            metadata_list.append(metadata)
+        return doc_entities, converted_docs, metadata_list
+
+    def update_status(self, doc_entities, failed):
+        # no session passed: this runs on a pipeline thread and opens its own
+        if failed:
+            self.mark_failed([doc for i, doc in enumerate(doc_entities) if i in failed])
+        self.mark_done([doc for i, doc in enumerate(doc_entities) if i not in failed])
 
-            self.pipeline.run(converted_docs, metadata_list)
-            self.mark_done(doc_entities, session)
-            doc_entities = self.get_documents(session)
+    @provide_session
+    def index(self, document_ids: Optional[List[int]] = None, session=None):
+        """
+        :param document_ids: index only these in-progress documents, a shard of a collection fanned out by the
+            caller which already marked them in progress; all the pending documents when None
+        """
+        self.log.info("Start indexing documents...")
+        if document_ids is None:
+            marked = self.mark_in_progress(session)
+            # documents still in progress were in flight when an earlier run stopped; their chunks already written
+            # are found unchanged by the diff, so only the missing ones are embedded and written again
+            doc_entities = self.get_documents(limit=None, session=session) or []
+            if len(doc_entities) > marked:
+                self.log.info(f"Resuming {len(doc_entities) - marked} documents left in progress by an interrupted run")
+        else:
+            doc_entities = self.get_documents(limit=None, document_ids=document_ids, session=session) or []
+        # detached so the pipeline threads can read them without sharing this session
+        for doc in doc_entities:
+            session.expunge(doc)
+        batches = [doc_entities[i:i + self.batch_size] for i in range(0, len(doc_entities), self.batch_size)]
+
+        def chunk(item):
+            docs, converted_docs, metadata_list = item
+            return docs, self.pipeline.plan(self.pipeline.chunk(converted_docs, metadata_list))
+
+        def embed(item):
+            docs, batch = item
+            return docs, self.pipeline.embed(batch)
+
+        def store(item):
+            docs, batch = item
+            return docs, self.pipeline.store(batch)
+
+        staged = []
+
+        def update_status(item):
+            docs, batch = item
+            if self.pipeline.deferred:
+                # not searchable before the bulk import, marked once it completes
+                staged.append((docs, set(batch.failed)))
+                if self.progress is not None:
+                    self.progress(0, f"staged {len(staged)}/{len(batches)} batches")
+            else:
+                self.update_status(docs, set(batch.failed))
+
+        # read -> chunk -> embed -> insert -> status, each stage overlapping the others on consecutive batches
+        StagedPipeline(
+            source=(self.read(batch) for batch in batches),
+            stages=[("chunk", chunk), ("embed", embed), ("insert", store), ("status", update_status)],
+            queue_size=self.queue_size,
+        ).run()
+
+        if self.pipeline.deferred:
+            try:
+                self.pipeline.finish(self.progress)
+            except Exception:
+                self.mark_failed([doc for docs, _ in staged for doc in docs])
+                raise
+            for docs, failed in staged:
+                self.update_status(docs, failed)
         self.log.info("Finish indexing documents...")
 
     @provide_session
-    def get_documents(self, session=None):
-        documents = (
+    def get_documents(self, limit: Optional[int] = 10, document_ids: Optional[List[int]] = None, session=None):
+        query = (
             session.query(Document)
             .join(CollectionDocument, CollectionDocument.document_id == Document.id)
             .join(CollectionDocumentStatus, CollectionDocument.status_id == CollectionDocumentStatus.id)
             .filter(CollectionDocument.collection_id == self.collection_id)
             .filter(CollectionDocumentStatus.name == "in progress")
             .options(joinedload(Document.status))
-            .limit(10)
-            .all()
         )
+        if document_ids is not None:
+            query = query.filter(Document.id.in_(document_ids))
+        if limit is not None:
+            query = query.limit(limit)
+        documents = query.all()
 
         return documents if documents else None
 
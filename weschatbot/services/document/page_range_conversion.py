@@ -0,0 +1,196 @@
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Optional, Sequence, Tuple
+
+from weschatbot.log.logging_mixin import LoggingMixin
+
+HEADING_PATTERN = re.compile(r'^(#{1,6})(\s+\S.*)$')
+TABLE_SEPARATOR_PATTERN = re.compile(r'^\|?\s*:?-{3,}:?\s*(\|\s*:?-{3,}:?\s*)*\|?$')
+
+
+def page_count(document_path: str) -> int:
+    import pypdfium2
+
+    pdf = pypdfium2.PdfDocument(document_path)
+    try:
+        return len(pdf)
+    finally:
+        pdf.close()
+
+
+def available_memory_mb() -> Optional[int]:
+    """Memory available to new processes, None when the platform does not tell."""
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") // (1024 * 1024)
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def page_ranges(count: int, pages_per_range: int) -> List[Tuple[int, int]]:
+    """``[start, stop)`` page ranges covering ``count`` pages."""
+    return [(start, min(start + pages_per_range, count)) for start in range(0, count, pages_per_range)]
+
+
+def _table_columns(line: str) -> int:
+    return line.strip().strip('|').count('|') + 1
+
+
+def _is_table_line(line: str) -> bool:
+    return line.lstrip().startswith('|')
+
+
+def _join_tables(previous: List[str], lines: List[str]) -> Tuple[List[str], bool]:
+    """
+    Continue a table cut at a range boundary.
+
+    When ``previous`` ends inside a table and ``lines`` opens with a table of the same width, the tables are
+    joined: a repeated header is dropped, a different one is a data row Marker promoted to header, so only the
+    separator is dropped. Trailing blank lines of ``previous`` are removed in place.
+    """
+    end = len(previous)
+    while end and not previous[end - 1].strip():
+        end -= 1
+    start = end
+    while start and _is_table_line(previous[start - 1]):
+        start -= 1
+    first = next((i for i, line in enumerate(lines) if line.strip()), None)
+
+    if start == end or first is None or first + 1 >= len(lines) or not _is_table_line(lines[first]) \
+            or not TABLE_SEPARATOR_PATTERN.match(lines[first + 1].strip()) \
+            or _table_columns(lines[first]) != _table_columns(previous[end - 1]):
+        return lines, False
+
+    del previous[end:]
+    if lines[first].strip() == previous[start].strip():
+        return lines[first + 2:], True
+    return [lines[first], *lines[first + 2:]], True
+
+
+def _normalize_headings(lines: List[str], top_level: Optional[int], previous_level: Optional[int]):
+    """
+    Marker buckets heading levels per converted range, so a continuation range can open at a different depth.
+    Headings are clamped to the document's top level and never go more than one level deeper than the
+    heading before them.
+    """
+    res = []
+    for line in lines:
+        match = HEADING_PATTERN.match(line)
+        if match is None:
+            res.append(line)
+            continue
+        level = len(match.group(1))
+        if top_level is not None:
+            level = max(level, top_level)
+        if previous_level is not None:
+            level = min(level, previous_level + 1)
+        previous_level = level
+        res.append('#' * level + match.group(2))
+    return res, previous_level
+
+
+def _heading_levels(lines: List[str]) -> List[int]:
+    return [len(m.group(1)) for m in (HEADING_PATTERN.match(line) for line in lines) if m]
+
+
+def stitch(parts: List[str]) -> str:
+    """Join the markdown of consecutive page ranges into one document."""
+    if not parts:
+        return ""
+    lines = parts[0].split('\n')
+    levels = _heading_levels(lines)
+    top_level = min(levels) if levels else None
+    previous_level = levels[-1] if levels else None
+
+    for part in parts[1:]:
+        part_lines, joined = _join_tables(lines, part.split('\n'))
+        part_lines, previous_level = _normalize_headings(part_lines, top_level, previous_level)
+        if top_level is None:
+            levels = _heading_levels(part_lines)
+            top_level = min(levels) if levels else None
+        if not joined and lines and lines[-1].strip():
+            lines.append('')
+        lines.extend(part_lines)
+    return '\n'.join(lines)
+
+
+def _init_worker(threads: int):
+    import torch
+    from weschatbot.services.document.converting import MarkerConverter
+
+    # the cores are shared between the workers, each torch would otherwise use all of them
+    torch.set_num_threads(threads)
+    MarkerConverter()
+
+
+def _convert_pages(document_path: str, pages: Sequence[int]) -> str:
+    from weschatbot.services.document.converting import MarkerConverter
+
+    return MarkerConverter().convert(document_path, page_range=pages)
+
+
+class ParallelPdfConverter(LoggingMixin):
+    """
+    Convert a large PDF as page ranges across processes, each holding its own Marker models.
+
+    Meant for CPU-only hosts where one Marker call leaves most cores idle. Every worker loads a full set of Marker
+    models, so ``workers=0`` starts only as many as fit in the available memory at ``worker_memory_mb`` each.
+    """
+
+    def __init__(self, workers: int = 1, pages_per_range: int = 25, min_pages: int = 50,
+                 worker_memory_mb: int = 4096):
+        cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+        if not workers:
+            memory = available_memory_mb()
+            workers = max(1, min(cores, memory // worker_memory_mb)) if memory is not None else 1
+        self.workers = workers
+        self.threads_per_worker = max(1, cores // self.workers)
+        self.pages_per_range = pages_per_range
+        self.min_pages = min_pages
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.threads_per_worker,),
+            )
+        return self._executor
+
+    def should_split(self, document_path: str) -> bool:
+        return self.should_split_pages(page_count(document_path))
+
+    def should_split_pages(self, pages: int) -> bool:
+        return self.workers > 1 and pages >= self.min_pages
+
+    def convert(self, document_path: str) -> str:
+        return self.convert_pages(document_path, [list(range(page_count(document_path)))])[0]
+
+    def convert_pages(self, document_path: str, groups: List[Sequence[int]]) -> List[str]:
+        """
+        Markdown of each group of pages of a document. Groups are cut into ranges of at most ``pages_per_range``
+        pages, all converted in parallel, and the ranges of each group are stitched back together.
+        """
+        ranges = [(index, group[start:stop]) for index, group in enumerate(groups)
+                  for start, stop in page_ranges(len(group), self.pages_per_range)]
+        self.log.info(f"Converting {document_path} as {len(ranges)} page ranges on {self.workers} workers")
+        executor = self._get_executor()
+        try:
+            futures = [(index, executor.submit(_convert_pages, document_path, pages)) for index, pages in ranges]
+            parts = [[] for _ in groups]
+            for index, future in futures:
+                parts[index].append(future.result())
+            return [stitch(group_parts) for group_parts in parts]
+        except BrokenProcessPool:
+            # a worker died (out of memory or crashed): the next document starts a fresh pool
+            self.shutdown()
+            raise
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,117 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Optional, Tuple
+
+from llama_index.core import Document as LlamaDocument
+
+from weschatbot.log.logging_mixin import LoggingMixin
+from weschatbot.services.document.adaptive_markdown_strategy import AdaptiveMarkdownStrategy
+
+# One strategy per worker process; built by the pool initializer so parsers are created once per process
+_worker_strategy: Optional[AdaptiveMarkdownStrategy] = None
+
+
+def _init_worker(strategy_kwargs):
+    global _worker_strategy
+    _worker_strategy = AdaptiveMarkdownStrategy(**strategy_kwargs)
+
+
+def _chunk_with(strategy, content, metadata) -> Tuple[Optional[List[LlamaDocument]], Optional[str]]:
+    try:
+        chunks = strategy.chunk_markdown(content, metadata)
+        # counted here so the tokenizer cache of the process that chunked the document is reused
+        for chunk, token_count in zip(chunks, strategy.count_tokens([chunk.text for chunk in chunks])):
+            chunk.metadata['token_count'] = token_count
+        return chunks, None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+def _chunk_in_worker(content, metadata) -> Tuple[Optional[List[LlamaDocument]], Optional[str]]:
+    return _chunk_with(_worker_strategy, content, metadata)
+
+
+def default_workers() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+class ParallelChunker(LoggingMixin):
+    """
+    Chunk independent documents across a process pool.
+
+    Results come back in document order. A document that fails to chunk yields ``None`` in its slot and
+    does not affect the others. When a worker process dies (out of memory, crash) the documents it took down
+    are chunked again on a fresh pool; those lost a second time are retried one at a time, and a document
+    that kills its worker alone is failed. Documents are never chunked in the calling process then, so a
+    document that crashes its worker cannot crash the Celery worker.
+    """
+
+    def __init__(self, workers: Optional[int] = None, strategy_kwargs: Optional[dict] = None):
+        self.workers = workers if workers else default_workers()
+        self.strategy_kwargs = strategy_kwargs or {}
+        self.strategy = AdaptiveMarkdownStrategy(**self.strategy_kwargs)
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn: the Celery worker runs threads, forking it would copy held locks into the children
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.strategy_kwargs,),
+            )
+        return self._executor
+
+    def _chunk_inline(self, content, metadata):
+        return _chunk_with(self.strategy, content, metadata)
+
+    def _chunk_on_pool(self, documents, metadata_list, indexes) -> Tuple[dict, List[int]]:
+        """:return: the outcome of each document chunked, and the documents lost with a dead worker"""
+        executor = self._get_executor()
+        futures = {i: executor.submit(_chunk_in_worker, documents[i], metadata_list[i]) for i in indexes}
+        outcomes, lost = {}, []
+        for i, future in futures.items():
+            try:
+                outcomes[i] = future.result()
+            except BrokenProcessPool:
+                lost.append(i)
+        if lost:
+            self.shutdown()
+        return outcomes, lost
+
+    def chunk(self, documents: List[str], metadata_list: List[dict]) -> List[Optional[List[LlamaDocument]]]:
+        pending = [i for i, content in enumerate(documents) if content]
+        results: List[Optional[List[LlamaDocument]]] = [[] for _ in documents]
+
+        if self.workers <= 1:
+            outcomes = {i: self._chunk_inline(documents[i], metadata_list[i]) for i in pending}
+        else:
+            outcomes, lost = self._chunk_on_pool(documents, metadata_list, pending)
+            if lost:
+                self.log.warning(f"A chunking worker died, chunking {len(lost)} documents again on a new pool")
+                retried, lost = self._chunk_on_pool(documents, metadata_list, lost)
+                outcomes.update(retried)
+            for i in lost:
+                retried, died = self._chunk_on_pool(documents, metadata_list, [i])
+                outcomes.update(retried)
+                if died:
+                    outcomes[i] = (None, "the chunking worker process died (out of memory or crashed)")
+
+        for i, (chunks, error) in outcomes.items():
+            if error is not None:
+                self.log.error(f"Failed to chunk document {metadata_list[i].get('doc_id')}: {error}")
+                results[i] = None
+            else:
+                results[i] = chunks
+        return results
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
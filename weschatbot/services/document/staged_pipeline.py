@@ -0,0 +1,146 @@
+import queue
+import threading
+import time
+from typing import Callable, Iterable, List, Optional
+
+from weschatbot.log.logging_mixin import LoggingMixin
+
+_DONE = object()
+
+
+class StageMetrics:
+    def __init__(self, name: str, input_queue: Optional[queue.Queue]):
+        self.name = name
+        self.input_queue = input_queue
+        self.items = 0
+        self.busy_seconds = 0.0
+        self.max_queue_depth = 0
+
+    @property
+    def queue_depth(self) -> int:
+        return self.input_queue.qsize() if self.input_queue is not None else 0
+
+    def observe_queue(self):
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+
+    def to_dict(self):
+        return {
+            "stage": self.name,
+            "items": self.items,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "items_per_second": round(self.items / self.busy_seconds, 3) if self.busy_seconds else None,
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+        }
+
+    def __str__(self):
+        rate = f"{self.items / self.busy_seconds:.2f}/s" if self.busy_seconds else "-"
+        return (f"{self.name}: {self.items} items, busy {self.busy_seconds:.1f}s ({rate}), "
+                f"queue {self.queue_depth} (max {self.max_queue_depth})")
+
+
+class StagedPipeline(LoggingMixin):
+    """
+    Producer/consumer stages, one thread each, connected by bounded queues.
+
+    ``source`` yields the items of the first stage; each stage turns an item into the input of the next one.
+    Bounded queues keep a fast stage from running ahead of a slow one. The first error stops every stage and
+    is raised by ``run``.
+    """
+
+    def __init__(self, source: Iterable, stages: List[tuple], queue_size: int = 2, report_interval: float = 30.0):
+        """
+        :param stages: ``(name, func)`` pairs, applied in order
+        """
+        self.source = source
+        self.stage_names = [name for name, _ in stages]
+        self.stage_funcs: List[Callable] = [func for _, func in stages]
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+        self.metrics = [StageMetrics("source", None)] + [StageMetrics(name, q)
+                                                         for name, q in zip(self.stage_names, self.queues)]
+        self.report_interval = report_interval
+        self._stop = threading.Event()
+        self._error: Optional[BaseException] = None
+
+    def _put(self, q: queue.Queue, item):
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _fail(self, e: BaseException):
+        if self._error is None:
+            self._error = e
+        self._stop.set()
+
+    def _run_source(self):
+        metrics = self.metrics[0]
+        try:
+            iterator = iter(self.source)
+            while not self._stop.is_set():
+                started = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                metrics.busy_seconds += time.perf_counter() - started
+                metrics.items += 1
+                if not self._put(self.queues[0], item):
+                    return
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            self._put(self.queues[0], _DONE)
+
+    def _run_stage(self, index: int):
+        func = self.stage_funcs[index]
+        metrics = self.metrics[index + 1]
+        input_queue = self.queues[index]
+        output_queue = self.queues[index + 1] if index + 1 < len(self.queues) else None
+        try:
+            while not self._stop.is_set():
+                metrics.observe_queue()
+                try:
+                    item = input_queue.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if item is _DONE:
+                    break
+                started = time.perf_counter()
+                result = func(item)
+                metrics.busy_seconds += time.perf_counter() - started
+                metrics.items += 1
+                if output_queue is not None and not self._put(output_queue, result):
+                    return
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            if output_queue is not None:
+                self._put(output_queue, _DONE)
+
+    def report(self):
+        for metrics in self.metrics:
+            self.log.info(f"Pipeline stage {metrics}")
+
+    def run(self):
+        threads = [threading.Thread(target=self._run_source, name="pipeline-source", daemon=True)]
+        threads.extend(threading.Thread(target=self._run_stage, args=(i,), name=f"pipeline-{name}", daemon=True)
+                       for i, name in enumerate(self.stage_names))
+        for thread in threads:
+            thread.start()
+
+        last_report = time.monotonic()
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(timeout=1.0)
+                if time.monotonic() - last_report >= self.report_interval:
+                    self.report()
+                    last_report = time.monotonic()
+        self.report()
+
+        if self._error is not None:
+            raise self._error
+        return [metrics.to_dict() for metrics in self.metrics]
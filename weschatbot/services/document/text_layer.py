@@ -0,0 +1,252 @@
+from collections import Counter
+from typing import List, Optional, Tuple
+
+from weschatbot.log.logging_mixin import LoggingMixin
+
+# replacement character of the glyphs the text layer cannot map to unicode
+INVALID_CHAR = "\ufffd"
+BOLD_WEIGHT = 600
+
+
+class TextLine:
+    def __init__(self, text: str, bbox: List[float], size: float = 0.0, bold: bool = False):
+        self.text = text
+        self.bbox = bbox
+        self.size = size
+        self.bold = bold
+
+    @property
+    def height(self):
+        return self.bbox[3] - self.bbox[1]
+
+
+class PageText:
+    def __init__(self, index: int, width: float, height: float, lines: List[TextLine], image_coverage: float = 0.0):
+        self.index = index
+        self.width = width
+        self.height = height
+        self.lines = lines
+        self.image_coverage = image_coverage
+
+    @property
+    def chars(self) -> int:
+        return sum(len(line.text.strip()) for line in self.lines)
+
+    @property
+    def invalid_ratio(self) -> float:
+        chars = self.chars
+        if not chars:
+            return 0.0
+        return sum(line.text.count(INVALID_CHAR) for line in self.lines) / chars
+
+
+def _image_coverage(page) -> float:
+    import pypdfium2.raw as pdfium_c
+
+    area = 0.0
+    for obj in page.get_objects(filter=(pdfium_c.FPDF_PAGEOBJ_IMAGE,), max_depth=2):
+        left, bottom, right, top = obj.get_pos()
+        area += max(0.0, right - left) * max(0.0, top - bottom)
+    width, height = page.get_size()
+    return min(1.0, area / (width * height)) if width and height else 0.0
+
+
+def _segment(spans) -> TextLine:
+    while not spans[-1]["text"].strip():
+        spans = spans[:-1]
+    return TextLine(
+        text="".join(span["text"] for span in spans).strip(),
+        bbox=[spans[0]["bbox"][0], min(x["bbox"][1] for x in spans), spans[-1]["bbox"][2],
+              max(x["bbox"][3] for x in spans)],
+        size=max(span["font"].get("size") or 0 for span in spans),
+        bold=all((span["font"].get("weight") or 0) >= BOLD_WEIGHT for span in spans),
+    )
+
+
+def _segments(spans) -> List[TextLine]:
+    """Split a text-layer line at wide horizontal gaps, which separate table cells."""
+    res = []
+    current = []
+    last = None
+    for span in spans:
+        if not span["text"].strip():
+            if current:
+                current.append(span)
+            continue
+        if last is not None and span["bbox"][0] - last["bbox"][2] > 1.5 * (last["bbox"][3] - last["bbox"][1]):
+            res.append(_segment(current))
+            current = []
+        current.append(span)
+        last = span
+    if current:
+        res.append(_segment(current))
+    return res
+
+
+def read_text_layer(document_path: str) -> List[PageText]:
+    """Lines of the embedded text layer of every page, with the share of each page covered by images."""
+    import pypdfium2
+    from pdftext.extraction import dictionary_output
+
+    pages = dictionary_output(document_path, sort=True, disable_links=True)
+    pdf = pypdfium2.PdfDocument(document_path)
+    try:
+        res = []
+        for index, page in enumerate(pages):
+            lines = []
+            for block in page["blocks"]:
+                for line in block["lines"]:
+                    lines.extend(_segments(line["spans"]))
+            res.append(PageText(index, page["width"], page["height"], lines, _image_coverage(pdf[index])))
+        return res
+    finally:
+        pdf.close()
+
+
+def _rows(lines: List[TextLine]) -> List[List[TextLine]]:
+    """Group lines sharing a baseline band into visual rows, top to bottom and left to right."""
+    rows: List[List[TextLine]] = []
+    for line in sorted(lines, key=lambda x: (x.bbox[1], x.bbox[0])):
+        center = (line.bbox[1] + line.bbox[3]) / 2
+        if rows:
+            top, bottom = rows[-1][0].bbox[1], rows[-1][0].bbox[3]
+            if top <= center <= bottom:
+                rows[-1].append(line)
+                continue
+        rows.append([line])
+    return [sorted(row, key=lambda x: x.bbox[0]) for row in rows]
+
+
+def _same_columns(row: List[TextLine], other: List[TextLine], tolerance: float) -> bool:
+    return len(row) == len(other) and all(abs(a.bbox[0] - b.bbox[0]) <= tolerance for a, b in zip(row, other))
+
+
+def _cell(text: str) -> str:
+    return text.replace("|", "\\|")
+
+
+class TextLayerPage:
+    """Markdown from the text layer of one born-digital page."""
+
+    # table cells are short; long aligned segments are text columns, which are left to Marker
+    max_cell_chars = 40
+    min_table_rows = 2
+
+    def __init__(self, page: PageText, body_size: float):
+        self.page = page
+        self.body_size = body_size
+
+    def _heading(self, row: List[TextLine]) -> Optional[str]:
+        line = row[0]
+        if len(row) > 1 or not self.body_size or len(line.text) > 120 or line.text.endswith('.'):
+            return None
+        ratio = line.size / self.body_size
+        if ratio >= 1.5:
+            return "#"
+        if ratio >= 1.25:
+            return "##"
+        if ratio >= 1.1 or (line.bold and len(line.text) <= 80):
+            return "###"
+        return None
+
+    def _table_end(self, rows, start, tolerance) -> int:
+        row = rows[start]
+        if len(row) < 2 or any(len(x.text) > self.max_cell_chars for x in row):
+            return start
+        end = start + 1
+        while end < len(rows) and _same_columns(row, rows[end], tolerance) \
+                and all(len(x.text) <= self.max_cell_chars for x in rows[end]):
+            end += 1
+        return end if end - start >= self.min_table_rows else start
+
+    def is_multi_column(self) -> bool:
+        rows = _rows(self.page.lines)
+        wide = [row for row in rows if len(row) > 1 and any(len(x.text) > self.max_cell_chars for x in row)]
+        return len(wide) > len(rows) // 4
+
+    def to_markdown(self) -> str:
+        rows = _rows(self.page.lines)
+        tolerance = self.body_size or 10
+        blocks: List[str] = []
+        paragraph: List[str] = []
+        previous_bottom = None
+
+        def flush():
+            if paragraph:
+                blocks.append(" ".join(paragraph))
+                paragraph.clear()
+
+        i = 0
+        while i < len(rows):
+            end = self._table_end(rows, i, tolerance)
+            if end > i:
+                flush()
+                table = [[_cell(x.text) for x in row] for row in rows[i:end]]
+                lines = ["| " + " | ".join(table[0]) + " |", "|" + " --- |" * len(table[0])]
+                lines.extend("| " + " | ".join(cells) + " |" for cells in table[1:])
+                blocks.append("\n".join(lines))
+                previous_bottom = rows[end - 1][0].bbox[3]
+                i = end
+                continue
+
+            row = rows[i]
+            heading = self._heading(row)
+            text = " ".join(x.text for x in row)
+            if heading:
+                flush()
+                blocks.append(f"{heading} {text}")
+            else:
+                gap = row[0].bbox[1] - previous_bottom if previous_bottom is not None else 0
+                if gap > row[0].height:
+                    flush()
+                if paragraph and paragraph[-1].endswith("-"):
+                    paragraph[-1] = paragraph[-1][:-1] + text
+                else:
+                    paragraph.append(text)
+            previous_bottom = row[0].bbox[3]
+            i += 1
+        flush()
+        return "\n\n".join(blocks)
+
+
+def body_font_size(pages: List[PageText]) -> float:
+    sizes = Counter()
+    for page in pages:
+        for line in page.lines:
+            sizes[round(line.size, 1)] += len(line.text)
+    return sizes.most_common(1)[0][0] if sizes else 0.0
+
+
+class TextLayerConverter(LoggingMixin):
+    """
+    Convert the born-digital pages of a PDF from its embedded text layer.
+
+    A page is born-digital when it has enough text, almost no unmapped characters, is not mostly covered by
+    images and is not laid out in text columns. The other pages are returned as page ranges for Marker.
+    """
+
+    def __init__(self, min_chars: int = 200, max_image_coverage: float = 0.5, max_invalid_ratio: float = 0.02):
+        self.min_chars = min_chars
+        self.max_image_coverage = max_image_coverage
+        self.max_invalid_ratio = max_invalid_ratio
+
+    def is_born_digital(self, page: PageText, body_size: float) -> bool:
+        return page.chars >= self.min_chars \
+            and page.image_coverage <= self.max_image_coverage \
+            and page.invalid_ratio <= self.max_invalid_ratio \
+            and not TextLayerPage(page, body_size).is_multi_column()
+
+    def plan(self, pages: List[PageText]) -> List[Tuple[str, object]]:
+        """
+        :return: consecutive parts in page order, either ``("text", markdown)`` or ``("marker", range(...))``
+        """
+        body_size = body_font_size(pages)
+        parts: List[Tuple[str, object]] = []
+        for page in pages:
+            if self.is_born_digital(page, body_size):
+                parts.append(("text", TextLayerPage(page, body_size).to_markdown()))
+            elif parts and parts[-1][0] == "marker":
+                parts[-1] = ("marker", range(parts[-1][1].start, page.index + 1))
+            else:
+                parts.append(("marker", range(page.index, page.index + 1)))
+        return parts
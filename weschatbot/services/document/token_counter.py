@@ -0,0 +1,78 @@
+import logging
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class TokenCounter:
+    """
+    Exact token counts from the embedding model's fast tokenizer.
+
+    Encodings (token ids and character offsets) are cached per text, so counting a chunk, splitting it and
+    counting its parts does not tokenize the same text twice. ``count_batch`` tokenizes all uncached texts in a
+    single tokenizer call.
+    """
+
+    def __init__(self, tokenizer, cache_size: int = 4096):
+        self.tokenizer = tokenizer
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, Tuple[List[int], List[Tuple[int, int]]]]" = OrderedDict()
+
+    @classmethod
+    def from_pretrained(cls, model_name: str, **kwargs) -> Optional["TokenCounter"]:
+        """Load the fast tokenizer of ``model_name``, or return None when it is not available."""
+        try:
+            from transformers import AutoTokenizer
+            tokenizer = AutoTokenizer.from_pretrained(model_name, use_fast=True)
+        except Exception as e:
+            logger.warning(f"Cannot load tokenizer {model_name}, falling back to estimated token counts: {e}")
+            return None
+        if not getattr(tokenizer, "is_fast", False):
+            logger.warning(f"Tokenizer {model_name} has no fast implementation, falling back to estimated counts")
+            return None
+        return cls(tokenizer, **kwargs)
+
+    def _remember(self, text, encoding):
+        self._cache[text] = encoding
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def encode_batch(self, texts: List[str]) -> List[Tuple[List[int], List[Tuple[int, int]]]]:
+        missing = list(dict.fromkeys(t for t in texts if t not in self._cache))
+        if missing:
+            encoded = self.tokenizer(missing, add_special_tokens=False, return_offsets_mapping=True)
+            for text, ids, offsets in zip(missing, encoded["input_ids"], encoded["offset_mapping"]):
+                self._remember(text, (ids, [tuple(o) for o in offsets]))
+
+        res = []
+        for text in texts:
+            encoding = self._cache.get(text)
+            if encoding is None:
+                # evicted while encoding a batch larger than the cache
+                encoding = self.encode_batch([text])[0]
+            else:
+                self._cache.move_to_end(text)
+            res.append(encoding)
+        return res
+
+    def encode(self, text: str) -> Tuple[List[int], List[Tuple[int, int]]]:
+        return self.encode_batch([text])[0]
+
+    def tokenize(self, text: str) -> List[int]:
+        return self.encode(text)[0]
+
+    def count(self, text: str) -> int:
+        return len(self.encode(text)[0])
+
+    def count_batch(self, texts: List[str]) -> List[int]:
+        return [len(ids) for ids, _ in self.encode_batch(texts)]
+
+    def split_points(self, text: str, max_tokens: int) -> List[int]:
+        """Character positions cutting ``text`` into pieces of at most ``max_tokens`` tokens."""
+        _, offsets = self.encode(text)
+        return [offsets[i][0] for i in range(max_tokens, len(offsets), max_tokens)]
+
+    def split(self, text: str, max_tokens: int) -> List[str]:
+        bounds = [0, *self.split_points(text, max_tokens), len(text)]
+        return [text[a:b] for a, b in zip(bounds, bounds[1:]) if text[a:b].strip()]
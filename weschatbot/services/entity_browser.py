@@ -0,0 +1,111 @@
+import base64
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from pymilvus import MilvusException
+
+from weschatbot.log.logging_mixin import LoggingMixin
+from weschatbot.services.milvus_handles import MilvusHandleManager
+
+
+class Base64URL:
+    @staticmethod
+    def decode(data):
+        missing_padding = len(data) % 4
+        if missing_padding:
+            data += '=' * (4 - missing_padding)
+        return base64.urlsafe_b64decode(data).decode('utf-8')
+
+    @staticmethod
+    def encode(data):
+        return base64.urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+
+def browse_fields(schema) -> List[str]:
+    """Every field of ``schema`` except vectors, which entity lists never show."""
+    return [field.name for field in schema.fields if "VECTOR" not in field.dtype.name]
+
+
+def encode_token(last_row_id: int, limit: int, collection_name: str) -> str:
+    return Base64URL.encode(f"{last_row_id}:{limit}:{collection_name}")
+
+
+def decode_token(token: str) -> Tuple[int, int, str]:
+    last_row_id, limit, *collection_names = Base64URL.decode(token).split(':')
+    return int(last_row_id), int(limit), ":".join(collection_names)
+
+
+class EntityBrowser(LoggingMixin):
+    """
+    Page through the entities of a collection in primary key order with Milvus query iterators.
+
+    A page token holds the last row id of the page, so any process can resume from it with a ``row_id >`` filter.
+    The iterator behind a token is also kept open for ``iterator_ttl`` seconds, so following the next token in
+    the same process continues it instead of starting a new query.
+    """
+
+    def __init__(self, handles: Optional[MilvusHandleManager] = None, max_iterators: int = 32,
+                 iterator_ttl: float = 300.0):
+        self.handles = handles or MilvusHandleManager()
+        self.max_iterators = max_iterators
+        self.iterator_ttl = iterator_ttl
+        self._lock = threading.Lock()
+        self._iterators: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def _take(self, token: str):
+        """Pop the open iterator of ``token``, closing the expired ones."""
+        now = time.monotonic()
+        with self._lock:
+            for key, (iterator, used_at) in list(self._iterators.items()):
+                if now - used_at > self.iterator_ttl:
+                    del self._iterators[key]
+                    iterator.close()
+            entry = self._iterators.pop(token, None)
+        return entry[0] if entry else None
+
+    def _keep(self, token: str, iterator):
+        with self._lock:
+            self._iterators[token] = (iterator, time.monotonic())
+            while len(self._iterators) > self.max_iterators:
+                _, (oldest, _) = self._iterators.popitem(last=False)
+                oldest.close()
+
+    def page(self, collection_name: str, after_row_id: int = -1, limit: int = 20,
+             output_fields: Optional[List[str]] = None, token: Optional[str] = None) -> Tuple[list, Optional[str]]:
+        """
+        :param after_row_id: the page starts after this row id
+        :param output_fields: defaults to every non-vector field
+        :param token: the token the page was requested with, to continue its open iterator
+        :return: the rows and the token of the next page, None on the last page
+        """
+        rows = None
+        iterator = self._take(token) if token else None
+        if iterator is not None:
+            try:
+                rows = iterator.next()
+            except MilvusException as e:
+                self.log.info(f"Open iterator of collection '{collection_name}' failed, starting a new one: {e}")
+                iterator.close()
+                iterator = None
+        if iterator is None:
+            collection = self.handles.collection(collection_name)
+            if output_fields is None:
+                output_fields = browse_fields(collection.schema)
+            iterator = collection.query_iterator(batch_size=limit, expr=f"row_id > {int(after_row_id)}",
+                                                 output_fields=output_fields)
+            rows = iterator.next()
+
+        if len(rows) < limit:
+            iterator.close()
+            return rows, None
+        next_token = encode_token(rows[-1]["row_id"], limit, collection_name)
+        self._keep(next_token, iterator)
+        return rows, next_token
+
+    def close(self):
+        with self._lock:
+            while self._iterators:
+                _, (iterator, _) = self._iterators.popitem()
+                iterator.close()
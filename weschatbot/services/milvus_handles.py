@@ -0,0 +1,144 @@
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+from pymilvus import Collection, MilvusException, connections, utility
+from pymilvus.exceptions import CollectionNotExistException
+from pymilvus.client.types import LoadState
+
+from weschatbot.exceptions.collection_exception import CollectionNotFoundException
+from weschatbot.log.logging_mixin import LoggingMixin
+from weschatbot.utils.common import SingletonMeta
+from weschatbot.utils.config import config
+
+
+# server error codes of a query on a collection that was dropped, recreated or released: not found, not loaded
+# and not fully loaded
+STALE_HANDLE_CODES = {100, 101, 103}
+
+
+def is_stale_handle_error(e: MilvusException) -> bool:
+    """Whether a failed query may succeed on a fresh handle, as opposed to a bad expression or an outage."""
+    message = str(e.message if hasattr(e, "message") else e).lower()
+    return isinstance(e, CollectionNotExistException) or e.code in STALE_HANDLE_CODES \
+        or "collection not found" in message or "not loaded" in message
+
+
+@dataclass
+class CollectionHandle:
+    collection: Collection
+    # collection_id changes when a collection is dropped and created again under the same name
+    collection_id: int
+    loaded: bool = False
+    checked_at: float = 0.0
+
+
+class MilvusHandleManager(LoggingMixin, metaclass=SingletonMeta):
+    """
+    Process-wide cache of Milvus connections per alias and of ``Collection`` handles with their load state.
+
+    A cached handle is checked against Milvus again after ``revalidate_seconds``: a dropped or recreated
+    collection gets a new handle and a released collection is loaded again. Code dropping or creating
+    collections in this process calls ``invalidate`` so the change is seen immediately.
+    """
+
+    def __init__(self, revalidate_seconds: Optional[float] = None):
+        if revalidate_seconds is None:
+            revalidate_seconds = config.getfloat("milvus", "handle_revalidate_seconds", fallback=30)
+        self.revalidate_seconds = revalidate_seconds
+        self._lock = threading.RLock()
+        self._connections: Dict[str, dict] = {}
+        self._handles: Dict[Tuple[str, str], CollectionHandle] = {}
+
+    def connect(self, alias: str = "default", **kwargs) -> str:
+        """Open the connection of ``alias`` unless it is already open with the same arguments."""
+        with self._lock:
+            if self._connections.get(alias) != kwargs or not connections.has_connection(alias):
+                if alias in self._connections:
+                    self.disconnect(alias)
+                connections.connect(alias=alias, **kwargs)
+                self._connections[alias] = kwargs
+        return alias
+
+    def disconnect(self, alias: str = "default"):
+        with self._lock:
+            self.invalidate(alias=alias)
+            self._connections.pop(alias, None)
+            if connections.has_connection(alias):
+                connections.disconnect(alias)
+
+    def _identity(self, collection: Collection) -> int:
+        return collection.describe().get("collection_id", 0)
+
+    def _is_loaded(self, name: str, alias: str) -> bool:
+        return utility.load_state(name, using=alias) == LoadState.Loaded
+
+    def _revalidate(self, key: Tuple[str, str], handle: CollectionHandle) -> Optional[CollectionHandle]:
+        name, alias = key[1], key[0]
+        try:
+            collection_id = self._identity(handle.collection)
+        except MilvusException:
+            collection_id = None
+        if collection_id != handle.collection_id:
+            self.log.info(f"Collection '{name}' was dropped or recreated, refreshing its handle")
+            del self._handles[key]
+            return None
+        if handle.loaded and not self._is_loaded(name, alias):
+            handle.loaded = False
+        handle.checked_at = time.monotonic()
+        return handle
+
+    def collection(self, name: str, alias: str = "default", load: bool = True) -> Collection:
+        """
+        :param load: load the collection into memory if it is not loaded yet, as needed to query it
+        :raise CollectionNotFoundException: the collection does not exist
+        """
+        key = (alias, name)
+        with self._lock:
+            handle = self._handles.get(key)
+            if handle is not None and time.monotonic() - handle.checked_at >= self.revalidate_seconds:
+                handle = self._revalidate(key, handle)
+            if handle is None:
+                if not utility.has_collection(name, using=alias):
+                    raise CollectionNotFoundException(f"Collection {name} is not found")
+                collection = Collection(name, using=alias)
+                handle = CollectionHandle(collection, self._identity(collection), checked_at=time.monotonic())
+                self._handles[key] = handle
+        # loaded outside the lock, so a slow load does not hold up the handles of other collections; loading a
+        # collection twice at once is harmless
+        if load and not handle.loaded:
+            if not self._is_loaded(name, alias):
+                handle.collection.load()
+            handle.loaded = True
+        return handle.collection
+
+    def query(self, name: str, alias: str = "default", **kwargs):
+        """
+        ``Collection.query`` on the cached handle, retried once on a fresh handle when the collection was dropped,
+        recreated or released meanwhile.
+        """
+        try:
+            return self.collection(name, alias).query(**kwargs)
+        except MilvusException as e:
+            if not is_stale_handle_error(e):
+                raise
+            self.log.info(f"Query on collection '{name}' failed, retrying with a fresh handle: {e}")
+            self.invalidate(name, alias)
+            return self.collection(name, alias).query(**kwargs)
+
+    def invalidate(self, name: Optional[str] = None, alias: Optional[str] = None):
+        """Forget the cached handle of ``name``, or of every collection, on ``alias`` or on every alias."""
+        with self._lock:
+            for key in list(self._handles):
+                if (alias is None or key[0] == alias) and (name is None or key[1] == name):
+                    del self._handles[key]
+
+    def drop_collection(self, name: str, alias: str = "default") -> bool:
+        """Drop a collection and its cached handle; returns False when it does not exist."""
+        with self._lock:
+            self.invalidate(name, alias)
+            if not utility.has_collection(name, using=alias):
+                return False
+            utility.drop_collection(name, using=alias)
+            return True
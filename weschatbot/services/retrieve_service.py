@@ -11,6 +11,7 @@ from weschatbot.services.vllm_embedding_service import VLLMEmbeddingService
 class Retriever(LoggingMixin):
     def __init__(self, config: RetrievalConfig):
         self.config = config
+        # rebuilt collections are served through an alias of this name, resolved by Milvus on every search
         self.collection = Collection(config.collection_name)
         self.collection.load()
 
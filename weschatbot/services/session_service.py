@@ -1,11 +1,13 @@
-import pickle
+from redis.exceptions import RedisError
 
 from weschatbot.exceptions.user_exceptions import UserNotFoundError
 from weschatbot.log.logging_mixin import LoggingMixin
-from weschatbot.models.user import ChatSession, ChatMessage, User
-from weschatbot.schemas.chat import Chat
+from weschatbot.models.user import ChatSession, ChatMessage, ChatTurn, User
+from weschatbot.schemas.chat import Chat, Message
+from weschatbot.services.chat_history import ChatHistory
+from weschatbot.services.chat_writer import ChatTurnWriter
+from weschatbot.utils.config import config
 from weschatbot.utils.db import provide_session
-from weschatbot.utils.redis_config import provide_redis, DB_CHAT
 
 
 class NotPermissionError(Exception):
@@ -13,23 +15,23 @@ class NotPermissionError(Exception):
 
 
 class SessionService(LoggingMixin):
-    KEY_FMT = 'ss_{chat_id}'
-    REDIS_DB = DB_CHAT
+    def __init__(self):
+        self.history = ChatHistory(loader=self.load_messages)
+        self.writer = ChatTurnWriter()
 
-    @provide_redis(REDIS_DB)
-    def store_chat(self, chat, redis_client):
-        redis_client.set(self.KEY_FMT.format(chat_id=chat.chat_id), pickle.dumps(chat.messages))
+    def store_chat(self, chat):
+        self.history.replace(chat.chat_id, chat.messages)
 
-    @provide_redis(REDIS_DB)
-    def get_chat(self, chat_id, redis_client):
-        messages = pickle.loads(redis_client.get(self.KEY_FMT.format(chat_id=chat_id)))
-        return Chat(messages=messages, chat_id=chat_id)
+    def get_chat(self, chat_id, last=None):
+        """:param last: only read the last ``last`` messages of the chat"""
+        return Chat(messages=self.history.tail(chat_id, last), chat_id=chat_id)
 
     def create_session(self):
         import uuid
         chat_id = str(uuid.uuid4())
+        # the history list is created by the first appended turn, until then the chat is known to be empty
+        self.history.create(chat_id)
         chat = Chat([], chat_id)
-        self.store_chat(chat)
         return chat_id, chat
 
     def get_session(self, chat_id):
@@ -37,46 +39,45 @@ class SessionService(LoggingMixin):
         return chat
 
     @provide_session
-    def add_session_in_db(self, user_id, chat_id, messages, session=None):
-
-        inserted_message_ids = []
-
-        def add_messages(db_chat_id):
-            for message in messages:
-                new_message = ChatMessage(
-                    name=message.message[0:31],
-                    content=message.message,
-                    sender=message.sender,
-                    chat_id=db_chat_id
-                )
-                session.add(new_message)
-                session.flush()
-                inserted_message_ids.append((new_message.id, message.sender))
-
-        chat = session.query(ChatSession).filter(ChatSession.uuid == chat_id).first()
-        if chat:
-            add_messages(chat.id)
-        else:
-            new_chat = ChatSession(
-                name=messages[0].message[0:31],
-                uuid=chat_id,
-                user_id=user_id,
-                status_id=1
-            )
-            session.add(new_chat)
-            session.commit()
-            session.refresh(new_chat)
-
-            add_messages(new_chat.id)
-
-        return inserted_message_ids
+    def load_messages(self, chat_id, session=None):
+        """Messages of a chat as written to the database, for chats no longer held in Redis."""
+        # turns are written in any order: messages follow the submission of their turn, those written before
+        # turns were recorded (no turn) come first
+        rows = (
+            session.query(ChatMessage.sender, ChatMessage.content)
+            .join(ChatSession, ChatMessage.chat_id == ChatSession.id)
+            .outerjoin(ChatTurn, ChatMessage.turn_id == ChatTurn.id)
+            .filter(ChatSession.uuid == chat_id)
+            .order_by(ChatTurn.submitted_at.is_not(None), ChatTurn.submitted_at, ChatMessage.id)
+            .all()
+        )
+        return [Message(sender=sender, receiver="bot" if sender == "user" else "user", message=content)
+                for sender, content in rows]
+
+    def get_history_window(self, chat_id, max_messages=None, max_tokens=None):
+        """
+        The trailing messages of a chat to send to the model, at most ``[chat_history] window_messages`` of them
+        and ``window_tokens`` tokens long, read from the end of the history without loading the rest.
+        """
+        if max_messages is None:
+            max_messages = config.getint("chat_history", "window_messages", fallback=3)
+        if max_tokens is None:
+            max_tokens = config.getint("chat_history", "window_tokens", fallback=1024)
+        messages = self.history.window(chat_id, max_messages=max_messages, max_tokens=max_tokens)
+        return Chat(messages=messages, chat_id=chat_id)
 
-    def update_session(self, user_id, chat_id, messages):
-        chat = self.get_chat(chat_id)
-        chat.messages = chat.messages + messages
-        inserted_message_ids = self.add_session_in_db(user_id, chat_id, messages)
-        self.store_chat(chat)
-        return inserted_message_ids
+    def update_session(self, user_id, chat_id, messages, query_results=()):
+        """
+        Append a turn to a chat. Its messages, and the query results of its question, are written to the database
+        in the background; returns the id of the turn, see ``ChatTurnWriter.message_ids``.
+        """
+        # queued first: the writer falls back to writing the turn itself when Redis is down
+        turn_id = self.writer.submit(user_id, chat_id, messages, query_results)
+        try:
+            self.history.append(chat_id, messages)
+        except RedisError as e:
+            self.log.warning(f"Could not append turn {turn_id} to the history of chat {chat_id}: {e}")
+        return turn_id
 
     @provide_session
     def delete_session(self, user_id, chat_id, session=None):
@@ -89,6 +90,7 @@ class SessionService(LoggingMixin):
                 chat_session.user_id = deleted_user.id
             else:
                 raise UserNotFoundError("User: anonymous not found")
+            self.history.delete(chat_id)
         else:
             raise NotPermissionError("This session doesn't belong to you")
 
@@ -100,6 +102,40 @@ class SessionService(LoggingMixin):
         res = query_sessions(session)
         return [x.to_dict(session=session) for x in res]
 
+    @provide_session
+    def get_session_index(self, user_id, before_id=None, limit=None, session=None):
+        """
+        A page of the active chats of a user for the sidebar, newest first, with their id, uuid, name and
+        modified_date only. Pass the returned cursor as ``before_id`` to read the next page; it is None on the last.
+        """
+        if limit is None:
+            limit = config.getint("chat_history", "session_page_size", fallback=50)
+        query = (
+            session.query(ChatSession.id, ChatSession.uuid, ChatSession.name, ChatSession.modified_date)
+            .filter(ChatSession.user_id == user_id)
+            .filter(ChatSession.status_id == 1)
+        )
+        if before_id is not None:
+            query = query.filter(ChatSession.id < before_id)
+        rows = query.order_by(ChatSession.id.desc()).limit(limit + 1).all()
+        items = [{
+            "id": row.id,
+            "uuid": row.uuid,
+            "name": row.name,
+            "modified_date": row.modified_date.strftime("%Y-%m-%d %H:%M:%S"),
+        } for row in rows[:limit]]
+        return items, items[-1]["id"] if len(rows) > limit else None
+
+    @provide_session
+    def can_open_session(self, user_id, chat_id, session=None):
+        """Whether a user may open a chat: one of their active chats, or one not written to the database yet."""
+        chat = (
+            session.query(ChatSession.user_id, ChatSession.status_id)
+            .filter(ChatSession.uuid == chat_id)
+            .one_or_none()
+        )
+        return chat is None or (chat.user_id == user_id and chat.status_id == 1)
+
     @provide_session
     def delete_chat_session_by_id(self, chat_id, session=None):
         chat = session.query(ChatSession).get(chat_id)
@@ -107,5 +143,7 @@ class SessionService(LoggingMixin):
             return False
 
         session.query(ChatMessage).filter(ChatMessage.chat_id == chat_id).delete()
+        session.query(ChatTurn).filter(ChatTurn.chat_id == chat_id).delete()
         session.delete(chat)
+        self.history.delete(chat.uuid)
         return True
@@ -31,6 +31,14 @@ class CeleryWorker(LoggingMixin, metaclass=SingletonMeta):
                 worker_concurrency=int(config["celery"]["worker_concurrency"])
             )
 
+        if "visibility_timeout" in config["celery"]:
+            # the Redis broker delivers unacknowledged tasks again after this delay, even while they still run
+            visibility_timeout = int(config["celery"]["visibility_timeout"])
+            self.celery.conf.update(
+                broker_transport_options={"visibility_timeout": visibility_timeout},
+                result_backend_transport_options={"visibility_timeout": visibility_timeout}
+            )
+
         if "task_queues" in config["celery"]:
             queues = [Queue(q.strip()) for q in config["celery"]["task_queues"].split(",")]
             self.celery.conf.task_queues = queues
@@ -1,11 +1,14 @@
 import json
 import logging
-from time import sleep
+from time import monotonic, sleep
 
 from weschatbot.models.job import Job, JobStatus
 from weschatbot.utils.common import get_function_by_fullname
+from weschatbot.utils.config import config
 from weschatbot.utils.db import provide_session
 
+REFRESH_STATS_TASK = "weschatbot.services.celery_service.refresh_collection_stats"
+
 
 @provide_session
 def execute_job_runs(session=None):
@@ -26,6 +29,12 @@ def execute_job_runs(session=None):
 
 @provide_session
 def schedule(session=None):
+    stats_interval = config.getint("collection_stats", "refresh_interval", fallback=60)
+    last_stats_refresh = None
     while True:
         execute_job_runs()
+        if stats_interval and (last_stats_refresh is None or monotonic() - last_stats_refresh >= stats_interval):
+            # behind a long indexing run on the index queue, a refresh is dropped once the next one is queued
+            get_function_by_fullname(REFRESH_STATS_TASK).apply_async(expires=stats_interval)
+            last_stats_refresh = monotonic()
         sleep(10)
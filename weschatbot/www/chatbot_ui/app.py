@@ -73,6 +73,7 @@ vllm_client = VLLMService(
 )
 
 session_service = SessionService()
+
 user_service = BcryptUserService()
 token_service = TokenService()
 
@@ -96,6 +97,16 @@ else:
     )
 
 
+@app.on_event("startup")
+def start_chat_writer():
+    session_service.writer.start()
+
+
+@app.on_event("shutdown")
+def stop_chat_writer():
+    session_service.writer.stop()
+
+
 @app.middleware("http")
 async def catch_exceptions_middleware(request: Request, call_next):
     try:
@@ -205,12 +216,9 @@ async def new_chat(payload: dict = Depends(jwt_manager.required)):
 @app.get("/chats/{chat_id}")
 async def get_chat(request: Request, chat_id: str, payload: dict = Depends(jwt_manager.required)):
     user_id = int(payload.get("sub"))
-    all_sessions = session_service.get_sessions(user_id)
-    valid_sessions = [x["uuid"] for x in all_sessions]
-    if chat_id not in valid_sessions:
-        chat = session_service.get_session(chat_id)
-        if not chat or chat.in_db:
-            return RedirectResponse(app.url_path_for("new_chat"), 302)
+    if not session_service.can_open_session(user_id, chat_id):
+        return RedirectResponse(app.url_path_for("new_chat"), 302)
+    sessions, next_before_id = session_service.get_session_index(user_id)
     chat = session_service.get_session(chat_id)
     model = chat.to_dict()
 
@@ -219,12 +227,19 @@ async def get_chat(request: Request, chat_id: str, payload: dict = Depends(jwt_m
         {
             "model": json.dumps(model),
             "request": request,
-            "sessions": json.dumps(all_sessions),
+            "sessions": json.dumps({"sessions": sessions, "next_before_id": next_before_id}),
             "username": payload["username"],
         }
     )
 
 
+@app.get("/sessions")
+async def get_sessions(before_id: int | None = None, payload: dict = Depends(jwt_manager.required)):
+    user_id = int(payload.get("sub"))
+    sessions, next_before_id = session_service.get_session_index(user_id, before_id=before_id)
+    return {"sessions": sessions, "next_before_id": next_before_id}
+
+
 @app.delete("/chats/{chat_id}")
 async def delete_chat(chat_id: str, payload: dict = Depends(jwt_manager.required)):
     user_id = int(payload.get("sub"))
@@ -286,7 +301,7 @@ async def websocket_endpoint(websocket: WebSocket,
                 question = json.loads(data)["message"]
                 chat_id = json.loads(data)["chat_id"]
 
-                chat = session_service.get_session(chat_id)
+                chat = session_service.get_history_window(chat_id)
                 conversation_history = get_conversation_history_from_chat(chat)
 
                 answer = "Error: Could not get answer from chatbot."
@@ -304,16 +319,10 @@ async def websocket_endpoint(websocket: WebSocket,
                         Message(sender="bot", receiver="user", message=answer),
                     ]
 
-                    inserted_message_id = [x[0] for x in filter(lambda x: x[1] == "user",
-                                                                session_service.update_session(user_id, chat_id,
-                                                                                               messages))]
-                    if len(inserted_message_id) > 0:
-                        message_id = inserted_message_id[-1]
-                        collection_id = chatbot_configuration.collection_id
-                        retrieved_docs = list(map(lambda x: make_query_result(*x, collection_id=collection_id),
-                                                  enumerate(result["retrieved_docs"])))
-                        query_service.add_query_result_for_message(list_query_results=retrieved_docs,
-                                                                   message_id=message_id)
+                    collection_id = chatbot_configuration.collection_id
+                    retrieved_docs = list(map(lambda x: make_query_result(*x, collection_id=collection_id),
+                                              enumerate(result["retrieved_docs"])))
+                    session_service.update_session(user_id, chat_id, messages, query_results=retrieved_docs)
 
                 except Exception as e:
                     answer = "An error occurred. Please try again!"
@@ -1,21 +1,17 @@
-import hashlib
 import json
 import logging
 import os
-import tempfile
-import uuid
 from datetime import datetime
 from functools import reduce, wraps
-from typing import Optional
 
 from flask import Blueprint, request, abort, render_template, redirect, flash
 from flask_login import current_user
-from werkzeug.datastructures import FileStorage
 
 from weschatbot.log.logging_mixin import LoggingMixin
 from weschatbot.services.rbac_service import RBACService
 from weschatbot.utils.config import config
 from weschatbot.utils.db import provide_session
+from weschatbot.www.management.uploads import UploadError, save_upload_file, secure_filename
 from weschatbot.www.management.utils import get_auto_field_types, is_relationship, relationship_class, \
     relationship_data, outside_url_for
 
@@ -28,77 +24,6 @@ def permissions_by_user(user_id, session=None):
     return res
 
 
-class UploadError(Exception):
-    pass
-
-
-def save_upload_file(
-        upload_file: FileStorage,
-        dest_folder: str,
-        *,
-        max_size: int = config.getint("core", "upload_max_file_size"),
-        chunk_size: int = 64 * 1024
-) -> str:
-    if not upload_file or not getattr(upload_file, "filename", None):
-        raise UploadError("No file provided")
-
-    filename = secure_filename(upload_file.filename)
-    if not filename:
-        raise UploadError("Invalid filename")
-
-    content_length = getattr(upload_file, "content_length", None)
-    if content_length is not None and content_length > max_size:
-        raise UploadError("Content-Length exceeds limit")
-
-    tmp_path: Optional[str] = None
-    try:
-        tmp = tempfile.NamedTemporaryFile(delete=False)
-        tmp_path = tmp.name
-        total = 0
-
-        while True:
-            chunk = upload_file.stream.read(chunk_size)
-            if not chunk:
-                break
-            total += len(chunk)
-            if total > max_size:
-                tmp.close()
-                os.unlink(tmp_path)
-                raise UploadError("File size exceeds limit")
-            tmp.write(chunk)
-
-        tmp.flush()
-        tmp.close()
-
-        os.makedirs(dest_folder, exist_ok=True)
-        dest_path = os.path.join(dest_folder, filename)
-
-        if os.path.exists(dest_path):
-            base, ext = os.path.splitext(filename)
-            counter = 1
-            while True:
-                new_name = f"{base}_{counter}{ext}"
-                new_path = os.path.join(dest_folder, new_name)
-                if not os.path.exists(new_path):
-                    dest_path = new_path
-                    break
-                counter += 1
-
-        os.replace(tmp_path, dest_path)
-        tmp_path = None
-        return dest_path
-
-    except UploadError:
-        raise
-    except Exception as exc:
-        if tmp_path and os.path.exists(tmp_path):
-            try:
-                os.unlink(tmp_path)
-            except Exception:
-                pass
-        raise UploadError("Internal error while saving file") from exc
-
-
 def check_permission(permission):
     def check_func(func):
         @wraps(func)
@@ -124,14 +49,6 @@ def check_permission(permission):
     return check_func
 
 
-def secure_filename(file_name):
-    ext = file_name.rsplit(".")[-1:][0]
-    std_file_name = "_".join(file_name.rsplit(".")[:-1]).replace(" ", "_")
-    hash_part = hashlib.sha256(
-        bytes(f"{std_file_name}.{uuid.uuid4().hex}", "UTF-8")).hexdigest()
-    return f"{std_file_name}.{hash_part}.{ext}"
-
-
 class Field:
     def __init__(self, name, _type):
         self.name = name
@@ -546,9 +463,19 @@ class ViewModel(LoggingMixin):
         return render_template(self.list_template, model=json.dumps(res.to_dict(), default=str),
                                title=f"List of {self.model_class.__name__}"), 200
 
+    def on_files_uploaded(self, kwargs, uploads, session=None):
+        """
+        Called before a new item is created from uploaded files.
+
+        :param kwargs: the fields of the new item, can be changed
+        :param uploads: sha256 of the uploaded content by field name
+        """
+        pass
+
     @provide_session
     def add_item_post(self, callback=lambda item: None, session=None):
         kwargs = {}
+        uploads = {}
 
         for field in self.add_fields:
             kwargs[field] = request.form.get(field, None)
@@ -572,8 +499,8 @@ class ViewModel(LoggingMixin):
                     if field in request.files and request.files[field].filename:
                         try:
                             file = request.files[field]
-                            upload_file_path = save_upload_file(upload_file=file,
-                                                                dest_folder=config.get("core", "upload_file_folder"))
+                            upload_file_path, uploads[field] = save_upload_file(
+                                upload_file=file, dest_folder=config.get("core", "upload_file_folder"))
                             res = UpdateValue(upload_file_path)
                         except UploadError as e:
                             flash(f"{e}", "danger")
@@ -584,6 +511,8 @@ class ViewModel(LoggingMixin):
                     res = NoUpdate()
             if res.is_updated():
                 kwargs[field] = res.value
+        if uploads:
+            self.on_files_uploaded(kwargs, uploads, session=session)
         item = self.model_class(**kwargs)
         session.add(item)
         session.commit()
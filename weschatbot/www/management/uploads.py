@@ -0,0 +1,95 @@
+import hashlib
+import os
+import tempfile
+import uuid
+from typing import Optional, Tuple
+
+from werkzeug.datastructures import FileStorage
+
+from weschatbot.utils.config import config
+
+
+class UploadError(Exception):
+    pass
+
+
+def save_upload_file(
+        upload_file: FileStorage,
+        dest_folder: str,
+        *,
+        max_size: int = config.getint("core", "upload_max_file_size"),
+        chunk_size: int = 64 * 1024
+) -> Tuple[str, str]:
+    """
+    Stream an upload to ``dest_folder``.
+
+    :return: the saved path and the sha256 of the content, hashed while streaming
+    """
+    if not upload_file or not getattr(upload_file, "filename", None):
+        raise UploadError("No file provided")
+
+    filename = secure_filename(upload_file.filename)
+    if not filename:
+        raise UploadError("Invalid filename")
+
+    content_length = getattr(upload_file, "content_length", None)
+    if content_length is not None and content_length > max_size:
+        raise UploadError("Content-Length exceeds limit")
+
+    tmp_path: Optional[str] = None
+    try:
+        tmp = tempfile.NamedTemporaryFile(delete=False)
+        tmp_path = tmp.name
+        total = 0
+        digest = hashlib.sha256()
+
+        while True:
+            chunk = upload_file.stream.read(chunk_size)
+            if not chunk:
+                break
+            total += len(chunk)
+            if total > max_size:
+                tmp.close()
+                os.unlink(tmp_path)
+                raise UploadError("File size exceeds limit")
+            tmp.write(chunk)
+            digest.update(chunk)
+
+        tmp.flush()
+        tmp.close()
+
+        os.makedirs(dest_folder, exist_ok=True)
+        dest_path = os.path.join(dest_folder, filename)
+
+        if os.path.exists(dest_path):
+            base, ext = os.path.splitext(filename)
+            counter = 1
+            while True:
+                new_name = f"{base}_{counter}{ext}"
+                new_path = os.path.join(dest_folder, new_name)
+                if not os.path.exists(new_path):
+                    dest_path = new_path
+                    break
+                counter += 1
+
+        os.replace(tmp_path, dest_path)
+        tmp_path = None
+        return dest_path, digest.hexdigest()
+
+    except UploadError:
+        raise
+    except Exception as exc:
+        if tmp_path and os.path.exists(tmp_path):
+            try:
+                os.unlink(tmp_path)
+            except Exception:
+                pass
+        raise UploadError("Internal error while saving file") from exc
+
+
+def secure_filename(file_name):
+    ext = file_name.rsplit(".")[-1:][0]
+    std_file_name = "_".join(file_name.rsplit(".")[:-1]).replace(" ", "_")
+    hash_part = hashlib.sha256(
+        bytes(f"{std_file_name}.{uuid.uuid4().hex}", "UTF-8")).hexdigest()
+    return f"{std_file_name}.{hash_part}.{ext}"
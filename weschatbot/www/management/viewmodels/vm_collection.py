@@ -2,6 +2,7 @@ import json
 
 from flask import request, redirect, render_template, flash, jsonify
 
+from weschatbot.exceptions.collection_exception import NoPreviousGenerationException
 from weschatbot.log.logging_mixin import LoggingMixin
 from weschatbot.models.user import Collection
 from weschatbot.services.collection_service import CollectionService
@@ -106,6 +107,21 @@ class ViewModelCollection(ViewModel, LoggingMixin):
         except Exception as e:
             return jsonify({"status": "error", "message": str(e)}), 500
 
+    @provide_session
+    def remove_documents_from_collection(self, session=None):
+        """Bulk removal: ``document_ids`` is repeated or comma separated."""
+        try:
+            collection_id = int(request.form.get("collection_id"))
+            document_ids = [int(x) for value in request.form.getlist("document_ids")
+                            for x in value.split(",") if x.strip()]
+            removed = self.collection_service.remove_documents_from_collection(collection_id=collection_id,
+                                                                               document_ids=document_ids,
+                                                                               session=session)
+            return jsonify({"status": "success", "removed": removed}), 200
+        except Exception as e:
+            self.log.error(e)
+            return jsonify({"status": "error", "message": str(e)}), 500
+
     @provide_session
     def index_collection(self, session):
         try:
@@ -115,6 +131,38 @@ class ViewModelCollection(ViewModel, LoggingMixin):
         except Exception as e:
             return jsonify({"status": "error", "message": str(e)}), 500
 
+    @provide_session
+    def bulk_load_collection(self, session=None):
+        try:
+            collection_id = int(request.form.get("collection_id"))
+            job_id = self.collection_service.bulk_load_collection(collection_id=collection_id, session=session)
+            return jsonify({"status": "success", "job_id": job_id}), 200
+        except Exception as e:
+            self.log.error(e)
+            return jsonify({"status": "error", "message": str(e)}), 500
+
+    @provide_session
+    def rebuild_collection(self, session=None):
+        try:
+            collection_id = int(request.form.get("collection_id"))
+            job_id = self.collection_service.rebuild_collection(collection_id=collection_id, session=session)
+            return jsonify({"status": "success", "job_id": job_id}), 200
+        except Exception as e:
+            self.log.error(e)
+            return jsonify({"status": "error", "message": str(e)}), 500
+
+    @provide_session
+    def rollback_collection(self, session=None):
+        try:
+            collection_id = int(request.form.get("collection_id"))
+            generation = self.collection_service.rollback_collection(collection_id=collection_id, session=session)
+            return jsonify({"status": "success", "generation": generation}), 200
+        except NoPreviousGenerationException as e:
+            return jsonify({"status": "failed", "message": str(e)}), 400
+        except Exception as e:
+            self.log.error(e)
+            return jsonify({"status": "error", "message": str(e)}), 500
+
     @provide_session
     def check_collection_indexing(self, session=None):
         try:
@@ -138,6 +186,16 @@ class ViewModelCollection(ViewModel, LoggingMixin):
             self.log.error(e)
             return jsonify({"status": "error", "message": str(e)}), 500
 
+    @provide_session
+    def collection_token_report(self, session=None):
+        try:
+            collection_id = int(request.args.get("collection_id"))
+            report = self.collection_service.token_length_report(collection_id=collection_id, session=session)
+            return jsonify({"status": "success", "data": report.to_dict()}), 200
+        except Exception as e:
+            self.log.error(e)
+            return jsonify({"status": "error", "message": str(e)}), 500
+
     @provide_session
     def flush(self, session=None):
         try:
@@ -176,6 +234,26 @@ class ViewModelCollection(ViewModel, LoggingMixin):
             self.log.error(e)
             return jsonify({"status": "error", "message": str(e)}), 500
 
+    @provide_session
+    def collection_entity(self, session=None):
+        try:
+            collection_id = int(request.args.get("collection_id"))
+            row_id = int(request.args.get("row_id"))
+            collection = self.collection_service.get_collection(collection_id=collection_id, session=session)
+            entities, _ = self.collection_service.get_entity_by_row_id(collection.collection_name, row_id,
+                                                                       with_vectors=True)
+            if not entities:
+                return jsonify({"status": "error", "message": f"Entity {row_id} is not found"}), 404
+            entity = dict(entities[0])
+            # row ids do not fit in a JavaScript number
+            entity["row_id"] = str(entity["row_id"])
+            if "embedding" in entity:
+                entity["embedding"] = [float(x) for x in entity["embedding"]]
+            return jsonify({"status": "success", "data": entity}), 200
+        except Exception as e:
+            self.log.error(e)
+            return jsonify({"status": "error", "message": str(e)}), 500
+
     @provide_session
     def delete_entities(self, session=None):
         try:
@@ -193,11 +271,18 @@ class ViewModelCollection(ViewModel, LoggingMixin):
         self.bp.route("/add_document_to_collection", methods=["POST"])(self.auth(self.add_document_to_collection))
         self.bp.route("/remove_document_from_collection", methods=["POST"])(
             self.auth(self.remove_document_from_collection))
+        self.bp.route("/remove_documents_from_collection", methods=["POST"])(
+            self.auth(self.remove_documents_from_collection))
         self.bp.route("/get_documents_by_collection_id", methods=["GET"])(
             self.auth(self.get_documents_by_collection_id))
         self.bp.route("/index_collection", methods=["POST"])(self.auth(self.index_collection))
+        self.bp.route("/bulk_load_collection", methods=["POST"])(self.auth(self.bulk_load_collection))
+        self.bp.route("/rebuild_collection", methods=["POST"])(self.auth(self.rebuild_collection))
+        self.bp.route("/rollback_collection", methods=["POST"])(self.auth(self.rollback_collection))
         self.bp.route("/flush_collection", methods=["GET"])(self.auth(self.flush))
         self.bp.route("/collection_entities", methods=["GET"])(self.auth(self.collection_entities))
+        self.bp.route("/collection_entity", methods=["GET"])(self.auth(self.collection_entity))
+        self.bp.route("/collection_token_report", methods=["GET"])(self.auth(self.collection_token_report))
         self.bp.route("/check_collection_indexing", methods=["GET"])(self.auth(self.check_collection_indexing))
         self.bp.route("/available_documents", methods=["GET"])(self.auth(self.available_documents))
         self.bp.route("/delete_entities", methods=["POST"])(self.auth(self.delete_entities))
@@ -1,7 +1,8 @@
 import json
 
-from weschatbot.models.user import Document
+from weschatbot.models.user import Document, DocumentStatus
 from weschatbot.services.celery_service import convert_document
+from weschatbot.services.document.conversion_cache import ConversionCache
 from weschatbot.utils.config import config
 from weschatbot.utils.db import provide_session
 from weschatbot.www.management.model_vm import ViewModel
@@ -11,7 +12,9 @@ from weschatbot.www.management.utils import outside_url_for
 
 
 def convert_document_callback(document):
-    convert_document.delay(document)
+    # a duplicate upload already has its converted markdown
+    if document["status"] == "new":
+        convert_document.delay(document)
 
 
 class ViewModelDocument(ViewModel):
@@ -29,6 +32,19 @@ class ViewModelDocument(ViewModel):
         "Converted document": outside_url_for(".get_converted_document")
     }
 
+    @provide_session
+    def on_files_uploaded(self, kwargs, uploads, session=None):
+        content_hash = uploads.get("path")
+        if content_hash is None:
+            return
+        kwargs["content_hash"] = content_hash
+
+        # every upload keeps its own file, chunks are stored per file path: only the converted markdown is shared
+        converted_path = ConversionCache().get(content_hash)
+        if converted_path is not None:
+            kwargs["converted_path"] = converted_path
+            kwargs["status"] = session.query(DocumentStatus).filter(DocumentStatus.name == "done").one_or_none()
+
     @provide_session
     def add_item_post(self, session=None):
         return super().add_item_post(callback=convert_document_callback, session=session)
@@ -2,8 +2,8 @@ from weschatbot.www.management.model_vm import ViewModel
 
 
 class ViewModelJob(ViewModel):
-    list_fields = ["id", "name", "class_name", "status"]
+    list_fields = ["id", "name", "class_name", "status", "progress"]
     update_fields = ["class_name", "status", "params"]
     add_fields = ["name", "class_name", "params", "status"]
-    detail_fields = ["name", "class_name", "params"]
+    detail_fields = ["name", "class_name", "params", "progress", "detail"]
     search_fields = ["name", "class_name", "params", "status"]
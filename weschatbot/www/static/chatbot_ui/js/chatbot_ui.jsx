@@ -367,7 +367,25 @@ function ChatFrame({chat_id, history_messages, userName}) {
 }
 
 
-function Sidebar({sessions}) {
+function Sidebar({sessions: firstPage}) {
+    const [sessions, setSessions] = useState(firstPage.sessions)
+    const [nextBeforeId, setNextBeforeId] = useState(firstPage.next_before_id)
+
+    const loadMoreSessions = () => {
+        fetch(`/sessions?before_id=${nextBeforeId}`)
+            .then((res) => {
+                if (!res.ok) throw new Error("Error")
+                return res.json()
+            })
+            .then((page) => {
+                setSessions((current) => [...current, ...page.sessions])
+                setNextBeforeId(page.next_before_id)
+            })
+            .catch((err) => {
+                alert("Error!")
+            });
+    }
+
     const deleteSession = (chat_id) => {
         if (!window.confirm("Are you sure to delete this conversation?")) return
 
@@ -439,6 +457,14 @@ function Sidebar({sessions}) {
                             </CNavItem>)
                         })
                     }
+                    {
+                        nextBeforeId !== null &&
+                        <div className="px-3 py-2">
+                            <CButton color="secondary" variant="ghost" className="w-100" onClick={loadMoreSessions}>
+                                Load more
+                            </CButton>
+                        </div>
+                    }
 
                 </CSidebarNav>
                 <CSidebarHeader className="border-top">
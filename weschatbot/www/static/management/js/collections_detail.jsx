@@ -53,9 +53,26 @@ const dataTypeMap = {
 };
 
 
-function ActionColumn({item, onDelete}) {
+function ActionColumn({item, collectionId, onDelete}) {
     const [visibleDetail, setVisibleDetail] = useState(false);
     const [visibleConfirm, setVisibleConfirm] = useState(false);
+    const [entity, setEntity] = useState(null);
+
+    useEffect(() => setEntity(null), [item["row_id"]])
+
+    // the list carries no vectors, the full entity is only fetched when its detail is opened
+    const openDetail = () => {
+        setVisibleDetail(true)
+        if (entity === null) {
+            fetch(`/management/ViewModelCollection/collection_entity?collection_id=${collectionId}&row_id=${item["row_id"]}`)
+                .then((res) => res.json())
+                .then((data) => {
+                    if (data.status === "success") {
+                        setEntity(data["data"])
+                    }
+                })
+        }
+    }
 
     return (
         <>
@@ -64,7 +81,7 @@ function ActionColumn({item, onDelete}) {
                     color="secondary"
                     variant="outline"
                     style={{height: "25px", padding: "0px", width: "25px"}}
-                    onClick={() => setVisibleDetail(true)}
+                    onClick={openDetail}
                 >
                     <CIcon icon={cilSearch} size="md"/>
                 </CButton>
@@ -87,6 +104,18 @@ function ActionColumn({item, onDelete}) {
                             {item["text"]}
                         </ReactMarkdown>
                     </p>
+                    {entity === null ? <CSpinner size="sm"/> :
+                        <>
+                            <p><strong>Document ID:</strong> {entity["doc_id"]}</p>
+                            {entity["embedding"] &&
+                                <p><strong>Embedding ({entity["embedding"].length} dims):</strong>
+                                    <pre style={{maxHeight: "150px", overflowY: "auto", whiteSpace: "pre-wrap"}}>
+                                        {entity["embedding"].map((x) => x.toFixed(4)).join(", ")}
+                                    </pre>
+                                </p>
+                            }
+                        </>
+                    }
                 </CModalBody>
                 <CModalFooter>
                     <CButton color="secondary" onClick={() => setVisibleDetail(false)}>Close</CButton>
@@ -128,11 +157,18 @@ function NotFoundMilvusOverviewPage() {
     )
 }
 
-function MilvusOverviewPage({fields, indexes, description, num_entities}) {
+function MilvusOverviewPage({fields, indexes, description, num_entities, ready_at, index_detail, stats = {}}) {
     return (
         <>
             <p><strong>Description:</strong> {description}</p>
             <p><strong>Number of entities:</strong> {num_entities}</p>
+            {stats.num_segments != null &&
+                <p><strong>Loaded segments:</strong> {stats.num_segments} ({(stats.memory_size / 1048576).toFixed(1)} MB)</p>}
+            {stats.total_rows != null &&
+                <p><strong>Indexed rows:</strong> {stats.indexed_rows}/{stats.total_rows}</p>}
+            {stats.updated_at && <p><strong>Statistics updated:</strong> {stats.updated_at}</p>}
+            <p><strong>Query-ready since:</strong> {ready_at || "not ready"}</p>
+            {index_detail && <p><strong>Index:</strong> {index_detail}</p>}
 
             <CCard className="mb-4">
                 <CCardHeader>Schema Fields</CCardHeader>
@@ -322,7 +358,8 @@ function MilvusEntitiesPage({collectionId}) {
                                     {entities.map((item, index) => (
                                         <CTableRow key={index}>
                                             <CTableDataCell style={{width: "5%"}}>
-                                                <ActionColumn item={item} onDelete={deleteItem(collectionId)}/>
+                                                <ActionColumn item={item} collectionId={collectionId}
+                                                              onDelete={deleteItem(collectionId)}/>
                                             </CTableDataCell>
                                             <CTableDataCell style={{width: "15%"}}><span
                                                 style={{fontSize: "0.9rem"}}>{item["row_id"]}</span></CTableDataCell>
@@ -542,7 +579,10 @@ function ListDocuments({documentsList, handleRemoveDocument}) {
 
 function CollectionInfoPage({data}) {
     const [activeTab, setActiveTab] = useState("documents")
-    const {collection_id, collection_name, description, num_entities, fields, indexes, status, documents = []} = data
+    const {
+        collection_id, collection_name, description, num_entities, fields, indexes, status, ready_at, index_detail,
+        stats, documents = []
+    } = data
     const [documentsList, setDocumentsList] = useState(documents)
     const [refreshFlag, setRefreshFlag] = useState(0)
     const [isIndexing, setIsIndexing] = useState(status === "running")
@@ -672,6 +712,38 @@ function CollectionInfoPage({data}) {
             })
     }
 
+    function postCollectionTask(action, onSuccess) {
+        const formData = new FormData()
+        formData.append("collection_id", collection_id)
+
+        fetch("/management/ViewModelCollection/" + action, {
+            method: "POST",
+            body: formData,
+            headers: {
+                "X-CSRFToken": csrf_token,
+            },
+        })
+            .then((res) => res.json())
+            .then((data) => {
+                if (data.status === "success") {
+                    onSuccess(data)
+                } else {
+                    alert("Failed: " + data.message)
+                }
+            })
+            .catch((err) => {
+                alert("Error: " + err)
+            })
+    }
+
+    function handleRebuildCollection() {
+        postCollectionTask("rebuild_collection", (data) => alert("Rebuild queued as job " + data.job_id))
+    }
+
+    function handleRollbackCollection() {
+        postCollectionTask("rollback_collection", (data) => alert("Generation " + data.generation + " is live again"))
+    }
+
     function pollCollectionStatus() {
 
         const interval = setInterval(() => {
@@ -727,7 +799,8 @@ function CollectionInfoPage({data}) {
                         <NotFoundMilvusOverviewPage></NotFoundMilvusOverviewPage>
                         ||
                         <MilvusOverviewPage description={description} indexes={indexes} fields={fields}
-                                            num_entities={num_entities}></MilvusOverviewPage>
+                                            num_entities={num_entities} ready_at={ready_at}
+                                            index_detail={index_detail} stats={stats}></MilvusOverviewPage>
                     }
                 </CTabPane>
 
@@ -762,6 +835,21 @@ function CollectionInfoPage({data}) {
                                 </CCardBody>
                             </CCard>
                             <br/>
+                            <CCard>
+                                <CCardHeader>Rebuild</CCardHeader>
+                                <CCardBody>
+                                    <p>Index every document into a new generation of this collection while the
+                                        current one keeps serving, then switch to it. Roll back switches to the
+                                        previous generation.</p>
+                                    <button className="btn btn-success me-2" onClick={handleRebuildCollection}>
+                                        Rebuild
+                                    </button>
+                                    <button className="btn btn-outline-secondary" onClick={handleRollbackCollection}>
+                                        Roll back
+                                    </button>
+                                </CCardBody>
+                            </CCard>
+                            <br/>
                             <CCard>
                                 <CCardHeader>Flushing</CCardHeader>
                                 <CCardBody>